@@ -0,0 +1,28 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build the API key index bundled with the authentication function from a key
+list with one ``key principal_id [role,role]`` line per key.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+import argh
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'authentication'))
+
+from key_index import KeyIndex, build_index, read_key_list  # noqa: E402
+
+
+@argh.dispatch_command
+@argh.arg('key_list', help='file with one "key principal_id [role,role]" line per key', type=str)
+@argh.arg('index', help='index file to write', type=str)
+@argh.arg('-f', '--false-positive-rate', help='Bloom filter false positive rate', default=0.01, type=float)
+def build_key_index(key_list, index, false_positive_rate=0.01):
+    count = build_index(read_key_list(key_list), index, false_positive_rate)
+    key_index = KeyIndex(index)
+    print('{0} keys, {1} bytes, {2} Bloom hashes -> {3}'.format(count, len(key_index.map), key_index.hashes,
+                                                                index))
@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build the deployment zips from the prepared workspace (see
+includes/init_workspace.yml): one slim zip per function and one layer zip
+shared by all of them.
+
+* Only modules a handler can import are packaged, found by following the
+  import statements from ``lambda_function.py`` (imports inside functions
+  included), plus the modules kombu loads by name.
+* Modules are byte-compiled here, with the Python of the Lambda runtime, and
+  shipped as ``.pyc`` only. Tests, package metadata, caches and the
+  ``requirements.txt`` are left out.
+* ``utils`` and the installed dependencies go into the layer, under
+  ``python/`` where the runtime looks for them, instead of into every zip.
+* Data files are bundled as they are: the ones with a known suffix and every
+  file the ``config.py`` of the function names in a ``*_FILE`` setting. The
+  build fails if a configured file is not in the workspace.
+
+The sizes of every artifact are printed, unpacked and zipped, and every
+function zip is test imported together with the layer, without the local
+site-packages.
+
+"""
+from __future__ import print_function
+
+import ast
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from distutils import sysconfig
+from modulefinder import ModuleFinder
+
+import argh
+
+LAYER_NAME = 'shared-layer'
+"aws_name of the layer, the zip is <environ>-shared-layer.zip"
+
+LAYER_PREFIX = 'python/'
+"Directory of a layer on the path of the Python runtimes."
+
+SHARED_PACKAGES = frozenset(['utils'])
+"Top level packages of this repository shared by the functions, installed dependencies are shared too."
+
+DYNAMIC_IMPORTS = {
+    'kombu': ['kombu.transport.pyamqp'],
+}
+"Modules imported by name at runtime, so the import statements do not show them, per top level package."
+
+DATA_SUFFIXES = ('.json', '.idx', '.pem')
+"Files next to a handler which are bundled as they are, i.e. the rules and the API key index."
+
+CONFIG_FILE_SUFFIX = '_FILE'
+"Settings of a config.py naming a data file the handler reads, i.e. JWT_PUBLIC_KEY_FILE."
+
+STDLIB = sysconfig.get_python_lib(standard_lib=True)
+STDLIB_PATH = [STDLIB, os.path.join(STDLIB, 'lib-dynload')]
+
+EXTENSION_SUFFIXES = ('.so', '.pyd')
+"Compiled extension modules, i.e. of pycrypto, bundled as they are."
+
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+"Fixed date of the compiled entries, so an unchanged build gives the same zip."
+
+
+class BuildError(Exception):
+    """ Raised if a function cannot be packaged as configured. """
+    pass
+
+
+def configured_files(workspace):
+    """
+    Return the data files named by the ``*_FILE`` settings of the
+    ``config.py`` of a workspace, read without importing it. Empty settings
+    and absolute paths, which are not read from the zip, are left out.
+
+    :return: dict of setting name to the file name relative to the workspace
+    """
+    config_file = os.path.join(workspace, 'config.py')
+    if not os.path.isfile(config_file):
+        return {}
+    with open(config_file) as config:
+        tree = ast.parse(config.read(), config_file)
+    files = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Str) and node.value.s:
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id.endswith(CONFIG_FILE_SUFFIX) and \
+                        not os.path.isabs(node.value.s):
+                    files[target.id] = os.path.normpath(node.value.s)
+    return files
+
+
+def data_files(workspace):
+    """
+    Return the data files of a function, see :py:data:`DATA_SUFFIXES` and
+    :py:func:`configured_files`.
+
+    :return: sorted list of file names relative to the workspace
+    :raises: BuildError if a configured file would not be packaged
+    """
+    names = set(entry for entry in os.listdir(workspace)
+                if entry.endswith(DATA_SUFFIXES) and os.path.isfile(os.path.join(workspace, entry)))
+    for setting, name in sorted(configured_files(workspace).items()):
+        if name.startswith(os.pardir) or not os.path.isfile(os.path.join(workspace, name)):
+            raise BuildError('{0} = {1!r} of {2} is not in the workspace'.format(setting, name, workspace))
+        names.add(name)
+    return sorted(names)
+
+
+def installed_packages(workspace):
+    """ Return the top level names installed into a workspace by pip. """
+    names = set()
+    for entry in os.listdir(workspace):
+        top_level = os.path.join(workspace, entry, 'top_level.txt')
+        if entry.endswith(('.dist-info', '.egg-info')) and os.path.isfile(top_level):
+            with open(top_level) as top_level_file:
+                names.update(line.strip() for line in top_level_file if line.strip())
+    return names
+
+
+def is_test(name):
+    return any(part == 'tests' or part.startswith('test_') for part in name.split('.'))
+
+
+def find_modules(workspace):
+    """
+    Follow the imports of the handler within the workspace.
+
+    :return: dict of module name to its source file in the workspace
+    """
+    finder = ModuleFinder(path=[workspace] + STDLIB_PATH)
+    finder.load_file(os.path.join(workspace, 'lambda_function.py'))
+    for package, modules in DYNAMIC_IMPORTS.items():
+        if package in finder.modules:
+            for name in modules:
+                finder.import_hook(name)
+
+    prefix = os.path.abspath(workspace) + os.sep
+    found = {}
+    for name, module in finder.modules.items():
+        path = module.__file__ and os.path.abspath(module.__file__)
+        packaged = path and path.startswith(prefix) and path.endswith(('.py',) + EXTENSION_SUFFIXES)
+        if packaged and not is_test(name):
+            found[name] = path
+    return found
+
+
+class Artifact(object):
+    """ A zip being built, with the unpacked size of its entries. """
+
+    def __init__(self, file_name, prefix=''):
+        self.file_name = file_name
+        self.prefix = prefix
+        self.zip = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
+        self.files = 0
+        self.unpacked = 0
+
+    def add(self, archive_name, data, date_time=ZIP_DATE, mode=0o644):
+        info = zipfile.ZipInfo(self.prefix + archive_name, date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = mode << 16
+        self.zip.writestr(info, data)
+        self.files += 1
+        self.unpacked += len(data)
+
+    def add_module(self, archive_name, source_file, keep_source=False):
+        """ Add the compiled module, and its source with the date the compiled one expects. """
+        if archive_name.endswith(EXTENSION_SUFFIXES):
+            with open(source_file, 'rb') as extension:
+                self.add(archive_name, extension.read(), mode=0o755)
+            return
+        handle, compiled_file = tempfile.mkstemp(suffix='.pyc')
+        os.close(handle)
+        try:
+            py_compile.compile(source_file, compiled_file, dfile=archive_name, doraise=True)
+            with open(compiled_file, 'rb') as compiled:
+                self.add(archive_name + 'c', compiled.read())
+        finally:
+            os.remove(compiled_file)
+        if keep_source:
+            with open(source_file, 'rb') as source:
+                # the runtime unpacks in UTC
+                self.add(archive_name, source.read(), time.gmtime(os.stat(source_file).st_mtime)[:6])
+
+    def close(self):
+        self.zip.close()
+        return dict(files=self.files, unpacked=self.unpacked, zipped=os.path.getsize(self.file_name))
+
+
+def build_function(workspace, file_name, layer_modules=None, keep_source=False):
+    """
+    Build the zip of one function.
+
+    :param layer_modules:
+        dict to collect the shared modules in, for the layer. Shared modules
+        are put into the function zip if None.
+
+    :return: dict of sizes
+    :raises: BuildError
+    """
+    shared = SHARED_PACKAGES | installed_packages(workspace)
+    artifact = Artifact(file_name)
+    for name, source_file in sorted(find_modules(workspace).items()):
+        archive_name = os.path.relpath(source_file, workspace).replace(os.sep, '/')
+        if layer_modules is not None and name.split('.')[0] in shared:
+            layer_modules[archive_name] = source_file
+        else:
+            artifact.add_module(archive_name, source_file, keep_source)
+    for name in data_files(workspace):
+        with open(os.path.join(workspace, name), 'rb') as data:
+            artifact.add(name.replace(os.sep, '/'), data.read())
+    return artifact.close()
+
+
+def build_layer(modules, file_name, keep_source=False):
+    artifact = Artifact(file_name, LAYER_PREFIX)
+    for archive_name, source_file in sorted(modules.items()):
+        artifact.add_module(archive_name, source_file, keep_source)
+    return artifact.close()
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def check_import(function_zip, layer_zip=None):
+    """
+    Import the handler from the unpacked zips, without site-packages, like
+    the runtime does from /var/task and /opt.
+
+    :return: error output, empty on success
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        task, opt = os.path.join(directory, 'task'), os.path.join(directory, 'opt')
+        zipfile.ZipFile(function_zip).extractall(task)
+        path = [task]
+        if layer_zip:
+            zipfile.ZipFile(layer_zip).extractall(opt)
+            path.append(os.path.join(opt, LAYER_PREFIX))
+        script = 'import sys; sys.path[:0] = {0!r}; import lambda_function'.format(path)
+        for package, modules in DYNAMIC_IMPORTS.items():
+            script += '\nif {0!r} in sys.modules:\n    import {1}'.format(package, ', '.join(modules))
+        process = subprocess.Popen([sys.executable, '-S', '-B', '-c', script], cwd=task,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        return output.decode('utf-8', 'replace').strip() if process.returncode else ''
+    finally:
+        shutil.rmtree(directory)
+
+
+@argh.arg('workspace', help='directory with a prepared workspace per function code')
+@argh.arg('build', help='directory the zips are written to')
+@argh.arg('environ', help='environment, the prefix of the zip names')
+@argh.arg('functions', help='JSON list of the functions of the playbook, with code and aws_name')
+@argh.arg('--keep-source', help='ship the sources with the compiled modules, for tracebacks with code')
+@argh.arg('--no-layer', help='put the shared modules into every function zip instead of a layer')
+@argh.arg('--no-check', help='do not test import the built zips')
+def build_package(workspace, build, environ, functions, keep_source=False, no_layer=False, no_check=False):
+    if not os.path.isdir(build):
+        os.makedirs(build)
+    layer_modules = None if no_layer else {}
+    layer_zip = None if no_layer else os.path.join(build, '{0}-{1}.zip'.format(environ, LAYER_NAME))
+
+    print('{0:>20} {1:>6} {2:>12} {3:>12} {4:>12}'.format('', 'files', 'workspace', 'unpacked', 'zipped'))
+    function_zips = []
+    for function in json.loads(functions):
+        function_workspace = os.path.join(workspace, function['code'])
+        file_name = os.path.join(build, '{0}-{1}.zip'.format(environ, function['aws_name']))
+        try:
+            sizes = build_function(function_workspace, file_name, layer_modules, keep_source)
+        except BuildError as err:
+            sys.exit('{0} cannot be built: {1}'.format(function['aws_name'], err))
+        function_zips.append((function['aws_name'], file_name))
+        print('{0:>20} {1:>6} {2:>12} {3:>12} {4:>12}'.format(
+            function['aws_name'], sizes['files'], directory_size(function_workspace), sizes['unpacked'],
+            sizes['zipped']))
+
+    if layer_zip:
+        sizes = build_layer(layer_modules, layer_zip, keep_source)
+        print('{0:>20} {1:>6} {2:>12} {3:>12} {4:>12}'.format(
+            LAYER_NAME, sizes['files'], '', sizes['unpacked'], sizes['zipped']))
+
+    if not no_check:
+        failed = []
+        for aws_name, file_name in function_zips:
+            error = check_import(file_name, layer_zip)
+            if error:
+                print('{0} does not import:\n{1}'.format(aws_name, error))
+                failed.append(aws_name)
+        if failed:
+            sys.exit('broken artifacts: {0}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    # dispatched here, deploy.py imports the build functions
+    argh.dispatch_command(build_package)
@@ -10,7 +10,32 @@ import os
 @argh.arg('-p', '--playbook', help='which playbook to run', default='playbook.yml', type=str)
 @argh.arg('-e', '--environment', help='environment to deploy to', default='dev', type=str)
 @argh.arg('-v', '--verbose', help='enable verbose output', default=False, action='store_true')
+@argh.arg('-i', '--incremental', help='build and deploy only the changed functions, without ansible',
+          default=False, action='store_true')
+@argh.arg('-j', '--jobs', help='parallel builds and uploads of --incremental, default the number of CPUs',
+          default=None, type=int)
+@argh.arg('-f', '--facts', help='JSON/YAML file with the facts for config.py, --incremental uses the '
+                                'config.py of the repository without facts or --vault', default=None, type=str)
+@argh.arg('--vault', help='read the facts from the vault of the environment', default=False, action='store_true')
+@argh.arg('--s3-dir', help='deploy into this directory instead of S3 and Lambda, for local runs', default=None,
+          type=str)
+@argh.arg('--force', help='rebuild and deploy all functions', default=False, action='store_true')
+@argh.arg('--refresh-deps', help='reinstall the requirements of the functions', default=False, action='store_true')
 def deploy(*args, **kwargs):
+    if kwargs['incremental']:
+        import incremental
+
+        variables = incremental.read_playbook(kwargs['playbook'])
+        if kwargs['s3_dir']:
+            target = incremental.LocalTarget(kwargs['s3_dir'], variables['s3_bucket'])
+        else:
+            target = incremental.AwsTarget(variables['s3_bucket'], variables['aws_region'])
+        facts = incremental.read_facts(kwargs['facts'], kwargs['environment'], kwargs['vault'])
+        incremental.deploy_incremental(kwargs['environment'], target, variables=variables, facts=facts,
+                                       jobs=kwargs['jobs'], force=kwargs['force'],
+                                       refresh_deps=kwargs['refresh_deps'])
+        return
+
     command = 'ansible-playbook %s -i hosts --extra-vars \'{\"environ\": \"%s\"}\'' % (kwargs['playbook'],
                                                                                        kwargs['environment'])
 
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental builds and deployments, used by ``deploy.py --incremental``
+instead of the playbook.
+
+Every function gets a content hash over its sources, ``utils``, the installed
+dependencies, its rendered ``config.py``, the API key list (authentication)
+and the build script. Functions whose hash is the one of the last build are
+neither rebuilt nor uploaded. Changed functions are built in a process pool,
+the uploads and deploys run in a thread pool. The shared layer is rebuilt,
+uploaded and published only if the modules it is made of changed, the
+functions are then pointed to the new layer version.
+
+State is kept in ``build/<environ>-manifest.json``: the hashes of the last
+build and of the last deployment, and the layer modules of every function, so
+the layer can be rebuilt without rebuilding unchanged functions.
+
+Dependencies are installed once per ``requirements.txt`` content into
+``build/deps/<hash>`` and linked into the workspaces, delete the directory
+(or use ``--refresh-deps``) to pick up new releases of unpinned packages.
+
+"""
+from __future__ import print_function
+
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import build_package
+from build_package import LAYER_NAME
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, os.pardir))
+PLAYBOOK = os.path.join(HERE, 'playbook.yml')
+CONFIG_TEMPLATE = os.path.join(HERE, 'templates', 'config.py.j2')
+
+SHARED_DIRS = ('utils',)
+"Directories of the repository copied into every workspace."
+
+IGNORED_SUFFIXES = ('.pyc', '.pyo', '.zip')
+IGNORED_DIRS = frozenset(['__pycache__', '.git'])
+
+KEY_INDEX_FILE = 'api_keys.idx'
+
+VAR_PATTERN = re.compile(r'^    (\w+):\s*(\S.*?)\s*$')
+
+
+def read_playbook(playbook=PLAYBOOK):
+    """
+    Read the vars of the playbook, the ``functions`` list included.
+
+    Without PyYAML only the plain one line vars and the ``functions`` flow
+    mappings are read, templated values are left out.
+    """
+    with open(playbook) as playbook_file:
+        text = playbook_file.read()
+    try:
+        import yaml
+    except ImportError:
+        section = text.split('vars:', 1)[1].split('tasks:', 1)[0]
+        variables = {}
+        for line in section.splitlines():
+            match = VAR_PATTERN.match(line)
+            if match and '{{' not in match.group(2) and not match.group(2).startswith('#'):
+                variables[match.group(1)] = match.group(2).strip("'\"")
+        variables['functions'] = [
+            dict((key.strip(), value.strip().strip("'\"")) for key, _, value in
+                 (field.partition(':') for field in entry.split(',')))
+            for entry in re.findall(r'-\s*\{([^}]*)\}', section)]
+        return variables
+    return yaml.safe_load(text)[0]['vars']
+
+
+def load_facts(text):
+    """
+    Read facts from JSON or YAML, either a plain mapping or the tasks of a
+    ``configs/set_<environ>_facts.yml`` file, whose ``set_fact`` are merged.
+    """
+    try:
+        loaded = json.loads(text)
+    except ValueError:
+        import yaml
+        loaded = yaml.safe_load(text)
+    if isinstance(loaded, list):
+        facts = {}
+        for task in loaded:
+            facts.update(task.get('set_fact') or {})
+        return facts
+    return loaded or {}
+
+
+def read_facts(facts_file=None, environ=None, vault=False):
+    """
+    :param facts_file: JSON or YAML file with the facts
+    :param vault: decrypt ``configs/set_<environ>_facts.yml`` with ansible-vault
+    :return: dict of facts, None to use the ``config.py`` of the repository
+    """
+    if facts_file:
+        with open(facts_file) as facts:
+            return load_facts(facts.read())
+    if vault:
+        path = os.path.join(HERE, 'configs', 'set_{0}_facts.yml'.format(environ))
+        return load_facts(subprocess.check_output(['ansible-vault', 'view', path]))
+    return None
+
+
+def render_config(function, variables, facts):
+    """
+    Render ``config.py`` like the playbook does. Without facts the
+    ``config.py`` of the function in the repository is used, for local runs.
+    """
+    if facts is None:
+        with open(os.path.join(ROOT, function['code'], 'config.py'), 'rb') as config:
+            return config.read()
+    import jinja2
+
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.dirname(CONFIG_TEMPLATE)),
+                                     undefined=jinja2.StrictUndefined, keep_trailing_newline=True)
+    context = dict(variables, **facts)
+    context['item'] = function
+    return environment.get_template(os.path.basename(CONFIG_TEMPLATE)).render(context).encode('utf-8')
+
+
+def tree_files(path):
+    """ :return: sorted paths relative to *path* of the files a build uses """
+    found = []
+    for directory, names, files in os.walk(path):
+        names[:] = sorted(name for name in names if name not in IGNORED_DIRS)
+        for name in files:
+            if not name.endswith(IGNORED_SUFFIXES):
+                found.append(os.path.relpath(os.path.join(directory, name), path))
+    return sorted(found)
+
+
+def hash_tree(digest, path, exclude=()):
+    for name in tree_files(path):
+        if name in exclude:
+            continue
+        digest.update(name.replace(os.sep, '/').encode('utf-8') + b'\0')
+        with open(os.path.join(path, name), 'rb') as source:
+            digest.update(hashlib.sha256(source.read()).digest())
+
+
+def requirements_hash(function):
+    requirements = os.path.join(ROOT, function['code'], 'requirements.txt')
+    if not os.path.isfile(requirements):
+        return None
+    with open(requirements, 'rb') as requirements_file:
+        return hashlib.sha256(requirements_file.read()).hexdigest()[:16]
+
+
+def install_dependencies(function, cache, refresh=False):
+    """
+    Install the requirements of a function into the cache, once per content
+    of the ``requirements.txt``.
+
+    :return: directory with the installed packages, None without requirements
+    """
+    digest = requirements_hash(function)
+    if digest is None:
+        return None
+    target = os.path.join(cache, digest)
+    if refresh and os.path.isdir(target):
+        shutil.rmtree(target)
+    if not os.path.isdir(target):
+        partial = target + '.partial'
+        if os.path.isdir(partial):
+            shutil.rmtree(partial)
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', '--quiet', '-t', partial, '-r',
+                               os.path.join(ROOT, function['code'], 'requirements.txt')])
+        os.rename(partial, target)
+    return target
+
+
+def installed_versions(dependencies):
+    """ The installed distributions by name and version, i.e. ``kombu-4.6.11.dist-info``. """
+    if dependencies is None:
+        return []
+    return sorted(entry for entry in os.listdir(dependencies) if entry.endswith(('.dist-info', '.egg-info')))
+
+
+def function_hash(function, config, dependencies, facts):
+    """
+    Hash all inputs of the zip of a function.
+
+    :param config: content of the rendered ``config.py``
+    :param dependencies: directory of the installed requirements
+    """
+    digest = hashlib.sha256()
+    digest.update(sys.version.encode('utf-8') + b'\0')
+    with open(build_package.__file__.replace('.pyc', '.py'), 'rb') as build_script:
+        digest.update(hashlib.sha256(build_script.read()).digest())
+    hash_tree(digest, os.path.join(ROOT, function['code']), exclude=('config.py',))
+    for shared in SHARED_DIRS:
+        digest.update(shared.encode('utf-8') + b'\0')
+        hash_tree(digest, os.path.join(ROOT, shared))
+    digest.update('\n'.join(installed_versions(dependencies)).encode('utf-8') + b'\0')
+    digest.update(hashlib.sha256(config).digest())
+    if function['code'] == 'authentication' and facts and facts.get('api_keys_file'):
+        with open(os.path.join(HERE, facts['api_keys_file']), 'rb') as key_list:
+            digest.update(hashlib.sha256(key_list.read()).digest())
+    return digest.hexdigest()
+
+
+def prepare_workspace(workspace, function, config, dependencies, facts):
+    """
+    Set up the workspace of a function like includes/init_workspace.yml
+    does, the installed dependencies are linked, not copied.
+    """
+    path = os.path.join(workspace, function['code'])
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    ignore = shutil.ignore_patterns('*.pyc', '*.pyo', *IGNORED_DIRS)
+    shutil.copytree(os.path.join(ROOT, function['code']), path, ignore=ignore)
+    for shared in SHARED_DIRS:
+        shutil.copytree(os.path.join(ROOT, shared), os.path.join(path, shared), ignore=ignore)
+    if dependencies is not None:
+        for entry in os.listdir(dependencies):
+            if not os.path.exists(os.path.join(path, entry)):
+                os.symlink(os.path.join(dependencies, entry), os.path.join(path, entry))
+    with open(os.path.join(path, 'config.py'), 'wb') as config_file:
+        config_file.write(config)
+    if function['code'] == 'authentication' and facts and facts.get('api_keys_file'):
+        sys.path.insert(0, os.path.join(ROOT, 'authentication'))
+        from key_index import build_index, read_key_list
+        build_index(read_key_list(os.path.join(HERE, facts['api_keys_file'])), os.path.join(path, KEY_INDEX_FILE))
+    return path
+
+
+def build_one(job):
+    """
+    Prepare the workspace and build the zip of one function, run in the
+    process pool.
+
+    :return: tuple ``(aws_name, sizes, layer modules, seconds)``
+    """
+    workspace, zip_file, function, config, dependencies, facts, keep_source = job
+    start = time.time()
+    path = prepare_workspace(workspace, function, config, dependencies, facts)
+    layer_modules = {}
+    sizes = build_package.build_function(path, zip_file, layer_modules, keep_source)
+    return function['aws_name'], sizes, layer_modules, time.time() - start
+
+
+def layer_hash(layer_modules):
+    digest = hashlib.sha256()
+    for archive_name, source_file in sorted(layer_modules.items()):
+        digest.update(archive_name.encode('utf-8') + b'\0')
+        with open(source_file, 'rb') as source:
+            digest.update(hashlib.sha256(source.read()).digest())
+    return digest.hexdigest()
+
+
+def file_sha256(file_name):
+    with open(file_name, 'rb') as content:
+        return hashlib.sha256(content.read()).hexdigest()
+
+
+class AwsTarget(object):
+    """ Uploads to S3 and deploys with the aws CLI, credentials as configured for it. """
+
+    def __init__(self, bucket, region):
+        self.bucket = bucket
+        self.region = region
+
+    def aws(self, *args):
+        return subprocess.check_output(('aws',) + args + ('--region', self.region)).decode('utf-8').strip()
+
+    def upload(self, file_name, key):
+        self.aws('s3', 'cp', '--only-show-errors', file_name, 's3://{0}/{1}'.format(self.bucket, key))
+
+    def publish_layer(self, name, key):
+        """ :return: ARN of the new layer version """
+        return self.aws('lambda', 'publish-layer-version', '--layer-name', name,
+                        '--content', 'S3Bucket={0},S3Key={1}'.format(self.bucket, key),
+                        '--compatible-runtimes', 'python2.7', '--query', 'LayerVersionArn', '--output', 'text')
+
+    def deploy_function(self, name, key=None, layer_arn=None):
+        """ Point a function to a new zip and/or layer version. """
+        if key:
+            self.aws('lambda', 'update-function-code', '--function-name', name, '--s3-bucket', self.bucket,
+                     '--s3-key', key)
+            # a configuration update is refused while the code update is in progress
+            self.aws('lambda', 'wait', 'function-updated', '--function-name', name)
+        if layer_arn:
+            self.aws('lambda', 'update-function-configuration', '--function-name', name, '--layers', layer_arn)
+
+
+class LocalTarget(object):
+    """
+    Stand-in for S3 and Lambda in a local directory: the uploads go to
+    ``<directory>/<bucket>/``, the deployed functions and published layer
+    versions are recorded in ``<directory>/lambda.json``.
+
+    """
+    def __init__(self, directory, bucket='lambda.deploy.bucket'):
+        self.directory = directory
+        self.bucket_dir = os.path.join(directory, bucket)
+        self.state_file = os.path.join(directory, 'lambda.json')
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.bucket_dir):
+            os.makedirs(self.bucket_dir)
+
+    def state(self):
+        if not os.path.isfile(self.state_file):
+            return dict(functions={}, layers={})
+        with open(self.state_file) as state:
+            return json.load(state)
+
+    def save(self, state):
+        with open(self.state_file + '.tmp', 'w') as state_file:
+            json.dump(state, state_file, indent=2, sort_keys=True)
+        os.rename(self.state_file + '.tmp', self.state_file)
+
+    def upload(self, file_name, key):
+        shutil.copyfile(file_name, os.path.join(self.bucket_dir, key + '.tmp'))
+        os.rename(os.path.join(self.bucket_dir, key + '.tmp'), os.path.join(self.bucket_dir, key))
+
+    def publish_layer(self, name, key):
+        with self.lock:
+            state = self.state()
+            versions = state['layers'].setdefault(name, [])
+            arn = 'arn:local:lambda:layer:{0}:{1}'.format(name, len(versions) + 1)
+            versions.append(dict(arn=arn, key=key, sha256=file_sha256(os.path.join(self.bucket_dir, key))))
+            self.save(state)
+        return arn
+
+    def deploy_function(self, name, key=None, layer_arn=None):
+        with self.lock:
+            state = self.state()
+            function = state['functions'].setdefault(name, dict(updates=0))
+            if key:
+                function.update(key=key, sha256=file_sha256(os.path.join(self.bucket_dir, key)))
+            if layer_arn:
+                function['layers'] = [layer_arn]
+            function['updates'] += 1
+            self.save(state)
+
+
+def read_manifest(file_name):
+    if not os.path.isfile(file_name):
+        return dict(functions={}, layer={})
+    with open(file_name) as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(file_name, manifest):
+    with open(file_name + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.rename(file_name + '.tmp', file_name)
+
+
+def map_jobs(pool, function, jobs):
+    return pool.map(function, jobs) if pool is not None and len(jobs) > 1 else [function(job) for job in jobs]
+
+
+def deploy_incremental(environ, target, functions=None, variables=None, facts=None, workspace=None, build=None,
+                       jobs=None, force=False, refresh_deps=False, keep_source=False, check=True):
+    """
+    Build, upload and deploy the functions which changed since the last run.
+
+    :param target: :py:class:`AwsTarget` or :py:class:`LocalTarget`
+    :param functions: entries of the ``functions`` list of the playbook, all if None
+    :param variables: vars of the playbook, for the config template
+    :param facts: facts of the environment, None to use the ``config.py`` of the repository
+    :param jobs: size of the process and thread pools, the number of CPUs if None
+    :param force: rebuild and deploy everything
+    :return: dict of aws_name to what was done: ``unchanged``, ``built``, ``deployed``
+    """
+    variables = read_playbook() if variables is None else variables
+    functions = variables['functions'] if functions is None else functions
+    workspace = workspace or os.path.join(HERE, 'workspace')
+    build = build or os.path.join(HERE, 'build')
+    jobs = jobs or multiprocessing.cpu_count()
+    for directory in (workspace, build):
+        try:
+            os.makedirs(directory)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+    manifest_file = os.path.join(build, '{0}-manifest.json'.format(environ))
+    manifest = read_manifest(manifest_file)
+    context = dict(variables, environ=environ)
+    zip_name = lambda name: '{0}-{1}.zip'.format(environ, name)  # noqa: E731
+    start = time.time()
+
+    threads = ThreadPool(jobs)
+    processes = None
+    try:
+        # dependencies first, they are part of the hash
+        cache = os.path.join(build, 'deps')
+        unique = dict((requirements_hash(function), function) for function in functions).values()
+        by_hash = dict((requirements_hash(function), dependencies) for function, dependencies in zip(
+            unique, map_jobs(threads, lambda function: install_dependencies(function, cache, refresh_deps), unique)))
+        installed = dict((function['code'], by_hash[requirements_hash(function)]) for function in functions)
+
+        changed = []
+        for function in functions:
+            config = render_config(function, context, facts)
+            digest = function_hash(function, config, installed[function['code']], facts)
+            entry = manifest['functions'].get(function['aws_name'], {})
+            zip_file = os.path.join(build, zip_name(function['aws_name']))
+            # the layer is rebuilt from the workspaces, they have to be there
+            missing = not os.path.isfile(zip_file) or not all(
+                os.path.isfile(source) for source in entry.get('layer_modules', {}).values())
+            if force or missing or entry.get('hash') != digest:
+                changed.append((function, digest, (workspace, zip_file, function, config,
+                                                   installed[function['code']], facts, keep_source)))
+        results = dict((function['aws_name'], 'unchanged') for function in functions)
+        if jobs > 1 and len(changed) > 1:
+            processes = multiprocessing.Pool(min(jobs, len(changed)))
+
+        print('{0:>20} {1:>6} {2:>12} {3:>12} {4:>8}'.format('', 'files', 'unpacked', 'zipped', 'seconds'))
+        for (function, digest, _), built in zip(changed, map_jobs(processes, build_one, [c[2] for c in changed])):
+            aws_name, sizes, layer_modules, seconds = built
+            manifest['functions'][aws_name] = dict(manifest['functions'].get(aws_name, {}), hash=digest,
+                                                   layer_modules=layer_modules)
+            results[aws_name] = 'built'
+            print('{0:>20} {1:>6} {2:>12} {3:>12} {4:>8.2f}'.format(aws_name, sizes['files'], sizes['unpacked'],
+                                                                    sizes['zipped'], seconds))
+
+        layer_modules = {}
+        for function in functions:
+            layer_modules.update(manifest['functions'][function['aws_name']].get('layer_modules', {}))
+        layer_zip = os.path.join(build, zip_name(LAYER_NAME))
+        layer_digest = layer_hash(layer_modules)
+        layer_changed = force or manifest['layer'].get('hash') != layer_digest or not os.path.isfile(layer_zip)
+        if layer_changed:
+            sizes = build_package.build_layer(layer_modules, layer_zip, keep_source)
+            manifest['layer'] = dict(hash=layer_digest)
+            print('{0:>20} {1:>6} {2:>12} {3:>12}'.format(LAYER_NAME, sizes['files'], sizes['unpacked'],
+                                                          sizes['zipped']))
+
+        checked = [function for function in functions if layer_changed or results[function['aws_name']] == 'built']
+        if check:
+            errors = map_jobs(threads, lambda function: build_package.check_import(
+                os.path.join(build, zip_name(function['aws_name'])), layer_zip), checked)
+            failed = [function['aws_name'] for function, error in zip(checked, errors) if error]
+            for function, error in zip(checked, errors):
+                if error:
+                    print('{0} does not import:\n{1}'.format(function['aws_name'], error))
+            if failed:
+                # nothing is uploaded, the next run builds them again
+                for aws_name in failed:
+                    manifest['functions'][aws_name].pop('hash', None)
+                write_manifest(manifest_file, manifest)
+                sys.exit('broken artifacts: {0}'.format(', '.join(failed)))
+        write_manifest(manifest_file, manifest)
+
+        if not manifest['layer'].get('arn'):
+            target.upload(layer_zip, zip_name(LAYER_NAME))
+            manifest['layer']['arn'] = target.publish_layer('{0}-{1}'.format(environ, LAYER_NAME),
+                                                            zip_name(LAYER_NAME))
+            write_manifest(manifest_file, manifest)
+        layer_arn = manifest['layer']['arn']
+
+        def deploy(function):
+            entry = manifest['functions'][function['aws_name']]
+            key = zip_name(function['aws_name'])
+            deployed = entry.get('deployed', {})
+            new_code = deployed.get('hash') != entry['hash']
+            new_layer = deployed.get('layer_arn') != layer_arn
+            if not (new_code or new_layer):
+                return None
+            if new_code:
+                target.upload(os.path.join(build, key), key)
+            target.deploy_function('{0}-{1}'.format(environ, function['aws_name']), key if new_code else None,
+                                   layer_arn if new_layer else None)
+            return dict(hash=entry['hash'], layer_arn=layer_arn)
+
+        for function, deployed in zip(functions, map_jobs(threads, deploy, functions)):
+            if deployed:
+                manifest['functions'][function['aws_name']]['deployed'] = deployed
+                results[function['aws_name']] = 'deployed'
+        write_manifest(manifest_file, manifest)
+    finally:
+        threads.close()
+        if processes is not None:
+            processes.close()
+
+    print(' '.join('{0}:{1}'.format(name, result) for name, result in sorted(results.items())))
+    print('done in {0:.1f}s'.format(time.time() - start))
+    return results
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from ansible import build_package
+
+
+class DataFilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workspace)
+        self.write('lambda_function.py', 'from config import *\n')
+        self.write('rules.json', '{}')
+
+    def write(self, name, text):
+        path = os.path.join(self.workspace, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as data:
+            data.write(text)
+
+    def test_configured_files_are_bundled(self):
+        self.write('config.py', 'JWT_PUBLIC_KEY_FILE = "keys/jwt.key"\nAPI_KEY_INDEX_FILE = ""\n'
+                                'CA_FILE = "/etc/ssl/ca.crt"\nLOG_LEVEL = "INFO"\n')
+        self.write('keys/jwt.key', 'public key')
+        self.assertEqual(['keys/jwt.key', 'rules.json'], build_package.data_files(self.workspace))
+
+        file_name = os.path.join(self.workspace, 'function.zip')
+        build_package.build_function(self.workspace, file_name)
+        self.assertIn('keys/jwt.key', zipfile.ZipFile(file_name).namelist())
+
+    def test_missing_configured_file_fails_the_build(self):
+        for name in ('jwt.key', '../jwt.key'):
+            self.write('config.py', 'JWT_PUBLIC_KEY_FILE = {0!r}\n'.format(name))
+            self.assertRaises(build_package.BuildError, build_package.data_files, self.workspace)
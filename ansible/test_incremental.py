@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from ansible import incremental
+
+FUNCTIONS = [{'code': 'one_call', 'aws_name': 'one'}, {'code': 'two_call', 'aws_name': 'two'}]
+
+
+class IncrementalDeployTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = os.path.join(self.directory, 'repo')
+        for function in FUNCTIONS:
+            self.write(function['code'], '__init__.py', '')
+            self.write(function['code'], 'config.py', 'LOG_LEVEL = "INFO"\n')
+            self.write(function['code'], 'lambda_function.py', 'from utils import helper\n')
+        self.write('utils', '__init__.py', '')
+        self.write('utils', 'helper.py', 'VALUE = 1\n')
+        patcher = mock.patch.object(incremental, 'ROOT', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.target = incremental.LocalTarget(os.path.join(self.directory, 's3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, code, name, text):
+        path = os.path.join(self.root, code)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, name), 'w') as source:
+            source.write(text)
+
+    def deploy(self):
+        return incremental.deploy_incremental(
+            'test', self.target, variables=dict(functions=FUNCTIONS), jobs=1,
+            workspace=os.path.join(self.directory, 'workspace'), build=os.path.join(self.directory, 'build'))
+
+    def test_unchanged_functions_are_skipped(self):
+        self.assertEqual({'one': 'deployed', 'two': 'deployed'}, self.deploy())
+        self.assertEqual({'one': 'unchanged', 'two': 'unchanged'}, self.deploy())
+
+        self.write('one_call', 'lambda_function.py', 'from utils import helper\nVALUE = 2\n')
+        self.assertEqual({'one': 'deployed', 'two': 'unchanged'}, self.deploy())
+        state = self.target.state()
+        self.assertEqual(2, state['functions']['test-one']['updates'])
+        self.assertEqual(1, state['functions']['test-two']['updates'])
+        self.assertEqual(1, len(state['layers']['test-shared-layer']))
+
+    def test_rendered_config_is_part_of_the_hash(self):
+        self.deploy()
+        self.write('two_call', 'config.py', 'LOG_LEVEL = "DEBUG"\n')
+        self.assertEqual({'one': 'unchanged', 'two': 'deployed'}, self.deploy())
+
+    def test_new_layer_version_is_deployed_to_all_functions(self):
+        self.deploy()
+        self.write('utils', 'helper.py', 'VALUE = 3\n')
+        self.assertEqual({'one': 'deployed', 'two': 'deployed'}, self.deploy())
+        state = self.target.state()
+        self.assertEqual(2, len(state['layers']['test-shared-layer']))
+        self.assertEqual(['arn:local:lambda:layer:test-shared-layer:2'], state['functions']['test-two']['layers'])
+
+    def test_manifest(self):
+        self.deploy()
+        with open(os.path.join(self.directory, 'build', 'test-manifest.json')) as manifest:
+            manifest = json.load(manifest)
+        self.assertEqual(['utils/__init__.py', 'utils/helper.py'],
+                         sorted(manifest['functions']['one']['layer_modules']))
+        self.assertEqual(manifest['functions']['one']['hash'], manifest['functions']['one']['deployed']['hash'])
+
+    def test_facts_from_set_fact_tasks(self):
+        self.assertEqual({'log_level': 'INFO', 'amqp_host': 'localhost'}, incremental.load_facts(json.dumps(
+            [{'set_fact': {'log_level': 'INFO'}}, {'set_fact': {'amqp_host': 'localhost'}}])))
+
+
+if __name__ == '__main__':
+    unittest.main()
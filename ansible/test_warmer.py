@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from ansible import warmer
+
+GET = {'code': 'get_call', 'aws_name': 'get-stuff', 'handler': 'get_stuff_handler', 'warm_containers': '2'}
+POST = {'code': 'post_call', 'aws_name': 'add-something', 'handler': 'add_something_handler'}
+
+
+class FakeInvoker(object):
+    """ Answers from an idle container if there is one, else from a new one, like Lambda. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = []
+        self.started = 0
+        self.events = []
+
+    def invoke(self, function, event):
+        with self.lock:
+            self.events.append(event)
+            if self.idle:
+                container_id = self.idle.pop()
+            else:
+                self.started += 1
+                container_id = '{0}-{1}'.format(function['code'], self.started)
+        time.sleep(event.get('hold_ms', 0) / 1000.0)
+        with self.lock:
+            self.idle.append(container_id)
+        return dict(success=True, container_id=container_id)
+
+    def stop(self):
+        pass
+
+
+class WarmerTests(unittest.TestCase):
+
+    def test_targets_from_the_functions_list(self):
+        self.assertEqual([(GET, 2)], warmer.warm_targets([GET, POST]))
+        self.assertEqual([], warmer.warm_targets([GET, POST], only=['post_call']))
+        self.assertEqual([(GET, 2)], warmer.warm_targets([GET, POST], only=['get-stuff']))
+
+    def test_concurrent_pings_reach_distinct_containers(self):
+        invoker = FakeInvoker()
+        keep_warm = warmer.Warmer(invoker, [(GET, 4)], hold_ms=50)
+        try:
+            first = keep_warm.warm()['get_call']
+            second = keep_warm.warm()['get_call']
+        finally:
+            keep_warm.stop()
+        self.assertEqual(dict(target=4, reached=4, new=4, errors=0), dict(
+            (key, first[key]) for key in ('target', 'reached', 'new', 'errors')))
+        self.assertEqual((4, 0), (second['reached'], second['new']))
+        self.assertEqual(4, invoker.started)
+        self.assertTrue(all(event['noop'] and event['skiplog'] for event in invoker.events))
+
+    def test_errors_are_counted(self):
+        class FailingInvoker(FakeInvoker):
+            def invoke(self, function, event):
+                raise RuntimeError('status 500')
+
+        keep_warm = warmer.Warmer(FailingInvoker(), [(GET, 2)])
+        try:
+            result = keep_warm.warm()['get_call']
+        finally:
+            keep_warm.stop()
+        self.assertEqual((0, 2, 'status 500'), (result['reached'], result['errors'], result['error']))
+
+    def test_failed_prewarm_is_an_error(self):
+        class PrewarmInvoker(FakeInvoker):
+            def invoke(self, function, event):
+                response = FakeInvoker.invoke(self, function, event)
+                return dict(response, prewarm={'error': 'connection refused'})
+
+        invoker = PrewarmInvoker()
+        keep_warm = warmer.Warmer(invoker, [(GET, 1)], hold_ms=0, prewarm=True, ping=True)
+        try:
+            result = keep_warm.warm()['get_call']
+        finally:
+            keep_warm.stop()
+        self.assertTrue(invoker.events[0]['prewarm'] and invoker.events[0]['ping'])
+        self.assertEqual((0, 1, 'prewarm failed: connection refused'),
+                         (result['reached'], result['errors'], result['error']))
+
+    def test_local_containers(self):
+        invoker = warmer.LocalInvoker(max_containers=4)
+        keep_warm = warmer.Warmer(invoker, [(POST, 2)], hold_ms=100)
+        rounds = []
+        try:
+            keep_warm.run(0, rounds=2, report=lambda number, result: rounds.append(result['post_call']))
+        finally:
+            keep_warm.stop()
+        self.assertEqual([(2, 2, 0), (2, 0, 0)], [(r['reached'], r['new'], r['errors']) for r in rounds])
+        self.assertEqual(2, invoker.started)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Keep warm the containers of the deployed functions: every round fires as many
+concurrent ``noop`` invocations per function as containers should stay warm,
+its ``warm_containers`` in the ``functions`` list of the playbook.
+
+A single ping only ever keeps one container warm, Lambda answers sequential
+calls from the same container. The pings hold their container for
+``hold_ms`` (see ``utils.noop_response``), so the concurrent ones land on
+distinct containers, and report the ``container_id`` of the container that
+answered. Per function and round the number of distinct containers reached
+is printed, and how many of them were not seen in the round before, which
+were cold starts or containers Lambda moved the pings to.
+
+    python warmer.py -e dev --interval 300 --rounds 0
+    python warmer.py --local --interval 5 --rounds 3 --max-idle-s 8
+
+``--local`` invokes the functions in local containers instead (see
+``benchmarks/container.py``), which are thrown away after ``--max-idle-s``.
+
+``--prewarm`` has the functions that support it open their AMQP connection
+and declare their exchange and reply queue while holding the container, so
+the first real request does not pay for it, ``--ping`` also round-trips a
+health ping to the service. A failed prewarm counts as an error.
+
+"""
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import argh
+
+import incremental
+
+DEFAULT_HOLD_MS = 200
+"How long a ping holds its container, long enough for all pings of a round to overlap."
+
+NOOP = {'noop': True, 'skiplog': True}
+
+
+def warm_targets(functions, only=None):
+    """
+    :param only: codes or aws_names of the functions to warm, all if None
+    :return: list of tuples ``(function, containers to keep warm)``, functions without a target are left out
+    """
+    targets = []
+    for function in functions:
+        count = int(function.get('warm_containers') or 0)
+        if count > 0 and (not only or function['code'] in only or function['aws_name'] in only):
+            targets.append((function, count))
+    return targets
+
+
+class AwsInvoker(object):
+    """ Invokes the deployed functions with boto3, or the aws CLI if it is not installed. """
+
+    def __init__(self, environ, region):
+        self.environ = environ
+        self.region = region
+        try:
+            import boto3
+        except ImportError:
+            self.client = None
+        else:
+            self.client = boto3.client('lambda', region_name=region)
+
+    def invoke(self, function, event):
+        """ :return: the response of the function """
+        name = '{0}-{1}'.format(self.environ, function['aws_name'])
+        if self.client is not None:
+            result = self.client.invoke(FunctionName=name, Payload=json.dumps(event))
+            payload = json.loads(result['Payload'].read())
+            if result.get('FunctionError'):
+                raise RuntimeError(payload.get('errorMessage', 'function error'))
+            return payload
+        handle, output = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            status = json.loads(subprocess.check_output([
+                'aws', 'lambda', 'invoke', '--function-name', name, '--payload', json.dumps(event),
+                '--region', self.region, output]))
+            with open(output) as payload_file:
+                payload = json.load(payload_file)
+        finally:
+            os.remove(output)
+        if status.get('FunctionError'):
+            raise RuntimeError(payload.get('errorMessage', 'function error'))
+        return payload
+
+    def stop(self):
+        pass
+
+
+class LocalInvoker(object):
+    """
+    Stand-in for Lambda: every function runs in local containers, a new one
+    is started whenever all existing ones are busy, idle ones are thrown away
+    after *max_idle_s*.
+
+    """
+    def __init__(self, max_containers=50, max_idle_s=None, options=None):
+        sys.path.insert(0, incremental.ROOT)
+        from benchmarks.container import Pool
+
+        self.pool_class = Pool
+        self.max_containers = max_containers
+        self.max_idle_s = max_idle_s
+        self.options = dict(dict(broker=None, latency_ms=2.0, jitter_ms=0.5, items=10, log=False), **options or {})
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.started = 0
+        "Containers started, i.e. the cold starts."
+
+    def pool(self, function):
+        with self.lock:
+            if function['code'] not in self.pools:
+                self.pools[function['code']] = self.pool_class(function, self.max_containers, self.options,
+                                                               self.max_idle_s)
+            return self.pools[function['code']]
+
+    def invoke(self, function, event):
+        pool = self.pool(function)
+        container, init_ms = pool.acquire()
+        if init_ms is not None:
+            with self.lock:
+                self.started += 1
+        try:
+            result = container.invoke('warm', event, response=True)
+        except RuntimeError:
+            pool.release(container, recycle=True)
+            raise
+        pool.release(container)
+        if result['status'] != '200':
+            raise RuntimeError('status {0}'.format(result['status']))
+        return result['response']
+
+    def stop(self):
+        for pool in self.pools.values():
+            pool.stop()
+
+
+class Warmer(object):
+    """
+    Fires the rounds of keep warm pings and remembers the containers reached.
+
+    :param targets: list of tuples ``(function, containers to keep warm)``
+    """
+    def __init__(self, invoker, targets, hold_ms=DEFAULT_HOLD_MS, prewarm=False, ping=False):
+        self.invoker = invoker
+        self.targets = targets
+        self.event = dict(NOOP, hold_ms=hold_ms)
+        if prewarm:
+            self.event.update(prewarm=True, ping=ping)
+        self.seen = {}
+        "The container IDs reached in the last round, by function code."
+        self.threads = ThreadPool(max(1, sum(count for _, count in targets)))
+
+    def ping(self, function):
+        start = time.time()
+        try:
+            response = self.invoker.invoke(function, self.event)
+            error = (response.get('prewarm') or {}).get('error')
+            if error:
+                raise RuntimeError('prewarm failed: {0}'.format(error))
+            return response.get('container_id'), (time.time() - start) * 1000, None
+        except Exception as err:
+            return None, (time.time() - start) * 1000, err
+
+    def warm(self):
+        """
+        Fire one round, all pings of all functions at once.
+
+        :return: dict of function code to a dict with the ``target``, the ``reached`` and ``new`` containers,
+            the ``errors`` and the ``max_ms`` of the pings
+        """
+        pings = [function for function, count in self.targets for _ in range(count)]
+        results = self.threads.map(self.ping, pings)
+        report = {}
+        for function, count in self.targets:
+            replies = [result for ping, result in zip(pings, results) if ping is function]
+            containers = set(container_id for container_id, _, error in replies if container_id and not error)
+            errors = [str(error) for _, _, error in replies if error]
+            report[function['code']] = dict(
+                target=count, reached=len(containers), new=len(containers - self.seen.get(function['code'], set())),
+                errors=len(errors), error=errors[0] if errors else None,
+                max_ms=round(max(latency for _, latency, _ in replies), 1))
+            self.seen[function['code']] = containers
+        return report
+
+    def run(self, interval, rounds=1, report=None):
+        """
+        Fire a round every *interval* seconds, at a fixed rate.
+
+        :param rounds: number of rounds, 0 to run until interrupted
+        :param report: called with the round number and the result of every round
+        """
+        start = time.time()
+        number = 0
+        while not rounds or number < rounds:
+            result = self.warm()
+            number += 1
+            if report is not None:
+                report(number, result)
+            if rounds and number >= rounds:
+                break
+            time.sleep(max(0.0, start + number * interval - time.time()))
+
+    def stop(self):
+        self.threads.close()
+        self.invoker.stop()
+
+
+def print_round(number, result):
+    print('round {0} at {1}'.format(number, time.strftime('%H:%M:%S')))
+    print('{0:>16} {1:>7} {2:>8} {3:>5} {4:>7} {5:>8}'.format('', 'target', 'reached', 'new', 'errors', 'max ms'))
+    for code, entry in sorted(result.items()):
+        print('{0:>16} {1:>7} {2:>8} {3:>5} {4:>7} {5:>8}'.format(
+            code, entry['target'], entry['reached'], entry['new'], entry['errors'], entry['max_ms']))
+        if entry['error']:
+            print('{0:>16} {1}'.format('', entry['error']))
+    sys.stdout.flush()
+
+
+@argh.arg('-e', '--environment', help='environment the functions are deployed to', type=str)
+@argh.arg('-p', '--playbook', help='playbook with the functions list and their warm_containers', type=str)
+@argh.arg('-f', '--only', action='append', type=str, help='code or aws_name of a function to warm, repeatable')
+@argh.arg('-i', '--interval', type=float, help='seconds between the rounds')
+@argh.arg('-r', '--rounds', type=int, help='number of rounds, 0 to run until interrupted')
+@argh.arg('--hold-ms', type=float, help='how long a ping holds its container')
+@argh.arg('--local', help='invoke local containers instead of the deployed functions')
+@argh.arg('--max-idle-s', type=float, help='with --local, seconds after which an idle container is thrown away')
+@argh.arg('--prewarm', help='open the AMQP connection and declarations of the functions while holding them')
+@argh.arg('--ping', help='with --prewarm, round-trip a health ping to the services too')
+def warmer(environment='dev', playbook=incremental.PLAYBOOK, only=None, interval=300.0, rounds=1,
+           hold_ms=DEFAULT_HOLD_MS, local=False, max_idle_s=None, prewarm=False, ping=False):
+    variables = incremental.read_playbook(playbook)
+    targets = warm_targets(variables['functions'], only)
+    if not targets:
+        sys.exit('no function with warm_containers to warm')
+    if local:
+        invoker = LocalInvoker(max_containers=max(count for _, count in targets) * 2, max_idle_s=max_idle_s)
+    else:
+        invoker = AwsInvoker(environment, variables['aws_region'])
+    keep_warm = Warmer(invoker, targets, hold_ms, prewarm, ping)
+    try:
+        keep_warm.run(interval, rounds, print_round)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        keep_warm.stop()
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(warmer)
@@ -1,2 +1,21 @@
 LOG_LEVEL = 'DEBUG'
+LOG_SAMPLE_RATE = 1.0
+LOG_MAX_SIZE = 1024
 
+METRICS_NAMESPACE = 'api-gateway-template'
+
+TOKEN_CACHE_SIZE = 1024
+TOKEN_ACCEPT_TTL = 300
+TOKEN_REJECT_TTL = 30
+
+JWT_HS256_SECRET = ''
+JWT_PUBLIC_KEY_FILE = ''
+JWT_LEEWAY = 30
+JWT_AUDIENCE = ''
+JWT_ISSUER = ''
+JWT_PRINCIPAL_CLAIM = 'sub'
+JWT_ROLES_CLAIM = 'roles'
+
+RULES_FILE = 'rules.json'
+
+API_KEY_INDEX_FILE = ''
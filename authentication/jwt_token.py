@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Local verification of HS256 and RS256 signed JSON Web Tokens, without any
+network calls. Keys are decoded once when the verifier is created.
+
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from token_cache import AuthFailedException
+
+
+def b64url_decode(data):
+    """ Decode unpadded base64url, as used in JWTs. """
+    if not isinstance(data, bytes):
+        data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+class JwtVerifier(object):
+    """
+    Verifies the signature and the time claims of JWTs.
+
+    :param hs256_secret:
+        Shared secret for HS256 tokens, None to not accept them.
+
+    :param rs256_public_key:
+        PEM encoded RSA public key for RS256 tokens, None to not accept them.
+
+    :param leeway:
+        Seconds of clock skew tolerated for ``exp`` and ``nbf``.
+
+    :param audience:
+        If set, the ``aud`` claim has to contain it.
+
+    :param issuer:
+        If set, the ``iss`` claim has to match it.
+
+    """
+    def __init__(self, hs256_secret=None, rs256_public_key=None, leeway=0, audience=None, issuer=None,
+                 clock=time.time):
+        self.keys = {}
+        if hs256_secret:
+            if not isinstance(hs256_secret, bytes):
+                hs256_secret = hs256_secret.encode('utf-8')
+            self.keys['HS256'] = hs256_secret
+        if rs256_public_key:
+            # optional and slow to import, so only loaded if RS256 is configured
+            try:
+                from Crypto.Hash import SHA256
+                from Crypto.PublicKey import RSA
+                from Crypto.Signature import PKCS1_v1_5
+            except ImportError:
+                raise ImportError('RS256 needs pycrypto')
+            self.keys['RS256'] = (PKCS1_v1_5.new(RSA.importKey(rs256_public_key)), SHA256)
+
+        self.leeway = leeway
+        self.audience = audience
+        self.issuer = issuer
+        self.clock = clock
+
+    def __repr__(self):
+        return '<JwtVerifier {0}>'.format(','.join(sorted(self.keys)) or 'no keys')
+
+    @classmethod
+    def from_config(cls, hs256_secret, public_key_file, leeway=0, audience=None, issuer=None):
+        """
+        Create the verifier from the function configuration, a relative key
+        file is looked up next to this module, i.e. bundled in the zip.
+
+        """
+        public_key = None
+        if public_key_file:
+            if not os.path.isabs(public_key_file):
+                public_key_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), public_key_file)
+            with open(public_key_file) as key_file:
+                public_key = key_file.read()
+        return cls(hs256_secret or None, public_key, int(leeway), audience or None, issuer or None)
+
+    @property
+    def enabled(self):
+        return bool(self.keys)
+
+    def verify(self, token):
+        """
+        Verify a token and return its claims.
+
+        :raises: AuthFailedException
+
+        """
+        try:
+            signing_input, _, signature = token.rpartition('.')
+            header_segment, _, payload_segment = signing_input.partition('.')
+            header = json.loads(b64url_decode(header_segment).decode('utf-8'))
+            signature = b64url_decode(signature)
+            signing_input = signing_input.encode('ascii')
+        except (ValueError, TypeError, AttributeError) as err:
+            raise AuthFailedException('malformed token: {0}'.format(err))
+
+        algorithm = header.get('alg') if isinstance(header, dict) else None
+        key = self.keys.get(algorithm)
+        if key is None:
+            raise AuthFailedException('algorithm not accepted: {0!r}'.format(algorithm))
+
+        if algorithm == 'HS256':
+            valid = hmac.compare_digest(hmac.new(key, signing_input, hashlib.sha256).digest(), signature)
+        else:
+            verifier, sha256 = key
+            valid = verifier.verify(sha256.new(signing_input), signature)
+        if not valid:
+            raise AuthFailedException('invalid signature')
+
+        try:
+            claims = json.loads(b64url_decode(payload_segment).decode('utf-8'))
+        except (ValueError, TypeError) as err:
+            raise AuthFailedException('malformed claims: {0}'.format(err))
+        if not isinstance(claims, dict):
+            raise AuthFailedException('malformed claims')
+
+        if self.issuer is not None and claims.get('iss') != self.issuer:
+            raise AuthFailedException('wrong issuer')
+        if self.audience is not None:
+            audience = claims.get('aud')
+            if self.audience not in (audience if isinstance(audience, list) else [audience]):
+                raise AuthFailedException('wrong audience')
+
+        self.check_times(claims)
+        return claims
+
+    def check_times(self, claims):
+        """
+        Check ``exp`` and ``nbf``, done again for claims taken from a cache.
+
+        :raises: AuthFailedException
+
+        """
+        now = self.clock()
+        try:
+            if 'exp' in claims and now > float(claims['exp']) + self.leeway:
+                raise AuthFailedException('token expired')
+            if 'nbf' in claims and now < float(claims['nbf']) - self.leeway:
+                raise AuthFailedException('token not yet valid')
+        except (TypeError, ValueError):
+            raise AuthFailedException('malformed time claims')
+
+
+def encode_hs256(claims, secret):
+    """
+    Create a HS256 token, for tests and benchmarks.
+
+    """
+    if not isinstance(secret, bytes):
+        secret = secret.encode('utf-8')
+    segments = [b64url_encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode('utf-8')),
+                b64url_encode(json.dumps(claims).encode('utf-8'))]
+    signing_input = b'.'.join(segments)
+    signature = hmac.new(secret, signing_input, hashlib.sha256).digest()
+    return b'.'.join(segments + [b64url_encode(signature)]).decode('ascii')
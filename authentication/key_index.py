@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only index of API keys, built before deployment and bundled in the
+authentication zip, so the authorizer needs no database for API keys.
+
+The index file holds a header, a Bloom filter and the sorted, fixed-width
+records ``digest | value``. Only the first bytes of the SHA-256 digest of a
+key are stored, never the key itself. The file is mapped with :py:mod:`mmap`,
+so opening it is O(1) and only the pages touched by a lookup are read. The
+Bloom filter rejects most unknown keys without touching the records.
+
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+MAGIC = b'KIDX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHIQ')
+"magic, version, digest size, value width, Bloom hashes, record count, Bloom bits"
+
+DIGEST_SIZE = 16
+"Bytes of the key digest stored per record."
+
+
+class KeyIndexError(Exception):
+    """ Raised if an index file can not be read. """
+    pass
+
+
+def key_digest(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return hashlib.sha256(key).digest()
+
+
+def bloom_positions(digest, bits, hashes):
+    """
+    Return the Bloom filter bits of a key, derived from the part of its
+    digest that is not stored in the records.
+
+    """
+    first, second = struct.unpack_from('<QQ', digest, DIGEST_SIZE)
+    second |= 1
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+def encode_value(principal_id, roles=()):
+    return u'\t'.join([principal_id, u','.join(roles)]).encode('utf-8')
+
+
+def decode_value(value):
+    principal_id, _, roles = value.rstrip(b'\0').decode('utf-8').partition(u'\t')
+    return principal_id, [role for role in roles.split(u',') if role]
+
+
+def bloom_size(count, false_positive_rate):
+    """
+    :return: tuple ``(bits, hashes)`` of the optimal Bloom filter for *count* keys
+    """
+    count = max(count, 1)
+    bits = int(math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2))
+    return bits, max(1, int(round(float(bits) / count * math.log(2))))
+
+
+def build_index(entries, file_name, false_positive_rate=0.01):
+    """
+    Write an index file.
+
+    :param entries:
+        iterable of ``(key, principal_id, roles)`` tuples, a later entry for
+        the same key replaces an earlier one.
+
+    :param false_positive_rate:
+        Share of unknown keys the Bloom filter lets through to the records.
+
+    :return: number of records written
+
+    """
+    records = {}
+    for key, principal_id, roles in entries:
+        records[key_digest(key)] = encode_value(principal_id, roles)
+
+    value_width = max([len(value) for value in records.values()] or [0])
+    bits, hashes = bloom_size(len(records), false_positive_rate)
+    bloom = bytearray((bits + 7) // 8)
+    for digest in records:
+        for position in bloom_positions(digest, bits, hashes):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    with open(file_name, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, VERSION, DIGEST_SIZE, value_width, hashes, len(records), bits))
+        index_file.write(bytes(bloom))
+        for digest in sorted(records):
+            index_file.write(digest[:DIGEST_SIZE] + records[digest].ljust(value_width, b'\0'))
+    return len(records)
+
+
+def read_key_list(file_name):
+    """
+    Read a key list with one ``key principal_id [role,role]`` line per key,
+    empty lines and lines starting with ``#`` are skipped.
+
+    """
+    with open(file_name) as key_file:
+        for line in key_file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) < 2:
+                raise KeyIndexError('no principal for key in line: {0}'.format(line.strip()))
+            roles = fields[2].split(',') if len(fields) > 2 else []
+            yield fields[0], fields[1], roles
+
+
+class KeyIndex(object):
+    """
+    Lookups in a mapped index file, opened once per container.
+
+    """
+    def __init__(self, file_name):
+        """
+        :raises: KeyIndexError
+
+        """
+        with open(file_name, 'rb') as index_file:
+            try:
+                self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error) as err:
+                raise KeyIndexError('can not map {0}: {1}'.format(file_name, err))
+
+        if len(self.map) < HEADER.size:
+            raise KeyIndexError('not a key index: {0}'.format(file_name))
+        magic, version, digest_size, self.value_width, self.hashes, self.count, self.bits = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or digest_size != DIGEST_SIZE:
+            raise KeyIndexError('not a key index of version {0}: {1}'.format(VERSION, file_name))
+
+        self.bloom_offset = HEADER.size
+        self.records_offset = self.bloom_offset + (self.bits + 7) // 8
+        self.record_size = DIGEST_SIZE + self.value_width
+        if len(self.map) != self.records_offset + self.count * self.record_size:
+            raise KeyIndexError('truncated key index: {0}'.format(file_name))
+
+        self.bloom_rejects = 0
+        self.lookups = 0
+
+    def __repr__(self):
+        return '<KeyIndex keys={0}>'.format(self.count)
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def from_config(cls, file_name):
+        """ A relative file name is looked up next to this module, i.e. bundled in the zip. """
+        if not os.path.isabs(file_name):
+            file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+        return cls(file_name)
+
+    def might_contain(self, digest):
+        """ Check the Bloom filter, False means the key is certainly unknown. """
+        for position in bloom_positions(digest, self.bits, self.hashes):
+            offset = self.bloom_offset + (position >> 3)
+            if not ord(self.map[offset:offset + 1]) & 1 << (position & 7):
+                return False
+        return True
+
+    def find(self, digest):
+        """ Binary search the records, return the raw value or None. """
+        digest = digest[:DIGEST_SIZE]
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.records_offset + middle * self.record_size
+            found = self.map[offset:offset + DIGEST_SIZE]
+            if found < digest:
+                low = middle + 1
+            elif found > digest:
+                high = middle
+            else:
+                return self.map[offset + DIGEST_SIZE:offset + self.record_size]
+        return None
+
+    def lookup(self, key):
+        """
+        Look up an API key.
+
+        :return: tuple ``(principal_id, roles)``, None for unknown keys
+
+        """
+        self.lookups += 1
+        digest = key_digest(key)
+        if not self.might_contain(digest):
+            self.bloom_rejects += 1
+            return None
+        value = self.find(digest)
+        return None if value is None else decode_value(value)
+
+    def stats(self):
+        return dict(keys=self.count, lookups=self.lookups, bloom_rejects=self.bloom_rejects,
+                    size=len(self.map))
@@ -19,21 +19,87 @@ from __future__ import print_function
 
 import logging
 import re
+from collections import namedtuple
 
 from config import *
+from jwt_token import JwtVerifier
+from key_index import KeyIndex
+from rules import RuleSet
+from token_cache import AuthFailedException, TokenCache, tokens_equal
+from utils import noop_response
+from utils.logs import add_fields, configure as configure_logs, fmt, log_invocation
+from utils.metrics import instrument, timer
 
 
 log = logging.getLogger('authentication')
 log.setLevel(getattr(logging, LOG_LEVEL.upper()))
+configure_logs(max_size=LOG_MAX_SIZE)
+
+# kept at module level, so verified tokens are remembered across warm invocations
+token_cache = TokenCache(max_size=int(TOKEN_CACHE_SIZE), accept_ttl=int(TOKEN_ACCEPT_TTL),
+                         reject_ttl=int(TOKEN_REJECT_TTL))
+# keys are decoded once per container
+jwt_verifier = JwtVerifier.from_config(JWT_HS256_SECRET, JWT_PUBLIC_KEY_FILE, JWT_LEEWAY, JWT_AUDIENCE, JWT_ISSUER)
+# compiled once per container, without rules every valid token may call every method
+rule_set = RuleSet.from_file(RULES_FILE) if RULES_FILE else None
+# bundled API keys, mapped and not read into memory
+key_index = KeyIndex.from_config(API_KEY_INDEX_FILE) if API_KEY_INDEX_FILE else None
+
+
+def verify_token(token):
+    """
+    Verify a token and return its claims, this is the work the token cache
+    saves. Tokens without dots are API keys, looked up in the bundled index.
+    Without configured JWT keys only the demo token is accepted.
+
+    :raises: AuthFailedException
+
+    """
+    if key_index is not None and '.' not in token:
+        entry = key_index.lookup(token)
+        if entry is None:
+            raise AuthFailedException('unknown api key')
+        claims = {JWT_PRINCIPAL_CLAIM: entry[0], JWT_ROLES_CLAIM: entry[1]}
+    elif jwt_verifier.enabled:
+        claims = jwt_verifier.verify(token)
+    elif tokens_equal(token, 'somethingsomethingsomethingsomething'):
+        # just a special string for demonstration purposes
+        claims = {JWT_PRINCIPAL_CLAIM: '*', JWT_ROLES_CLAIM: ['admin']}
+    else:
+        raise AuthFailedException('invalid token')
+
+    if not claims.get(JWT_PRINCIPAL_CLAIM):
+        raise AuthFailedException('no principal in token')
+    return claims
+
+
+def allow_role_methods(policy, claims, verb, path):
+    """
+    Allow every method the roles of a token grant, not only the called one:
+    API Gateway caches the policy for the token and evaluates it for the
+    following calls as well. Rules with a ``*`` in the middle of the path
+    only grant the called method, see RuleSet.policy_methods.
+
+    """
+    roles = claims.get(JWT_ROLES_CLAIM) or []
+    if not isinstance(roles, list):
+        roles = [roles]
+    if not rule_set.is_allowed(roles, verb, path):
+        log.info(fmt('roles {0} may not call {1} /{2}', roles, verb, path))
+    for method, resource in rule_set.policy_methods(roles, verb, path):
+        policy.allow_method(method, resource)
+    if not policy.allow_methods:
+        policy.deny_all_methods()
 
 
-class AuthFailedException(Exception):
-    pass
-
-
+@log_invocation('authentication', sample_rate=LOG_SAMPLE_RATE)
+@instrument('authentication', namespace=METRICS_NAMESPACE)
 def lambda_handler(request, context):
-    log.info('authorizationToken: {0}'.format(request.get('authorizationToken', '')))
-    log.info('Method ARN: {0}'.format(request['methodArn']))
+    # keep warm pings are invoked directly, API Gateway only sends TOKEN events
+    if request.get('noop'):
+        return noop_response(request, context)
+    # never log the token itself, the request is logged with the token redacted
+    log.debug(fmt('Method ARN: {0}', request['methodArn']))
     """validate the incoming token"""
     """and produce the principal user identifier associated with the token"""
 
@@ -73,35 +139,34 @@ def lambda_handler(request, context):
     _token = request.get('authorizationToken')
     if _token:
         try:
-            # do some authentication here
-            # here just set to true if token is equal to a special string
-            # for demonstration purposes
-            # you can be as specific as you need, or just binary authentication
-            auth_success = _token == 'somethingsomethingsomethingsomething'
-            if not auth_success:
-                log.error('Authentication failure.')
-                raise AuthFailedException
-            else:
-                log.debug('token authorized, allowing all methods for now')
+            with timer('verify'):
+                claims = token_cache.verify(_token, verify_token)
+                # a cached token may have expired in the meantime
+                jwt_verifier.check_times(claims)
+            policy.principal_id = claims[JWT_PRINCIPAL_CLAIM]
+            add_fields(principal_id=policy.principal_id)
+            if rule_set is None:
+                log.debug('token authorized, no rules, allowing all methods')
                 policy.allow_all_methods()
+            else:
+                allow_role_methods(policy, claims, api_gateway_arn_tmp[2], '/'.join(api_gateway_arn_tmp[3:]))
 
-        except AuthFailedException:
-            log.error('Authentication error, denying all method access')
-            log.error('request: {0}'.format(request))
-            log.error('context: {0}'.format(context))
+        except AuthFailedException as err:
+            log.error(fmt('Authentication error ({0}), denying all method access, request: {1}', err, request))
+            add_fields(status='denied', error=str(err))
             policy.deny_all_methods()
         except:
-            log.error('Error in auth process !')
-            log.error('request: {0}'.format(request))
-            log.error('context: {0}'.format(context))
+            log.exception(fmt('Error in auth process ! request: {0}', request))
+            add_fields(status='denied', error='error in auth process')
             policy.deny_all_methods()
     else:
-        log.warning('no token in request, returning DENY on all policy')
-        log.warning('request: {0}'.format(request))
+        log.warning(fmt('no token in request, returning DENY on all policy, request: {0}', request))
+        add_fields(status='denied', error='no token')
         policy.deny_all_methods()
 
     """finally, build the policy and exit the function using return"""
-    return policy.build()
+    with timer('policy'):
+        return policy.build()
 
 
 class HttpVerb:
@@ -115,6 +180,11 @@ class HttpVerb:
     ALL = "*"
 
 
+PolicyMethod = namedtuple('PolicyMethod', ['resource_arn', 'conditions'])
+"""An allowed or denied method of a policy: the resource ARN and a conditions
+statement, which can be None."""
+
+
 class AuthPolicy(object):
     aws_account_id = ""
     """The AWS account id the policy will be generated for. This is used to create the method ARNs."""
@@ -124,15 +194,28 @@ class AuthPolicy(object):
     """The policy version used for the evaluation. This should always be '2012-10-17'"""
     pathRegex = "^[/.a-zA-Z0-9-\*]+$"
     """The regular expression used to validate resource paths for the policy"""
+    path_pattern = re.compile(pathRegex)
+    """pathRegex, compiled once for all policies"""
+    arn_format = "arn:aws:execute-api:{0}:{1}:{2}/{3}/{4}/{5}"
+    """region, account id, API id, stage, verb and resource of a method ARN"""
 
     """these are the internal lists of allowed and denied methods. These are lists
-    of objects and each object has 2 properties: A resource ARN and a nullable
+    of PolicyMethod tuples, each with 2 properties: A resource ARN and a nullable
     conditions statement.
     the build method processes these lists and generates the approriate
     statements for the final policy"""
     allow_methods = []
     deny_methods = []
 
+    documents = {}
+    """Policy documents already built in this container, by rule set. The common
+    allow-all and deny-all policies of an API stage are built only once this way.
+    The documents are shared and must not be modified."""
+    max_documents = 256
+    """The documents are dropped once there are more than this many"""
+    all_methods = {}
+    """Prebuilt '*' methods by effect and API stage"""
+
     restApiId = "*"
     """The API Gateway API id. By default this is set to '*'"""
     region = "*"
@@ -152,31 +235,21 @@ class AuthPolicy(object):
         statement can be null."""
         if verb != "*" and not hasattr(HttpVerb, verb):
             raise NameError("Invalid HTTP verb " + verb + ". Allowed verbs in HttpVerb class")
-        resource_pattern = re.compile(self.pathRegex)
-        if not resource_pattern.match(resource):
+        if not self.path_pattern.match(resource):
             raise NameError("Invalid resource path: " + resource + ". Path should match " + self.pathRegex)
 
         if resource[:1] == "/":
             resource = resource[1:]
 
-        resource_arn = ("arn:aws:execute-api:" +
-                        self.region + ":" +
-                        self.aws_account_id + ":" +
-                        self.restApiId + "/" +
-                        self.stage + "/" +
-                        verb + "/" +
-                        resource)
-
-        if effect.lower() == "allow":
-            self.allow_methods.append({
-                'resourceArn': resource_arn,
-                'conditions': conditions
-            })
-        elif effect.lower() == "deny":
-            self.deny_methods.append({
-                'resourceArn': resource_arn,
-                'conditions': conditions
-            })
+        method = PolicyMethod(self.arn_format.format(self.region, self.aws_account_id, self.restApiId,
+                                                     self.stage, verb, resource),
+                              conditions or None)
+
+        effect = effect.lower()
+        if effect == "allow":
+            self.allow_methods.append(method)
+        elif effect == "deny":
+            self.deny_methods.append(method)
 
     @classmethod
     def _get_empty_statement(cls, effect):
@@ -190,33 +263,45 @@ class AuthPolicy(object):
         return statement
 
     def _get_statement_for_effect(self, effect, methods):
-        """This function loops over an array of objects containing a resourceArn and
-        conditions statement and generates the array of statements for the policy."""
+        """This function loops over an array of PolicyMethod tuples and generates the
+        array of statements for the policy."""
         statements = []
 
-        if len(methods) > 0:
+        if methods:
             statement = self._get_empty_statement(effect)
 
             for cur_method in methods:
-                if cur_method['conditions'] is None or len(cur_method['conditions']) == 0:
-                    statement['Resource'].append(cur_method['resourceArn'])
+                if not cur_method.conditions:
+                    statement['Resource'].append(cur_method.resource_arn)
                 else:
                     conditional_statement = self._get_empty_statement(effect)
-                    conditional_statement['Resource'].append(cur_method['resourceArn'])
-                    conditional_statement['Condition'] = cur_method['conditions']
+                    conditional_statement['Resource'].append(cur_method.resource_arn)
+                    conditional_statement['Condition'] = cur_method.conditions
                     statements.append(conditional_statement)
 
             statements.append(statement)
 
         return statements
 
+    def _add_all_methods(self, effect):
+        """Adds the '*' method for an effect, which is prepared once per API stage."""
+        key = (effect, self.region, self.aws_account_id, self.restApiId, self.stage)
+        method = self.all_methods.get(key)
+        if method is None:
+            self._add_method(effect, HttpVerb.ALL, "*", [])
+            self.all_methods[key] = (self.allow_methods if effect == "Allow" else self.deny_methods)[-1]
+        elif effect == "Allow":
+            self.allow_methods.append(method)
+        else:
+            self.deny_methods.append(method)
+
     def allow_all_methods(self):
         """Adds a '*' allow to the policy to authorize access to all methods of an API"""
-        self._add_method("Allow", HttpVerb.ALL, "*", [])
+        self._add_all_methods("Allow")
 
     def deny_all_methods(self):
         """Adds a '*' allow to the policy to deny access to all methods of an API"""
-        self._add_method("Deny", HttpVerb.ALL, "*", [])
+        self._add_all_methods("Deny")
 
     def allow_method(self, verb, resource):
         """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
@@ -244,23 +329,33 @@ class AuthPolicy(object):
         """Generates the policy document based on the internal lists of allowed and denied
         conditions. This will generate a policy with two main statements for the effect:
         one statement for Allow and one statement for Deny.
-        Methods that includes conditions will have their own statement in the policy."""
-        if ((self.allow_methods is None or len(self.allow_methods) == 0) and
-                (self.deny_methods is None or len(self.deny_methods) == 0)):
+        Methods that includes conditions will have their own statement in the policy.
+        The policy document is built once per rule set and then taken from the documents cache."""
+        if not self.allow_methods and not self.deny_methods:
             raise NameError("No statements defined for the policy")
 
-        policy = {
-            'principalId': self.principal_id,
-            'policyDocument': {
+        key = (self.version, tuple(self.allow_methods), tuple(self.deny_methods))
+        try:
+            document = self.documents.get(key)
+        except TypeError:
+            # conditions are not hashable, so this rule set is not cached
+            key = document = None
+
+        if document is None:
+            document = {
                 'Version': self.version,
-                'Statement': []
+                'Statement': (self._get_statement_for_effect("Allow", self.allow_methods) +
+                              self._get_statement_for_effect("Deny", self.deny_methods))
             }
-        }
-
-        policy['policyDocument']['Statement'].extend(self._get_statement_for_effect("Allow", self.allow_methods))
-        policy['policyDocument']['Statement'].extend(self._get_statement_for_effect("Deny", self.deny_methods))
+            if key is not None:
+                if len(self.documents) >= self.max_documents:
+                    self.documents.clear()
+                self.documents[key] = document
 
-        return policy
+        return {
+            'principalId': self.principal_id,
+            'policyDocument': document
+        }
 
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative access rules for the authorizer: roles map HTTP verbs to resource
+path patterns. A ``*`` path segment matches exactly one segment, a trailing
+``*`` matches everything below the path, as in the API Gateway method ARNs.
+
+In the ARNs a ``*`` matches any characters, ``/`` included, so a ``*`` in the
+middle of a path cannot be put into a policy without allowing more than the
+rule: such rules only contribute the called method to the policy, see
+:py:meth:`RuleSet.policy_methods`.
+
+    {
+        "roles": {
+            "admin": {"*": ["*"]},
+            "reader": {"GET": ["/stuff", "/stuff/*"]}
+        }
+    }
+
+"""
+import fnmatch
+import json
+import os
+
+ALL = '*'
+VERBS = frozenset(['GET', 'POST', 'PUT', 'PATCH', 'HEAD', 'DELETE', ALL])
+
+
+class RuleError(Exception):
+    """ Raised if a rule set is malformed. """
+    pass
+
+
+class RuleNode(object):
+    """
+    A node of the path trie, one per path segment.
+
+    """
+    __slots__ = ('children', 'verbs', 'rest_verbs')
+
+    def __init__(self):
+        self.children = {}
+        self.verbs = set()
+        "Verbs allowed on exactly this path."
+        self.rest_verbs = set()
+        "Verbs allowed on every path below this one."
+
+    def insert(self, verb, segments):
+        node = self
+        for index, segment in enumerate(segments):
+            if segment == ALL and index == len(segments) - 1:
+                node.rest_verbs.add(verb)
+                return
+            node = node.children.setdefault(segment, RuleNode())
+        node.verbs.add(verb)
+
+    def allowed_verbs(self, segments, index=0):
+        """
+        Return the verbs allowed on a path, visiting one node per segment and
+        wildcard, i.e. proportional to the path depth.
+
+        """
+        if index == len(segments):
+            # the ARN of the root path ends with the verb, a trailing * covers it
+            return self.verbs | self.rest_verbs if index == 0 else set(self.verbs)
+        verbs = set(self.rest_verbs)
+        for key in (segments[index], ALL):
+            child = self.children.get(key)
+            if child is not None:
+                verbs |= child.allowed_verbs(segments, index + 1)
+        return verbs
+
+    def minimal_methods(self, path='', covered=frozenset()):
+        """
+        Yield ``(verb, path)`` for every allowed method not already covered by
+        a wildcard further up the trie, or by the ``*`` verb on the same path.
+        Methods below a ``*`` in the middle of a path are left out, as an ARN
+        it would match more than one segment.
+
+        """
+        def uncovered(verbs):
+            if ALL in covered or not verbs:
+                return set()
+            if ALL in verbs:
+                return set([ALL])
+            return verbs - covered
+
+        for verb in sorted(uncovered(self.verbs)):
+            yield verb, path or '/'
+        rest = uncovered(self.rest_verbs)
+        for verb in sorted(rest):
+            yield verb, path + '/*'
+
+        covered = covered | rest
+        for segment in sorted(self.children):
+            if segment == ALL:
+                continue
+            for method in self.children[segment].minimal_methods(path + '/' + segment, covered):
+                yield method
+
+
+def split_path(path):
+    return [segment for segment in path.split('/') if segment]
+
+
+def arn_matches(method, verb, path):
+    """
+    Decide whether a ``(verb, path)`` method of a policy covers a call, the
+    way API Gateway matches the method ARNs: ``*`` matches any characters,
+    the leading ``/`` is not part of the ARN.
+
+    """
+    return method[0] in (ALL, verb) and fnmatch.fnmatchcase('/'.join(split_path(path)), method[1].lstrip('/'))
+
+
+class RuleSet(object):
+    """
+    The compiled rules, loaded once per container. The tries for a role
+    combination are built on first use and then kept.
+
+    """
+    def __init__(self, roles):
+        """
+        :param roles:
+            dict of role name to a dict of verb to a list of path patterns.
+
+        :raises: RuleError
+
+        """
+        if not isinstance(roles, dict):
+            raise RuleError('roles have to be a mapping')
+        for role, verbs in roles.items():
+            if not isinstance(verbs, dict):
+                raise RuleError('rules of role {0} have to be a mapping'.format(role))
+            for verb, paths in verbs.items():
+                if verb not in VERBS:
+                    raise RuleError('invalid verb {0} in role {1}'.format(verb, role))
+                if not isinstance(paths, list):
+                    raise RuleError('paths of {0} in role {1} have to be a list'.format(verb, role))
+        self.roles = roles
+        self.tries = {}
+        self.methods = {}
+
+    def __repr__(self):
+        return '<RuleSet roles={0}>'.format(','.join(sorted(self.roles)))
+
+    @classmethod
+    def from_file(cls, file_name):
+        """
+        Load the rules from a JSON file, a relative name is looked up next to
+        this module, i.e. bundled in the zip.
+
+        """
+        if not os.path.isabs(file_name):
+            file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+        with open(file_name) as rules_file:
+            try:
+                rules = json.load(rules_file)
+            except ValueError as err:
+                raise RuleError('malformed rules file {0}: {1}'.format(file_name, err))
+        return cls(rules.get('roles', {}))
+
+    def get_trie(self, roles):
+        """ Return the trie of all rules of a combination of roles. """
+        key = frozenset(roles)
+        trie = self.tries.get(key)
+        if trie is None:
+            trie = RuleNode()
+            for role in key:
+                for verb, paths in self.roles.get(role, {}).items():
+                    for path in paths:
+                        trie.insert(verb, split_path(path))
+            self.tries[key] = trie
+        return trie
+
+    def is_allowed(self, roles, verb, path):
+        """ Decide whether the roles may call a method. """
+        verbs = self.get_trie(roles).allowed_verbs(split_path(path))
+        return ALL in verbs or verb in verbs
+
+    def policy_methods(self, roles, verb=None, path=None):
+        """
+        Return the minimal list of ``(verb, path)`` allowed for the roles, to
+        be put into a policy. Methods covered by a wildcard are left out, so
+        the policy stays small and the one cached by API Gateway covers every
+        call the roles may make, except for the rules with a ``*`` in the
+        middle of the path: they only add the called method, if it is given
+        with *verb* and *path* and they allow it.
+
+        """
+        key = frozenset(roles)
+        methods = self.methods.get(key)
+        if methods is None:
+            methods = self.methods[key] = list(self.get_trie(key).minimal_methods())
+        # a literal * in the called path would be a wildcard in the ARN
+        if verb is not None and ALL not in path and self.is_allowed(key, verb, path) and \
+                not any(arn_matches(method, verb, path) for method in methods):
+            methods = methods + [(verb, '/' + '/'.join(split_path(path)))]
+        return methods
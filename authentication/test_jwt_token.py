@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from authentication.jwt_token import JwtVerifier, b64url_encode, encode_hs256
+from authentication.token_cache import AuthFailedException
+
+
+class JwtVerifierTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1500000000
+        self.verifier = JwtVerifier(hs256_secret='secret', leeway=10, audience='api', clock=lambda: self.now)
+
+    def test_valid_token(self):
+        token = encode_hs256({'sub': 'user-1', 'aud': 'api', 'exp': self.now + 60}, 'secret')
+        self.assertEqual('user-1', self.verifier.verify(token)['sub'])
+
+    def test_wrong_secret(self):
+        token = encode_hs256({'sub': 'user-1', 'aud': 'api'}, 'other')
+        self.assertRaises(AuthFailedException, self.verifier.verify, token)
+
+    def test_time_claims_with_leeway(self):
+        self.verifier.verify(encode_hs256({'aud': 'api', 'exp': self.now - 5}, 'secret'))
+        self.assertRaises(AuthFailedException, self.verifier.verify,
+                          encode_hs256({'aud': 'api', 'exp': self.now - 11}, 'secret'))
+        self.assertRaises(AuthFailedException, self.verifier.verify,
+                          encode_hs256({'aud': 'api', 'nbf': self.now + 11}, 'secret'))
+
+    def test_wrong_audience(self):
+        token = encode_hs256({'sub': 'user-1', 'aud': ['other']}, 'secret')
+        self.assertRaises(AuthFailedException, self.verifier.verify, token)
+
+    def test_unsigned_and_malformed_tokens(self):
+        header = b64url_encode(b'{"alg": "none"}').decode('ascii')
+        payload = b64url_encode(b'{"sub": "user-1"}').decode('ascii')
+        for token in ['{0}.{1}.'.format(header, payload), 'garbage', u'\xe4.\xe4.\xe4', '']:
+            self.assertRaises(AuthFailedException, self.verifier.verify, token)
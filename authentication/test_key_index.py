@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from authentication.key_index import KeyIndex, KeyIndexError, build_index, read_key_list
+
+
+class KeyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'api_keys.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        entries = [('key-{0}'.format(i), 'user-{0}'.format(i), ['reader'] * (i % 2)) for i in range(500)]
+        self.assertEqual(500, build_index(entries, self.file_name))
+        index = KeyIndex(self.file_name)
+
+        self.assertEqual(500, len(index))
+        for key, principal_id, roles in entries:
+            self.assertEqual((principal_id, roles), index.lookup(key))
+        for i in range(500):
+            self.assertIsNone(index.lookup('other-{0}'.format(i)))
+        self.assertGreater(index.bloom_rejects, 450)
+
+    def test_empty_index(self):
+        build_index([], self.file_name)
+        self.assertIsNone(KeyIndex(self.file_name).lookup('key'))
+
+    def test_read_key_list(self):
+        key_list = os.path.join(self.directory, 'keys.txt')
+        with open(key_list, 'w') as key_file:
+            key_file.write('# key principal roles\n\nkey-1 user-1 reader,editor\nkey-2 user-2\n')
+        self.assertEqual([('key-1', 'user-1', ['reader', 'editor']), ('key-2', 'user-2', [])],
+                         list(read_key_list(key_list)))
+
+    def test_invalid_file(self):
+        with open(self.file_name, 'wb') as index_file:
+            index_file.write(b'not an index at all, not at all')
+        self.assertRaises(KeyIndexError, KeyIndex, self.file_name)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import unittest
+
+from authentication.rules import RuleError, RuleSet, arn_matches
+
+
+class RuleSetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet({
+            'admin': {'*': ['*']},
+            'reader': {'GET': ['/stuff', '/stuff/*']},
+            'editor': {'GET': ['/stuff/*/entries'], 'PUT': ['/stuff/*'], 'DELETE': ['/stuff/*/entries/*']},
+        })
+
+    def test_is_allowed(self):
+        self.assertTrue(self.rules.is_allowed(['reader'], 'GET', '/stuff'))
+        self.assertTrue(self.rules.is_allowed(['reader'], 'GET', '/stuff/1/entries'))
+        self.assertFalse(self.rules.is_allowed(['reader'], 'PUT', '/stuff/1'))
+        self.assertTrue(self.rules.is_allowed(['editor'], 'DELETE', '/stuff/1/entries/2'))
+        self.assertFalse(self.rules.is_allowed(['editor'], 'DELETE', '/stuff/1/other/2'))
+        self.assertTrue(self.rules.is_allowed(['reader', 'editor'], 'PUT', '/stuff/1'))
+        self.assertTrue(self.rules.is_allowed(['admin'], 'PATCH', '/anything/at/all'))
+        self.assertFalse(self.rules.is_allowed(['unknown'], 'GET', '/stuff'))
+
+    def test_policy_methods_merged_under_wildcards(self):
+        self.assertEqual([('GET', '/stuff'), ('GET', '/stuff/*')], self.rules.policy_methods(['reader']))
+        self.assertEqual([('GET', '/stuff'), ('GET', '/stuff/*'), ('PUT', '/stuff/*')],
+                         self.rules.policy_methods(['reader', 'editor']))
+        self.assertEqual([('*', '/*')], self.rules.policy_methods(['admin', 'reader', 'editor']))
+        self.assertEqual([], self.rules.policy_methods([]))
+
+    def test_mid_path_wildcards_only_allow_the_called_method(self):
+        self.assertEqual([('PUT', '/stuff/*'), ('DELETE', '/stuff/1/entries/2')],
+                         self.rules.policy_methods(['editor'], 'DELETE', 'stuff/1/entries/2'))
+        self.assertEqual([('PUT', '/stuff/*')], self.rules.policy_methods(['editor'], 'DELETE', 'stuff/1/other/2'))
+        self.assertEqual([('PUT', '/stuff/*')], self.rules.policy_methods(['editor'], 'DELETE', 'stuff/*/entries/*'))
+        self.assertEqual([('PUT', '/stuff/*')], self.rules.policy_methods(['editor']))
+
+    def test_policies_allow_what_the_rules_allow(self):
+        segments = ['stuff', 'entries', '1']
+        paths = ['/'] + ['/' + '/'.join(p) for depth in range(1, 5) for p in itertools.product(segments, repeat=depth)]
+        for roles in [['reader'], ['editor'], ['reader', 'editor'], ['admin']]:
+            for verb in ['GET', 'PUT', 'DELETE']:
+                for called in paths:
+                    methods = self.rules.policy_methods(roles, verb, called)
+                    # as cached by API Gateway for the following calls with the token
+                    for path in paths:
+                        allowed = any(arn_matches(method, verb, path) for method in methods)
+                        if allowed or path == called:
+                            self.assertEqual(self.rules.is_allowed(roles, verb, path), allowed,
+                                             (roles, verb, called, path, methods))
+
+    def test_invalid_rules(self):
+        self.assertRaises(RuleError, RuleSet, {'reader': {'FETCH': ['/stuff']}})
+        self.assertRaises(RuleError, RuleSet, {'reader': {'GET': '/stuff'}})
+
+    def test_bundled_rules(self):
+        rules = RuleSet.from_file('rules.json')
+        self.assertTrue(rules.is_allowed(['editor'], 'PATCH', '/stuff/1'))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from authentication.token_cache import AuthFailedException, TokenCache, tokens_equal
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(max_size=10, accept_ttl=300, reject_ttl=30, clock=self.clock)
+        self.calls = []
+
+    def verifier(self, token):
+        self.calls.append(token)
+        if token != 'good':
+            raise AuthFailedException(token)
+        return 'user-1'
+
+    def test_accepted_token_verified_once_per_ttl(self):
+        for _ in range(3):
+            self.assertEqual('user-1', self.cache.verify('good', self.verifier))
+        self.assertEqual(['good'], self.calls)
+
+        self.clock.now += 301
+        self.cache.verify('good', self.verifier)
+        self.assertEqual(['good', 'good'], self.calls)
+
+    def test_rejected_token_negative_cached_with_own_ttl(self):
+        for _ in range(3):
+            self.assertRaises(AuthFailedException, self.cache.verify, 'bad', self.verifier)
+        self.assertEqual(['bad'], self.calls)
+
+        self.clock.now += 31
+        self.assertRaises(AuthFailedException, self.cache.verify, 'bad', self.verifier)
+        self.assertEqual(['bad', 'bad'], self.calls)
+
+    def test_verifier_errors_are_not_cached(self):
+        def broken(token):
+            self.calls.append(token)
+            raise IOError('db down')
+
+        self.assertRaises(IOError, self.cache.verify, 'good', broken)
+        self.assertEqual('user-1', self.cache.verify('good', self.verifier))
+
+    def test_tokens_equal(self):
+        self.assertTrue(tokens_equal(u'token', 'token'))
+        self.assertFalse(tokens_equal('token', 'other'))
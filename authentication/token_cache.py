@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import hmac
+import logging
+import time
+
+from utils.cache import FRESH, ResponseCache
+from utils.coalesce import SingleFlight
+
+log = logging.getLogger('authentication')
+
+
+class AuthFailedException(Exception):
+    pass
+
+
+def token_digest(token):
+    """
+    Return the SHA-256 digest of a token, tokens are only kept and looked up
+    in this form.
+
+    """
+    if not isinstance(token, bytes):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+def tokens_equal(token, expected):
+    """ Compare two tokens in constant time. """
+    return hmac.compare_digest(token_digest(token), token_digest(expected))
+
+
+class TokenCache(object):
+    """
+    Bounded in-memory cache of token verification results, kept at module
+    level so it survives warm invocations of the authorizer.
+
+    Accepted and rejected tokens have separate TTLs, a rejected token is
+    usually cached for a shorter time so a newly issued token works soon.
+    Concurrent lookups of the same uncached token share one verification, so
+    a slow verifier (DB, OAuth provider) is called at most once per token and
+    TTL window. Errors of the verifier itself are not cached.
+
+    """
+    def __init__(self, max_size=1024, accept_ttl=300, reject_ttl=30, clock=time.time):
+        self.accepted = ResponseCache(max_size=max_size, ttl=accept_ttl, clock=clock)
+        self.rejected = ResponseCache(max_size=max_size, ttl=reject_ttl, clock=clock)
+        self.in_flight = SingleFlight()
+        self.verifications = 0
+
+    def __repr__(self):
+        return '<TokenCache accepted={0} rejected={1}>'.format(len(self.accepted), len(self.rejected))
+
+    def verify(self, token, verifier):
+        """
+        Return the claims of a token, verifying it only if there is no
+        cached result.
+
+        :param token:
+            The authorization token.
+
+        :param verifier:
+            Callable taking the token and returning its claims, i.e.
+            :py:meth:`jwt_token.JwtVerifier.verify`, it raises
+            :py:exc:`AuthFailedException` for invalid tokens.
+
+        :return:
+            dict of the claims, shared by all lookups of the token, so it must
+            not be modified.
+
+        :raises: AuthFailedException
+
+        """
+        digest = token_digest(token)
+        claims, cached = self._lookup(digest)
+        if cached:
+            return claims
+        return self.in_flight.do(digest, lambda: self._verify(digest, token, verifier))
+
+    def _lookup(self, digest):
+        claims, state = self.accepted.get(digest)
+        if state == FRESH:
+            return claims, True
+        if self.rejected.get(digest)[1] == FRESH:
+            raise AuthFailedException('token rejected (cached)')
+        return None, False
+
+    def _verify(self, digest, token, verifier):
+        # somebody else may have verified it since our lookup
+        claims, cached = self._lookup(digest)
+        if cached:
+            return claims
+
+        self.verifications += 1
+        try:
+            claims = verifier(token)
+        except AuthFailedException:
+            self.rejected.set(digest, None)
+            raise
+        self.accepted.set(digest, claims)
+        return claims
+
+    def stats(self):
+        return dict(verifications=self.verifications,
+                    accepted=self.accepted.stats(),
+                    rejected=self.rejected.stats())
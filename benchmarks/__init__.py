@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the lambda functions and the shared utils, run from the
+repository root, i.e. ``python -m benchmarks.bench_codecs``.
+
+"""
+import json
+import os
+import random
+import re
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PLAYBOOK = os.path.join(ROOT, 'ansible', 'playbook.yml')
+
+AUTHORIZER = 'authentication'
+"Code of the function bare events with a ``type`` go to."
+
+METHODS = {'GET': 'get_call', 'POST': 'post_call', 'PUT': 'put_call', 'PATCH': 'patch_call',
+           'DELETE': 'delete_call'}
+"Code of the function bare events go to by their HTTP method."
+
+FUNCTION_PATTERN = re.compile(r'-\s*\{([^}]*)\}')
+
+
+def read_functions(playbook=PLAYBOOK):
+    """
+    Read the ``functions`` list of the playbook.
+
+    :return: list of dicts with ``code``, ``aws_name`` and ``handler``
+    """
+    with open(playbook) as playbook_file:
+        text = playbook_file.read()
+    try:
+        import yaml
+    except ImportError:
+        # the entries are flow mappings, one per line
+        section = text.split('functions:', 1)[1].split('tasks:', 1)[0]
+        return [dict((key.strip(), value.strip().strip("'\"")) for key, _, value in
+                     (field.partition(':') for field in entry.split(',')))
+                for entry in FUNCTION_PATTERN.findall(section)]
+    return yaml.safe_load(text)[0]['vars']['functions']
+
+
+def route(record, names):
+    """
+    Find the function of a recorded event.
+
+    :param names: dict of code, aws_name and handler to the function code
+    :return: tuple ``(code, event)``, the code is None if no function matches
+    """
+    if isinstance(record, dict) and 'function' in record and 'event' in record:
+        return names.get(record['function']), record['event']
+    if isinstance(record, dict):
+        if 'type' in record:
+            return AUTHORIZER, record
+        if 'httpMethod' in record:
+            event = record.get('body')
+            if isinstance(event, basestring):
+                event = json.loads(event) if event.strip() else {}
+            return METHODS.get(record['httpMethod'].upper()), event if event is not None else {}
+    return None, record
+
+
+def read_events(file_name, repeat=1, limit=None):
+    """ Stream the recorded events, *repeat* times, without reading the file at once. """
+    count = 0
+    for _ in range(repeat):
+        with open(file_name) as events:
+            for line in events:
+                if not line.strip():
+                    continue
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield json.loads(line)
+
+
+def sample_stuff(index, rng):
+    """ One item like the get_stuff backend returns them. """
+    return {
+        'stuff_id': 'stuff-{0:08d}'.format(index),
+        'name': u'Stuff n\xb0{0}'.format(index),
+        'active': rng.random() > 0.2,
+        'score': round(rng.random() * 100, 3),
+        'count': rng.randint(0, 100000),
+        'created': '2016-08-{0:02d}T12:{1:02d}:00Z'.format(rng.randint(1, 28), rng.randint(0, 59)),
+        'tags': ['tag{0}'.format(rng.randint(0, 50)) for _ in range(rng.randint(0, 5))],
+        'owner': {'owner_id': rng.randint(1, 5000), 'email': 'user{0}@example.com'.format(index)},
+    }
+
+
+def sample_stuff_response(items, seed=42):
+    """
+    A representative reply of the get_stuff service.
+
+    :param items: number of items in the result
+
+    :return: dict
+
+    """
+    rng = random.Random(seed)
+    return {
+        'success': True,
+        'message': '',
+        'stuff': [sample_stuff(i, rng) for i in range(items)],
+    }
+
+
+def best_of(function, number, repeat=5):
+    """
+    Run *function* *number* times per round and return the best time per call
+    in seconds.
+
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of the authorizer ``lambda_handler`` for a valid and an invalid
+token as seen by a warm container, and of building its policy alone.
+Logging is disabled unless asked for, it would dominate the numbers.
+
+    python -m benchmarks.bench_authorizer
+
+"""
+from __future__ import print_function
+
+import logging
+import os
+import sys
+
+import argh
+
+from benchmarks import best_of
+from utils import metrics
+from utils.logs import Invocation
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'authentication')
+
+
+def load_handler():
+    """ Import the authorizer the way Lambda does, from its own directory. """
+    sys.path.insert(0, FUNCTION_DIR)
+    import lambda_function
+    return lambda_function
+
+
+def sample_event(token, stage='dev', resource='GET/stuff'):
+    return {
+        'type': 'TOKEN',
+        'authorizationToken': token,
+        'methodArn': 'arn:aws:execute-api:eu-west-1:123456789012:abcdef1234/{0}/{1}'.format(stage, resource),
+    }
+
+
+@argh.dispatch_command
+@argh.arg('-n', '--number', type=int, help='calls per timing round')
+@argh.arg('-l', '--log', help='keep logging enabled (to /dev/null)')
+def bench_authorizer(number=5000, log=False):
+    devnull = open(os.devnull, 'w')
+    logging.basicConfig(stream=devnull)
+    Invocation.stream = metrics.stream = devnull
+    if not log:
+        logging.disable(logging.CRITICAL)
+    module = load_handler()
+    handler = module.lambda_handler
+
+    print('{0:>10} {1:>12} {2:>12}'.format('token', 'us/call', 'calls/s'))
+    for name, token in [('valid', 'somethingsomethingsomethingsomething'), ('invalid', 'wrong'), ('missing', '')]:
+        event = sample_event(token)
+        per_call = best_of(lambda: handler(event, {}), number)
+        print('{0:>10} {1:>12.1f} {2:>12.0f}'.format(name, per_call * 1e6, 1 / per_call))
+
+    def build_policy():
+        policy = module.AuthPolicy('user-1', '123456789012')
+        policy.restApiId, policy.region, policy.stage = 'abcdef1234', 'eu-west-1', 'dev'
+        policy.allow_all_methods()
+        return policy.build()
+
+    per_call = best_of(build_policy, number)
+    print('{0:>10} {1:>12.1f} {2:>12.0f}'.format('policy', per_call * 1e6, 1 / per_call))
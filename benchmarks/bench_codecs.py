@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the wire codecs of :py:mod:`utils.serialization` on representative
+get_stuff responses: encode time, decode time and payload size.
+
+    python -m benchmarks.bench_codecs -i 1 10 100 1000
+
+"""
+from __future__ import print_function
+
+import argh
+
+from benchmarks import best_of, sample_stuff_response
+from utils.serialization import codecs_by_name
+
+
+@argh.dispatch_command
+@argh.arg('-i', '--items', nargs='+', type=int, help='result sizes (items per response) to test')
+@argh.arg('-n', '--number', type=int, help='calls per timing round')
+def bench_codecs(items=(1, 10, 100, 1000), number=200):
+    print('{0:>6} {1:>8} {2:>10} {3:>12} {4:>12}'.format('items', 'codec', 'bytes', 'encode us', 'decode us'))
+    for count in items:
+        response = sample_stuff_response(count)
+        rounds = max(1, number // max(1, count // 10))
+        for name, codec in sorted(codecs_by_name.items()):
+            body = codec.encode(response)
+            assert codec.decode(body) == response
+            encode = best_of(lambda: codec.encode(response), rounds)
+            decode = best_of(lambda: codec.decode(body), rounds)
+            print('{0:>6} {1:>8} {2:>10} {3:>12.1f} {4:>12.1f}'.format(
+                count, name, len(body), encode * 1e6, decode * 1e6))
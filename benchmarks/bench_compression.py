@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the CPU vs. bytes trade-off of the message compressions in
+:py:mod:`utils.serialization` on representative get_stuff responses.
+
+Lambda assigns CPU in proportion to the memory size, a full vCPU at 1769 MB,
+so the times measured here are scaled to the given memory size to estimate
+the cost inside a function (128 MB gets about 7% of a vCPU).
+
+    python -m benchmarks.bench_compression -m 128 -i 10 100 1000
+
+"""
+from __future__ import print_function
+
+import argh
+
+from benchmarks import best_of, sample_stuff_response
+from utils.serialization import compressors, get_codec
+
+FULL_VCPU_MEMORY = 1769.0
+"Lambda memory size in MB which gets one full vCPU."
+
+
+@argh.dispatch_command
+@argh.arg('-i', '--items', nargs='+', type=int, help='result sizes (items per response) to test')
+@argh.arg('-l', '--levels', nargs='+', type=int, help='compression levels to test')
+@argh.arg('-m', '--memory', type=int, help='Lambda memory size in MB to estimate the CPU time for')
+@argh.arg('-c', '--codec', help='codec the responses are encoded with')
+@argh.arg('-n', '--number', type=int, help='calls per timing round')
+def bench_compression(items=(10, 100, 1000), levels=(1, 6, 9), memory=128, codec='json', number=50):
+    cpu_share = min(1.0, memory / FULL_VCPU_MEMORY)
+    print('{0} codec, times scaled to {1} MB Lambda ({2:.1%} vCPU)'.format(codec, memory, cpu_share))
+    print('{0:>6} {1:>6} {2:>5} {3:>9} {4:>9} {5:>6} {6:>12} {7:>12} {8:>14}'.format(
+        'items', 'algo', 'level', 'raw', 'bytes', 'ratio', 'compress ms', 'decomp. ms', 'saved KB/cpu ms'))
+
+    for count in items:
+        body = get_codec(codec).encode(sample_stuff_response(count))
+        rounds = max(1, number // max(1, count // 100))
+        for name, compressor in sorted(compressors.items()):
+            for level in levels:
+                compressed = compressor.compress(body, level)
+                assert compressor.decompress(compressed) == body
+                compress_time = best_of(lambda: compressor.compress(body, level), rounds) / cpu_share
+                decompress_time = best_of(lambda: compressor.decompress(compressed), rounds) / cpu_share
+                saved = (len(body) - len(compressed)) / 1024.0
+                print('{0:>6} {1:>6} {2:>5} {3:>9} {4:>9} {5:>6.2f} {6:>12.3f} {7:>12.3f} {8:>14.1f}'.format(
+                    count, name, level, len(body), len(compressed), float(len(compressed)) / len(body),
+                    compress_time * 1e3, decompress_time * 1e3,
+                    saved / ((compress_time + decompress_time) * 1e3)))
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro benchmark of the inline JWT verification of the authorizer: a full
+HS256 / RS256 verification and a token cache hit, per call.
+
+    python -m benchmarks.bench_jwt
+
+"""
+from __future__ import print_function
+
+import json
+import time
+
+import argh
+
+from authentication.jwt_token import JwtVerifier, b64url_encode, encode_hs256
+from authentication.token_cache import TokenCache
+from benchmarks import best_of
+
+try:
+    from Crypto.PublicKey import RSA
+except ImportError:  # pycrypto is optional, without it only HS256 is measured
+    RSA = None
+
+
+def encode_rs256(claims, private_key):
+    from Crypto.Hash import SHA256
+    from Crypto.Signature import PKCS1_v1_5
+
+    segments = [b64url_encode(json.dumps({'alg': 'RS256', 'typ': 'JWT'}).encode('utf-8')),
+                b64url_encode(json.dumps(claims).encode('utf-8'))]
+    signing_input = b'.'.join(segments)
+    signature = PKCS1_v1_5.new(private_key).sign(SHA256.new(signing_input))
+    return b'.'.join(segments + [b64url_encode(signature)]).decode('ascii')
+
+
+@argh.dispatch_command
+@argh.arg('-n', '--number', type=int, help='calls per timing round')
+@argh.arg('-b', '--bits', type=int, help='RSA key size')
+def bench_jwt(number=2000, bits=2048):
+    claims = {'sub': 'user-1', 'aud': 'api', 'exp': int(time.time()) + 3600}
+    tokens = [('HS256', JwtVerifier(hs256_secret='secret', audience='api'), encode_hs256(claims, 'secret'))]
+    if RSA is not None:
+        private_key = RSA.generate(bits)
+        verifier = JwtVerifier(rs256_public_key=private_key.publickey().exportKey(), audience='api')
+        tokens.append(('RS256', verifier, encode_rs256(claims, private_key)))
+    else:
+        print('pycrypto not installed, skipping RS256')
+
+    print('{0:>8} {1:>16} {2:>12}'.format('alg', 'path', 'us/call'))
+    for algorithm, verifier, token in tokens:
+        assert verifier.verify(token)['sub'] == 'user-1'
+        full = best_of(lambda: verifier.verify(token), number)
+
+        cache = TokenCache()
+        cache.verify(token, verifier.verify)
+
+        def cached():
+            verifier.check_times(cache.verify(token, verifier.verify))
+
+        hit = best_of(cached, number)
+        print('{0:>8} {1:>16} {2:>12.1f}'.format(algorithm, 'verify', full * 1e6))
+        print('{0:>8} {1:>16} {2:>12.1f}'.format(algorithm, 'cache hit', hit * 1e6))
@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the bundled API key index: build time, size, time to open the
+mapped file in a cold container and lookup times for known keys, unknown
+keys rejected by the Bloom filter and unknown keys searched in the records,
+with the peak RSS against the Lambda memory size.
+
+    python -m benchmarks.bench_key_index --keys 1000000
+
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import argh
+
+from authentication.key_index import KeyIndex, build_index, key_digest
+from benchmarks import best_of
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def build(file_name, keys):
+    entries = (('api-key-{0:012d}'.format(i), 'user-{0}'.format(i), ['reader']) for i in range(keys))
+    build_index(entries, file_name)
+
+
+@argh.dispatch_command
+@argh.arg('-k', '--keys', type=int, help='number of API keys in the index')
+@argh.arg('-n', '--number', type=int, help='lookups per timing round')
+@argh.arg('-m', '--memory', type=int, help='Lambda memory size in MB')
+def bench_key_index(keys=1000000, number=20000, memory=128):
+    directory = tempfile.mkdtemp()
+    file_name = os.path.join(directory, 'api_keys.idx')
+    try:
+        # built in a child process, so its memory does not count for the lookups
+        start = time.time()
+        builder = multiprocessing.Process(target=build, args=(file_name, keys))
+        builder.start()
+        builder.join()
+        print('build: {0} keys in {1:.1f} s, {2:.1f} MB'.format(keys, time.time() - start,
+                                                            os.path.getsize(file_name) / 1048576.0))
+
+        rss_before = max_rss_mb()
+        load = best_of(lambda: KeyIndex(file_name), 100)
+        index = KeyIndex(file_name)
+
+        rng = random.Random(42)
+        known = ['api-key-{0:012d}'.format(rng.randrange(keys)) for _ in range(number)]
+        unknown = ['unknown-{0}'.format(i) for i in range(number)]
+        digests = [key_digest(key) for key in unknown]
+        known_iter, unknown_iter, digest_iter = iter(known * 10), iter(unknown * 10), iter(digests * 10)
+
+        hit = best_of(lambda: index.lookup(next(known_iter)), number, repeat=3)
+        reject = best_of(lambda: index.lookup(next(unknown_iter)), number, repeat=3)
+        search = best_of(lambda: index.find(next(digest_iter)), number, repeat=3)
+
+        print('{0:>28} {1:>12}'.format('path', 'us/call'))
+        print('{0:>28} {1:>12.1f}'.format('open (cold container)', load * 1e6))
+        print('{0:>28} {1:>12.1f}'.format('known key', hit * 1e6))
+        print('{0:>28} {1:>12.1f}'.format('unknown key, Bloom reject', reject * 1e6))
+        print('{0:>28} {1:>12.1f}'.format('binary search only', search * 1e6))
+        print('Bloom rejects: {0:.2%} of unknown keys'.format(
+            float(index.bloom_rejects) / (index.lookups - 3 * number)))
+        print('peak RSS: {0:.1f} MB before lookups, {1:.1f} MB after, Lambda memory {2} MB'.format(
+            rss_before, max_rss_mb(), memory))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reads a whole result from the fake get_stuff service as one reply and
+page by page with streamed chunks (see ``GetStuffViaAMQPClient.get_page``),
+and compares the time, the largest message and the most items held at once.
+
+    python -m benchmarks.bench_paging -i 1000 10000 50000 -l 1000 -c 100
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import argh
+
+from benchmarks import ROOT
+from benchmarks.fake_service import FakeService, memory_connection
+
+
+def read_single(client, routing_key, limit):
+    response = client.call({'stuff_id': 'all'}, routing_key=routing_key)
+    return len(response['stuff']), len(response['stuff'])
+
+
+def read_pages(client, routing_key, limit):
+    request = {'stuff_id': 'all', 'limit': limit}
+    items = held = 0
+    while True:
+        page = client.get_page(request)
+        items += len(page['stuff'])
+        held = max(held, len(page['stuff']))
+        if not page['cursor']:
+            return items, held
+        request = dict(request, cursor=page['cursor'])
+
+
+@argh.dispatch_command
+@argh.arg('-i', '--items', nargs='+', type=int, help='items in the result')
+@argh.arg('-l', '--limit', type=int, help='items per page')
+@argh.arg('-c', '--chunk-size', type=int, help='items per chunk')
+def bench_paging(items=(1000, 10000, 50000), limit=1000, chunk_size=100):
+    sys.path.insert(0, os.path.join(ROOT, 'get_call'))
+    import lambda_function as module
+    from utils import logs, rpc_client
+
+    logs.Invocation.stream = open(os.devnull, 'w')
+
+    connection = memory_connection(0.0001)
+    rpc_client.connection_manager = rpc_client.ConnectionManager(lambda: connection)
+    module.CHUNK_SIZE = chunk_size
+    client = module.GetStuffViaAMQPClient()
+
+    print('{0:>8} {1:>8} {2:>10} {3:>14} {4:>10}'.format('items', 'mode', 'seconds', 'largest bytes', 'held'))
+    for count in items:
+        for mode, read in [('single', read_single), ('paged', read_pages)]:
+            service = FakeService(module.AMQP_EXCHANGE, module.ROUTING_KEY, items=count, envelope=False)
+            service.start()
+            service.ready.wait()
+            try:
+                start = time.time()
+                received, held = read(client, module.ROUTING_KEY, limit)
+                seconds = time.time() - start
+            finally:
+                service.stop()
+            assert received == count
+            print('{0:>8} {1:>8} {2:>10.3f} {3:>14} {4:>10}'.format(count, mode, seconds, service.largest, held))
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the AMQP RPC client without a broker: requests go over kombu's
+in-memory transport to a fake service in a thread of its own, which answers
+after a configurable latency with a payload of a configurable size.
+
+Measures sequential calls, a window of concurrent (pipelined) calls and
+batches of calls, for a plain RpcClient and the GetStuffViaAMQPClient of the
+get_call function, and saves the results as JSON to compare commits:
+
+    python -m benchmarks.bench_rpc --output build/bench_rpc.json
+    python -m benchmarks.bench_rpc --compare build/bench_rpc.json
+
+"""
+from __future__ import print_function
+
+import collections
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import argh
+
+from benchmarks.fake_service import FakeService, memory_connection
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'get_call')
+
+try:
+    import tracemalloc
+except ImportError:  # python 2, only the growth of gc tracked objects is reported
+    tracemalloc = None
+
+
+def load_handler():
+    """ Import get_call the way Lambda does, the RPC client needs its config. """
+    sys.path.insert(0, FUNCTION_DIR)
+    import lambda_function
+    return lambda_function
+
+
+def percentiles(latencies):
+    """ Exact percentiles of a list of latencies in seconds, in ms. """
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+
+    def at(percent):
+        return round(ordered[int(round(percent / 100.0 * (len(ordered) - 1)))] * 1000, 3)
+
+    return dict(p50=at(50), p95=at(95), p99=at(99), max=round(ordered[-1] * 1000, 3),
+                mean=round(sum(ordered) / len(ordered) * 1000, 3))
+
+
+def sequential(client, messages, routing_key, window, batch):
+    latencies = []
+    for message in messages:
+        start = time.time()
+        client.call(message, routing_key=routing_key)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def concurrent(client, messages, routing_key, window, batch):
+    """ Keep *window* calls in flight, as a handler doing async calls would. """
+    latencies = []
+    in_flight = collections.deque()
+    for message in messages:
+        if len(in_flight) >= window:
+            start, future = in_flight.popleft()
+            future.result()
+            latencies.append(time.time() - start)
+        in_flight.append((time.time(), client.call_async(message, routing_key=routing_key)))
+    for start, future in in_flight:
+        future.result()
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def batched(client, messages, routing_key, window, batch):
+    """ Scatter-gather *batch* calls at a time, every call takes as long as its batch. """
+    latencies = []
+    for offset in range(0, len(messages), batch):
+        chunk = messages[offset:offset + batch]
+        start = time.time()
+        results = client.call_many(chunk, routing_key=routing_key)
+        errors = [r.error for r in results if r.error]
+        if errors:
+            raise errors[0]
+        latencies.extend([time.time() - start] * len(chunk))
+    return latencies
+
+
+PATTERNS = collections.OrderedDict([('sequential', sequential), ('concurrent', concurrent), ('batched', batched)])
+
+
+def measure(pattern, client, messages, routing_key, window, batch):
+    """
+    Run a pattern and return its latencies, duration and allocations.
+
+    """
+    from utils import metrics
+
+    metrics.reset()
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    latencies = pattern(client, messages, routing_key, window, batch)
+    seconds = time.time() - start
+
+    allocations = {}
+    if tracemalloc is not None:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations.update(peak_bytes=peak, retained_bytes_per_call=round(float(current) / len(messages), 1))
+    gc.collect()
+    allocations['retained_objects_per_call'] = round(float(len(gc.get_objects()) - objects_before) / len(messages), 3)
+
+    return dict(calls=len(messages),
+                seconds=round(seconds, 4),
+                calls_per_s=round(len(messages) / seconds, 1),
+                latency_ms=percentiles(latencies),
+                phases_ms=metrics.dump(),
+                allocations=allocations)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=open(os.devnull, 'w')).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline_file):
+    with open(baseline_file) as baseline_json:
+        baseline = json.load(baseline_json)
+    print('\ncompared to {0} ({1}):'.format(baseline_file, baseline['meta'].get('commit')))
+    print('{0:>22} {1:>12} {2:>12}'.format('', 'calls/s', 'p99'))
+    for name, result in sorted(results.items()):
+        old = baseline['results'].get(name)
+        if old:
+            print('{0:>22} {1:>+11.1%} {2:>+11.1%}'.format(
+                name, result['calls_per_s'] / old['calls_per_s'] - 1,
+                result['latency_ms']['p99'] / old['latency_ms']['p99'] - 1))
+
+
+@argh.dispatch_command
+@argh.arg('-n', '--number', type=int, help='calls per pattern and client')
+@argh.arg('-l', '--latency-ms', type=float, help='mean latency of the fake service')
+@argh.arg('-j', '--jitter-ms', type=float, help='standard deviation of the service latency')
+@argh.arg('-i', '--items', type=int, help='stuff items per reply, sets the payload size')
+@argh.arg('-w', '--window', type=int, help='calls in flight for the concurrent pattern')
+@argh.arg('-b', '--batch', type=int, help='calls per batch for the batched pattern')
+@argh.arg('-p', '--poll-ms', type=float, help='polling interval of the memory transport')
+@argh.arg('-o', '--output', type=str, help='save the results to this JSON file')
+@argh.arg('-c', '--compare', type=str, help='JSON file of an earlier run to compare with')
+def bench_rpc(number=500, latency_ms=2.0, jitter_ms=0.5, items=10, window=10, batch=10, poll_ms=0.1,
+              output=None, compare=None):
+    module = load_handler()
+    from utils import logs, rpc_client
+
+    logs.Invocation.stream = open(os.devnull, 'w')
+    polling_interval = poll_ms / 1000.0
+    connection = memory_connection(polling_interval)
+    rpc_client.connection_manager = rpc_client.ConnectionManager(lambda: connection)
+
+    class BenchClient(rpc_client.RpcClient):
+        service = 'bench'
+        response_routing_key = 'bench_response'
+        send_exchange_name = 'bench_exchange'
+        send_routing_key = 'bench'
+
+    clients = [('rpc', BenchClient(), 'bench', 'bench_exchange', True),
+               ('get_stuff', module.GetStuffViaAMQPClient(), module.ROUTING_KEY, module.AMQP_EXCHANGE, False)]
+
+    results = collections.OrderedDict()
+    print('{0:>22} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12}'.format(
+        '', 'calls/s', 'p50 ms', 'p95 ms', 'p99 ms', 'objects/call'))
+    for client_name, client, routing_key, exchange_name, envelope in clients:
+        service = FakeService(exchange_name, routing_key, latency_ms, jitter_ms, items, envelope,
+                              polling_interval)
+        service.start()
+        service.ready.wait()
+        try:
+            for pattern_name, pattern in PATTERNS.items():
+                # distinct requests, so the coalescing of get_stuff does not kick in
+                messages = [{'stuff_id': 'stuff-{0}-{1}'.format(pattern_name, i)} for i in range(number)]
+                result = measure(pattern, client, messages, routing_key, window, batch)
+                name = '{0}/{1}'.format(client_name, pattern_name)
+                results[name] = result
+                print('{0:>22} {1:>10.0f} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>12.2f}'.format(
+                    name, result['calls_per_s'], result['latency_ms']['p50'], result['latency_ms']['p95'],
+                    result['latency_ms']['p99'], result['allocations']['retained_objects_per_call']))
+        finally:
+            service.stop()
+
+    document = dict(meta=dict(commit=git_commit(), python=platform.python_version(), timestamp=int(time.time()),
+                              max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+                              number=number, latency_ms=latency_ms, jitter_ms=jitter_ms, items=items,
+                              window=window, batch=batch, poll_ms=poll_ms),
+                    results=results)
+    if output:
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(output, 'w') as output_json:
+            json.dump(document, output_json, indent=2, sort_keys=True)
+        print('saved to {0}'.format(output))
+    if compare:
+        compare_results(results, compare)
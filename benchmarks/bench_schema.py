@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the request validators compiled by :py:mod:`utils.schema` with the
+generic interpreter of the same schema, for valid requests and for requests
+rejected at the first and at the last field.
+
+    python -m benchmarks.bench_schema -f 2 8 32
+
+"""
+from __future__ import print_function
+
+import collections
+
+import argh
+
+from benchmarks import best_of
+from utils.schema import Field, check, compile_schema
+
+
+def sample_schema(fields):
+    """ A schema of *fields* fields, cycling through the kinds of constraints. """
+    kinds = [
+        lambda: Field('string', required=True, blank=False, max_length=128),
+        lambda: Field(('string', 'integer'), blank=False, max_length=64),
+        lambda: Field('integer', minimum=0, maximum=1000),
+        lambda: Field('string', enum=('open', 'closed', 'pending')),
+        lambda: Field('number', minimum=0.0),
+        lambda: Field('array', max_length=10),
+        lambda: Field('boolean'),
+        lambda: Field('string', pattern=r'[a-z]+-\d+$'),
+    ]
+    values = ['stuff-00000001', 'user-1', 42, 'open', 1.5, ['a', 'b'], True, 'item-7']
+    schema = collections.OrderedDict()
+    request = {}
+    for index in range(fields):
+        name = 'field_{0:02d}'.format(index)
+        schema[name] = kinds[index % len(kinds)]()
+        request[name] = values[index % len(values)]
+    return dict(schema), request
+
+
+@argh.dispatch_command
+@argh.arg('-f', '--fields', nargs='+', type=int, help='fields per schema to test')
+@argh.arg('-n', '--number', type=int, help='calls per timing round')
+def bench_schema(fields=(2, 8, 32), number=20000):
+    print('{0:>6} {1:>16} {2:>16} {3:>14} {4:>10}'.format('fields', 'request', 'interpreted us', 'compiled us',
+                                                           'speedup'))
+    for count in fields:
+        schema, valid = sample_schema(count)
+        validate = compile_schema('bench', schema)
+        names = sorted(schema)
+        requests = collections.OrderedDict([
+            ('valid', valid),
+            ('not an object', []),
+            ('first invalid', dict(valid, **{names[0]: ''})),
+            ('last invalid', dict(valid, **{names[-1]: {}})),
+        ])
+        for label, request in requests.items():
+            assert validate(request) == check(schema, request)
+            interpreted = best_of(lambda: check(schema, request), number)
+            compiled = best_of(lambda: validate(request), number)
+            print('{0:>6} {1:>16} {2:>16.2f} {3:>14.2f} {4:>9.1f}x'.format(
+                count, label, interpreted * 1e6, compiled * 1e6, interpreted / compiled))
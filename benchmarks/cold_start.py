@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cold start of every function: the time to import it, with the import time
+of every module like ``python -X importtime``, and the latency of its first
+and second invocation. Fails if a function takes longer than its
+``cold_start_ms`` in the playbook (import plus first invocation).
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start -f get_call --noop --importtime
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+import argh
+
+from benchmarks import PLAYBOOK, ROOT, read_events, read_functions, route
+from benchmarks.container import Container
+
+NOOP = {'noop': True, 'skiplog': True}
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def first_events(events_file, functions):
+    """ The first recorded event of every function. """
+    names = {}
+    for function in functions:
+        for key in ('code', 'aws_name', 'handler'):
+            names[function[key]] = function['code']
+    events = {}
+    for record in read_events(events_file):
+        code, event = route(record, names)
+        if code is not None:
+            events.setdefault(code, event)
+    return events
+
+
+def print_imports(imports, threshold_us):
+    print('import time: self [us] | cumulative | imported package')
+    for depth, name, self_us, cumulative_us in imports:
+        if cumulative_us >= threshold_us:
+            print('import time: {0:>9} | {1:>10} | {2}{3}'.format(self_us, cumulative_us, '  ' * depth, name))
+
+
+def measure(function, event, rounds, options):
+    """
+    Start *rounds* fresh containers of a function and call each twice.
+
+    :return: dict of medians in ms, and the imports of the last round
+    """
+    samples = dict(start=[], init=[], first=[], warm=[])
+    for _ in range(rounds):
+        container = Container(function, options)
+        try:
+            first = container.invoke('cold', event)
+            warm = container.invoke('warm', event)
+        finally:
+            container.stop()
+        samples['start'].append(container.start_ms)
+        samples['init'].append(container.init_ms)
+        samples['first'].append(first['duration_ms'])
+        samples['warm'].append(warm['duration_ms'])
+    result = dict((name, round(median(values), 2)) for name, values in samples.items())
+    cold_starts = [init_ms + first_ms for init_ms, first_ms in zip(samples['init'], samples['first'])]
+    result.update(cold_start=round(median(cold_starts), 2), kombu=first['kombu'], status=first['status'],
+                  imports=container.ready.get('imports', []))
+    return result
+
+
+@argh.dispatch_command
+@argh.arg('-f', '--only', type=str, action='append', help='code of a function to measure, default all')
+@argh.arg('-e', '--events', type=str, help='JSONL file the first event of every function is taken from')
+@argh.arg('--noop', help='call with a noop (keep warm) event instead of a recorded one')
+@argh.arg('-r', '--rounds', type=int, help='fresh containers per function, medians are reported')
+@argh.arg('-i', '--importtime', help='print the import times of every module')
+@argh.arg('-t', '--threshold-us', type=int, help='only print imports taking at least this long')
+@argh.arg('-b', '--budget-ms', type=float, help='budget of functions without cold_start_ms in the playbook')
+@argh.arg('-p', '--playbook', type=str, help='playbook with the functions list')
+def cold_start(only=None, events=os.path.join(ROOT, 'benchmarks', 'sample_events.jsonl'), noop=False,
+               rounds=5, importtime=False, threshold_us=1000, budget_ms=200.0, playbook=PLAYBOOK):
+    functions = [entry for entry in read_functions(playbook) if not only or entry['code'] in only]
+    recorded = first_events(events, functions)
+    options = dict(broker=None, latency_ms=0.0, jitter_ms=0.0, items=10, log=False, importtime=importtime)
+
+    over_budget = []
+    print('{0:>16} {1:>9} {2:>9} {3:>9} {4:>9} {5:>11} {6:>9} {7:>7} {8:>7}'.format(
+        '', 'start ms', 'init ms', 'first ms', 'warm ms', 'cold start', 'budget', 'status', 'kombu'))
+    for entry in functions:
+        event = NOOP if noop and entry['code'] != 'authentication' else recorded.get(entry['code'], NOOP)
+        result = measure(entry, event, rounds, options)
+        budget = float(entry.get('cold_start_ms') or budget_ms)
+        if result['cold_start'] > budget:
+            over_budget.append(entry['code'])
+        print('{0:>16} {1:>9} {2:>9} {3:>9} {4:>9} {5:>11} {6:>9} {7:>7} {8:>7}'.format(
+            entry['code'], result['start'], result['init'], result['first'], result['warm'], result['cold_start'],
+            budget, result['status'], 'yes' if result['kombu'] else 'no'))
+        if importtime:
+            print_imports(result['imports'], threshold_us)
+            print()
+
+    if over_budget:
+        sys.exit('over the cold start budget: {0}'.format(', '.join(over_budget)))
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Lambda like containers for the benchmarks: a :py:class:`Container` is a
+process of its own running :py:func:`run_container`, which imports one
+function, then reads one JSON line per event from stdin and answers with one
+JSON line of its outcome. The :py:class:`Pool` of the containers of a
+function starts them on demand, like Lambda does.
+
+"""
+import __builtin__
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import ROOT
+from benchmarks.fake_service import FakeService, memory_connection
+
+COMMAND = 'from benchmarks.container import run_container; run_container()'
+
+
+class ImportTimer(object):
+    """
+    Times every module loaded while installed, like ``python -X importtime``
+    of Python 3.7: self and cumulative time per module, nested by importer.
+
+    """
+    def __init__(self):
+        self.records = []
+        "tuples ``(depth, name, self_us, cumulative_us)``, children before their parent"
+        self.stack = []
+        self.original = None
+
+    def __enter__(self):
+        self.original = __builtin__.__import__
+        __builtin__.__import__ = self.traced_import
+        return self
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self.original
+
+    def traced_import(self, name, *args, **kwargs):
+        loaded = len(sys.modules)
+        children = [0.0]
+        self.stack.append(children)
+        start = time.time()
+        try:
+            return self.original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            self.stack.pop()
+            # lookups of modules loaded before count as time of the importer
+            if len(sys.modules) > loaded:
+                if self.stack:
+                    self.stack[-1][0] += elapsed
+                self.records.append((len(self.stack), name, int((elapsed - children[0]) * 1e6),
+                                     int(elapsed * 1e6)))
+
+
+def outcome(error, response):
+    """ The status of an invocation as API Gateway would answer it. """
+    if error is not None:
+        status, _, message = error.partition('--')
+        if message:
+            return status
+        return '401' if error == 'Unauthorized' else '500'
+    statements = response.get('policyDocument', {}).get('Statement', []) if isinstance(response, dict) else []
+    if statements and all(statement.get('Effect') == 'Deny' for statement in statements):
+        return '403'
+    return '200'
+
+
+class Context(object):
+    """ The parts of the Lambda context the handlers use. """
+
+    def __init__(self, function_name, request_id, memory_limit_in_mb=128):
+        self.function_name = function_name
+        self.aws_request_id = request_id
+        self.memory_limit_in_mb = memory_limit_in_mb
+
+    def __repr__(self):
+        return '<Context {0} {1}>'.format(self.function_name, self.aws_request_id)
+
+
+def start_fake_services(module, options):
+    """ Answer the RPC calls of a function on the memory transport. """
+    from utils.rpc_client import RpcClient
+
+    services = []
+    routing_key = getattr(module, 'ROUTING_KEY', None)
+    for value in list(vars(module).values()):
+        if routing_key and isinstance(value, type) and issubclass(value, RpcClient) and value is not RpcClient:
+            service = FakeService(value.send_exchange_name, routing_key, options['latency_ms'],
+                                  options['jitter_ms'], options['items'], envelope=False)
+            service.start()
+            service.ready.wait()
+            services.append(service)
+    return services
+
+
+def run_container():
+    """
+    Entry point of a container process: import the function, then answer
+    one JSON line per event on stdout. Everything the handler prints goes
+    to /dev/null (or stderr with ``--log``).
+
+    """
+    code, handler_name, options = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    output = open(os.devnull, 'w') if not options['log'] else sys.stderr
+    os.dup2(output.fileno(), sys.stdout.fileno())
+
+    import logging
+    logging.basicConfig(stream=output, level=logging.DEBUG)
+    sys.path.insert(0, os.path.join(ROOT, code))
+    start = time.time()
+    with ImportTimer() as import_timer:
+        import lambda_function
+    handler = getattr(lambda_function, handler_name)
+    init_ms = (time.time() - start) * 1000
+
+    from utils import logs, metrics, rpc_client
+    logs.Invocation.stream = metrics.stream = output
+    services = []
+    if options['broker']:
+        from kombu import Connection
+        rpc_client.connection_manager.connection_factory = lambda: Connection(options['broker'])
+    else:
+        def connect():
+            # started on the first connection, a noop call must not load kombu
+            if not services:
+                services.extend(start_fake_services(lambda_function, options))
+            return memory_connection(0.0001)
+        rpc_client.connection_manager.connection_factory = connect
+
+    ready = dict(init_ms=init_ms)
+    if options.get('importtime'):
+        ready['imports'] = import_timer.records
+    protocol.write(json.dumps(ready) + '\n')
+    protocol.flush()
+    for line in iter(sys.stdin.readline, ''):
+        invocation = json.loads(line)
+        context = Context(code, invocation['id'])
+        error = response = None
+        start = time.time()
+        try:
+            response = handler(invocation['event'], context)
+        except Exception as err:
+            error = str(err)
+        duration_ms = (time.time() - start) * 1000
+        reply = dict(status=outcome(error, response), duration_ms=duration_ms,
+                     kombu='kombu.connection' in sys.modules)
+        if invocation.get('response'):
+            reply['response'] = response
+        # the noop responses hold the context
+        protocol.write(json.dumps(reply, default=repr) + '\n')
+        protocol.flush()
+    for service in services:
+        service.stop()
+
+
+class Container(object):
+    """ A container process of a function, seen from the replay. """
+
+    def __init__(self, function, options):
+        start = time.time()
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', COMMAND, function['code'], function['handler'], json.dumps(options)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=ROOT)
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError('container of {0} did not start'.format(function['code']))
+        self.ready = json.loads(line)
+        self.init_ms = self.ready['init_ms']
+        self.start_ms = (time.time() - start) * 1000
+        "From starting the process until the function is imported, includes the interpreter start."
+        self.invocations = 0
+
+    def invoke(self, request_id, event, response=False):
+        """
+        :param response: send back the response of the handler too
+        :return: dict with ``status``, ``duration_ms``, ``kombu`` and ``response``
+        """
+        self.process.stdin.write(json.dumps(dict(id=request_id, event=event, response=response)) + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError('container died')
+        self.invocations += 1
+        return json.loads(line)
+
+    def stop(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class Pool(object):
+    """
+    The containers of one function: an idle one is reused (warm), a new
+    one is started (cold) while less than *size* exist. Like Lambda does,
+    containers idle for longer than *max_idle_s* are thrown away.
+
+    """
+    def __init__(self, function, size, options, max_idle_s=None):
+        self.function = function
+        self.size = size
+        self.options = options
+        self.max_idle_s = max_idle_s
+        self.idle = []
+        "tuples ``(container, released)``, the most recently released last"
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def expire(self):
+        """ Stop the containers idle for too long, call with the condition held. """
+        if self.max_idle_s is None:
+            return
+        deadline = time.time() - self.max_idle_s
+        while self.idle and self.idle[0][1] < deadline:
+            self.idle.pop(0)[0].stop()
+            self.count -= 1
+            self.condition.notify()
+
+    def acquire(self):
+        """ :return: tuple ``(container, init_ms)``, init_ms is None for a warm container """
+        with self.condition:
+            self.expire()
+            while not self.idle and self.count >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()[0], None
+            self.count += 1
+        try:
+            container = Container(self.function, self.options)
+        except Exception:
+            with self.condition:
+                self.count -= 1
+                self.condition.notify()
+            raise
+        return container, container.init_ms
+
+    def release(self, container, recycle=False):
+        if recycle:
+            container.stop()
+        with self.condition:
+            if recycle:
+                self.count -= 1
+            else:
+                self.idle.append((container, time.time()))
+            self.condition.notify()
+
+    def prewarm(self):
+        containers = [self.acquire()[0] for _ in range(self.size)]
+        for container in containers:
+            self.release(container)
+
+    def stop(self):
+        with self.condition:
+            for container, _ in self.idle:
+                container.stop()
+            self.idle = []
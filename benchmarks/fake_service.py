@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+A fake backend service for the benchmarks, answering RPC calls over kombu's
+in-memory transport, so no broker is needed.
+
+"""
+import heapq
+import random
+import socket
+import threading
+import time
+
+from benchmarks import sample_stuff_response
+
+
+def memory_connection(polling_interval):
+    from kombu import Connection
+    return Connection(transport='memory', transport_options={'polling_interval': polling_interval})
+
+
+class FakeService(threading.Thread):
+    """
+    Answers requests like a backend service, on a connection of its own.
+    Replies are sent when their latency has passed, so calls overlap just
+    like with a real service.
+
+    """
+    def __init__(self, exchange_name, routing_key, latency_ms=0.0, jitter_ms=0.0, items=10, envelope=True,
+                 polling_interval=0.0001, seed=42):
+        """
+        :param latency_ms: mean time the service takes per request
+        :param jitter_ms: standard deviation of the latency
+        :param items: number of stuff items in the result
+        :param envelope: wrap replies in ``_status`` / ``_response`` as RpcClient expects
+
+        Requests with a ``limit`` get a page of the items from their ``cursor`` on, streamed in chunks
+        of ``chunk_size`` items if they ask for it, see ``utils.rpc_client.RpcClient.stream``.
+        """
+        super(FakeService, self).__init__(name='fake-{0}'.format(routing_key))
+        self.daemon = True
+        from kombu import Exchange, Queue
+
+        self.connection = memory_connection(polling_interval)
+        self.exchange = Exchange(exchange_name, type='topic')
+        self.queue = Queue('{0}_requests'.format(routing_key), self.exchange, routing_key)
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rng = random.Random(seed)
+        self.envelope = envelope
+        self.response = sample_stuff_response(items, seed)
+        self.reply = self.wrap(self.response)
+        self.encoded = {}
+        self.due = []
+        self.requests = 0
+        self.largest = 0
+        "Bytes of the largest message sent."
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+
+    def wrap(self, response):
+        return {'_status': {'code': 'ok'}, '_response': response} if self.envelope else response
+
+    def page(self, codec, request):
+        """ :return: list of the encoded chunks and their headers answering a paged request """
+        from utils.rpc_client import CHUNK_HEADER, LAST_CHUNK_HEADER
+
+        start = int(request.get('cursor') or 0)
+        end = start + int(request['limit'])
+        stuff = self.response['stuff'][start:end]
+        cursor = str(end) if end < len(self.response['stuff']) else None
+        size = int(request.get('chunk_size') or 0)
+        if not size:
+            return [(codec.encode(self.wrap(dict(self.response, stuff=stuff, cursor=cursor))), {})]
+        chunks = [stuff[offset:offset + size] for offset in range(0, len(stuff), size)] or [[]]
+        replies = []
+        for index, chunk in enumerate(chunks):
+            last = index == len(chunks) - 1
+            body = dict(self.response, stuff=chunk, cursor=cursor) if last else dict(self.response, stuff=chunk)
+            replies.append((codec.encode(self.wrap(body)), {CHUNK_HEADER: index, LAST_CHUNK_HEADER: last}))
+        return replies
+
+    def on_message(self, message):
+        from utils.serialization import decompress, get_codec_for
+
+        message.ack()
+        self.requests += 1
+        codec = get_codec_for(message.content_type)
+        request = codec.decode(decompress(message.body, message.headers))
+        if isinstance(request, dict) and request.get('limit'):
+            replies = self.page(codec, request)
+        else:
+            if codec.content_type not in self.encoded:
+                self.encoded[codec.content_type] = codec.encode(self.reply)
+            replies = [(self.encoded[codec.content_type], {})]
+        delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        heapq.heappush(self.due, (time.time() + delay, self.requests, codec.content_type, replies,
+                                  message.properties['reply_to'], message.properties['correlation_id']))
+
+    def send_due(self, producer):
+        now = time.time()
+        while self.due and self.due[0][0] <= now:
+            _, _, content_type, replies, reply_to, correlation_id = heapq.heappop(self.due)
+            for body, headers in replies:
+                self.largest = max(self.largest, len(body))
+                producer.publish(body, headers=headers, content_type=content_type, content_encoding='binary',
+                                 routing_key=reply_to, correlation_id=correlation_id)
+
+    def run(self):
+        from kombu import Consumer, Exchange, Producer
+
+        producer = Producer(self.connection, exchange=Exchange(''))
+        with Consumer(self.connection, self.queue, on_message=self.on_message):
+            self.ready.set()
+            while not self.stopped.is_set():
+                try:
+                    self.connection.drain_events(timeout=0.0005)
+                except socket.timeout:
+                    pass
+                self.send_due(producer)
+        self.connection.release()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay recorded API Gateway events against the lambda handlers, to load test
+a change locally before deploying it.
+
+The events are streamed from a JSONL file, one event per line, either bare
+or wrapped with the function to call::
+
+    {"function": "get-stuff", "event": {"stuff_id": "stuff-1"}}
+    {"type": "TOKEN", "authorizationToken": "...", "methodArn": "..."}
+    {"httpMethod": "DELETE", "body": {"modifier_id": "user-1"}}
+
+``function`` is the ``code``, ``aws_name`` or ``handler`` of an entry in the
+``functions`` list of the playbook. Bare events go to the authorizer if they
+have a ``type``, else by their ``httpMethod``.
+
+Every function runs in containers like on Lambda: a container is a process of
+its own that imports the function once (the cold start) and then handles one
+event at a time. Containers are started on demand up to ``--concurrency`` per
+function, ``--recycle`` throws a share of them away after an invocation to
+simulate cold starts, ``--prewarm`` starts all of them before the replay.
+Without ``--broker`` the AMQP calls go over kombu's in-memory transport to a
+fake service in the container, see :py:mod:`benchmarks.container`.
+
+    python -m benchmarks.replay benchmarks/sample_events.jsonl -r 200 -c 4 --repeat 50
+
+"""
+from __future__ import print_function
+
+import collections
+import json
+import random
+import sys
+import threading
+import time
+from Queue import Queue
+
+import argh
+
+from benchmarks import PLAYBOOK, read_events, read_functions, route
+from benchmarks.container import Pool
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return dict(p50=None, p95=None, p99=None, max=None)
+
+    def at(percent):
+        return round(ordered[int(round(percent / 100.0 * (len(ordered) - 1)))], 3)
+
+    return dict(p50=at(50), p95=at(95), p99=at(99), max=round(ordered[-1], 3))
+
+
+class Stats(object):
+    """ Results of the invocations of one function. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.durations = []
+        self.init = []
+        self.statuses = collections.Counter()
+
+    def add(self, status, latency_ms, duration_ms, init_ms):
+        with self.lock:
+            self.statuses[status] += 1
+            self.latencies.append(latency_ms)
+            if duration_ms is not None:
+                self.durations.append(duration_ms)
+            if init_ms is not None:
+                self.init.append(init_ms)
+
+    def report(self, seconds):
+        count = sum(self.statuses.values())
+        errors = sum(number for status, number in self.statuses.items() if not status.startswith('2'))
+        return dict(invocations=count,
+                    per_s=round(count / seconds, 1) if seconds else None,
+                    error_rate=round(float(errors) / count, 4) if count else None,
+                    statuses=dict(self.statuses),
+                    cold_starts=len(self.init),
+                    init_ms=percentiles(self.init),
+                    latency_ms=percentiles(self.latencies),
+                    duration_ms=percentiles(self.durations))
+
+
+def replay(events, functions, concurrency=1, rate=None, recycle=0.0, prewarm=False, options=None, seed=42):
+    """
+    Replay the events against the functions.
+
+    :param events: iterable of recorded events
+    :param concurrency: containers per function, and worker threads per function
+    :param rate: target events per second, as fast as possible if None
+    :param recycle: share of invocations after which the container is thrown away
+    :return: tuple ``(stats by function code, seconds, unroutable events)``
+    """
+    names = {}
+    for function in functions:
+        for key in ('code', 'aws_name', 'handler'):
+            names[function[key]] = function['code']
+    by_code = dict((function['code'], function) for function in functions)
+    pools = dict((code, Pool(function, concurrency, options)) for code, function in by_code.items())
+    stats = dict((code, Stats()) for code in pools)
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    unroutable = [0]
+    work = Queue(maxsize=concurrency * len(pools))
+
+    if prewarm:
+        for pool in pools.values():
+            pool.prewarm()
+
+    def worker():
+        for code, request_id, event, scheduled in iter(work.get, None):
+            pool = pools[code]
+            duration_ms = None
+            try:
+                container, init_ms = pool.acquire()
+            except RuntimeError:
+                stats[code].add('cold start failed', (time.time() - scheduled) * 1000, None, None)
+                continue
+            try:
+                result = container.invoke(request_id, event)
+                status, duration_ms = result['status'], result['duration_ms']
+                with rng_lock:
+                    retire = rng.random() < recycle
+            except RuntimeError:
+                status, retire = 'container died', True
+            pool.release(container, recycle=retire)
+            # from the scheduled start, so a backlog shows in the latency
+            stats[code].add(status, (time.time() - scheduled) * 1000, duration_ms, init_ms)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency * len(pools))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    try:
+        for index, record in enumerate(events):
+            code, event = route(record, names)
+            if code not in pools:
+                unroutable[0] += 1
+                continue
+            scheduled = time.time()
+            if rate:
+                scheduled = start + float(index) / rate
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            work.put((code, 'replay-{0}'.format(index), event, scheduled))
+    finally:
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - start
+        for pool in pools.values():
+            pool.stop()
+    return stats, seconds, unroutable[0]
+
+
+def print_report(results, seconds, unroutable):
+    print('{0:>16} {1:>7} {2:>8} {3:>7} {4:>5} {5:>8} {6:>8} {7:>8} {8:>8} {9:>9}'.format(
+        '', 'calls', 'calls/s', 'errors', 'cold', 'init ms', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'))
+    for code, report in sorted(results.items()):
+        print('{0:>16} {1:>7} {2:>8} {3:>6.1%} {4:>5} {5:>8} {6:>8} {7:>8} {8:>8}  {9}'.format(
+            code, report['invocations'], report['per_s'], report['error_rate'], report['cold_starts'],
+            report['init_ms']['p50'], report['latency_ms']['p50'], report['latency_ms']['p95'],
+            report['latency_ms']['p99'],
+            ' '.join('{0}:{1}'.format(status, count) for status, count in sorted(report['statuses'].items()))))
+    total = sum(report['invocations'] for report in results.values())
+    print('{0} events in {1:.2f}s, {2:.0f}/s, {3} without a function'.format(
+        total, seconds, total / seconds if seconds else 0, unroutable))
+
+
+@argh.dispatch_command
+@argh.arg('events', help='JSONL file of recorded events')
+@argh.arg('-c', '--concurrency', type=int, help='containers per function')
+@argh.arg('-r', '--rate', type=float, help='target events per second, default as fast as possible')
+@argh.arg('--recycle', type=float, help='share of invocations after which a container is replaced (cold start)')
+@argh.arg('--prewarm', help='start all containers before the replay')
+@argh.arg('--repeat', type=int, help='replay the file this many times')
+@argh.arg('-n', '--limit', type=int, help='stop after this many events')
+@argh.arg('-b', '--broker', type=str, help='AMQP URL, default a fake service on the memory transport')
+@argh.arg('-l', '--latency-ms', type=float, help='mean latency of the fake service')
+@argh.arg('-j', '--jitter-ms', type=float, help='standard deviation of the fake service latency')
+@argh.arg('-i', '--items', type=int, help='stuff items per fake reply')
+@argh.arg('-p', '--playbook', type=str, help='playbook with the functions list')
+@argh.arg('-o', '--output', type=str, help='save the report to this JSON file')
+@argh.arg('--log', help='send the handler logs to stderr')
+def replay_events(events, concurrency=1, rate=None, recycle=0.0, prewarm=False, repeat=1, limit=None, broker=None,
+         latency_ms=2.0, jitter_ms=0.5, items=10, playbook=PLAYBOOK, output=None, log=False):
+    options = dict(broker=broker, latency_ms=latency_ms, jitter_ms=jitter_ms, items=items, log=log)
+    results, seconds, unroutable = replay(read_events(events, repeat, limit), read_functions(playbook),
+                                          concurrency, rate, recycle, prewarm, options)
+    reports = dict((code, stats.report(seconds)) for code, stats in results.items() if stats.statuses)
+    print_report(reports, seconds, unroutable)
+    if output:
+        with open(output, 'w') as output_json:
+            json.dump(dict(seconds=round(seconds, 3), unroutable=unroutable, functions=reports), output_json,
+                      indent=2, sort_keys=True)
+        print('saved to {0}'.format(output))
@@ -4,8 +4,21 @@ AMQP_PORT = 5672
 AMQP_USER = 'guest'
 AMQP_VHOST = '/'
 AMQP_TIMEOUT = 30
+AMQP_HEARTBEAT = 60
 AMQP_HOST = '127.0.0.1'
 AMQP_PASS = 'guest'
 ROUTING_KEY = 'get_call'
 
+CACHE_SIZE = 512
+CACHE_TTL = 30
+CACHE_STALE_TTL = 300
+
+PAGE_LIMIT = 100
+PAGE_MAX_LIMIT = 1000
+CHUNK_SIZE = 100
+
 LOG_LEVEL = "INFO"
+LOG_SAMPLE_RATE = 1.0
+LOG_MAX_SIZE = 1024
+
+METRICS_NAMESPACE = 'api-gateway-template'
@@ -2,17 +2,27 @@
 import json
 import logging
 import re
-import traceback
-
-from httplib import BAD_REQUEST, INTERNAL_SERVER_ERROR
+import time
 
 from config import *
-from utils.rpc_client import RpcClient, AmqpRpcError
+from utils.cache import MISS, STALE, ResponseCache
+from utils.rpc_client import (RpcClient, AmqpRpcError, ValidationError, connection_manager, poll,
+                              subscribe_invalidations)
 
-from utils import get_error_message
+from utils import BAD_REQUEST, INTERNAL_SERVER_ERROR, get_error_message, noop_response
+from utils.logs import add_fields, configure as configure_logs, fmt, log_invocation
+from utils.metrics import instrument, timer
+from utils.schema import Field, coerce_integers, compile_schema
 
 log = logging.getLogger('get_call')
 log.setLevel(getattr(logging, LOG_LEVEL.upper()))
+configure_logs(max_size=LOG_MAX_SIZE)
+
+# kept at module level, so cached responses survive warm invocations
+response_cache = ResponseCache(max_size=CACHE_SIZE, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL,
+                               ignore_keys=('noop', 'skiplog'))
+# number of the AMQP connection the cache received invalidations on
+cache_connection = dict(connects=0)
 
 
 class GetCallException(Exception):
@@ -29,37 +39,143 @@ class GetStuffViaAMQPClient(RpcClient):
     response_routing_key = 'get_stuff_response'
     send_exchange_name = AMQP_EXCHANGE
     send_exchange_type = 'topic'
+    codec = 'json'  # 'msgpack' is more compact, if the backend accepts it
+    coalesce = True
 
     def process_response(self, response):
         """ overwrite the process response, we just need a pass-through here """
-        log.debug('got response from AMQP: {0}'.format(response))
+        log.debug(fmt('got response from AMQP: {0}', response))
         return response
 
+    def merge_chunks(self, chunks, message):
+        """
+        Merge the chunks of a page as they arrive, so only the page and one
+        chunk are in memory, never the whole result. Items past the "limit"
+        of the request, if it has one, are dropped. A reply whose "stuff" is
+        not a list, i.e. an error, is returned as it is.
+
+        :return: dict with the "stuff" of the page and the "cursor" of the next page, None after the last one
+        :raises: ValidationError if a later chunk has no list of stuff
+        """
+        limit = (message or {}).get('limit')
+        page = None
+        for chunk in chunks:
+            if not chunk.get('success'):
+                return chunk
+            stuff = chunk.get('stuff')
+            if not isinstance(stuff, list):
+                if page is None:
+                    return chunk
+                raise ValidationError('{0} sent a chunk without a list of stuff'.format(self.service))
+            if page is None:
+                page = dict(chunk, stuff=[])
+            if limit is not None and len(page['stuff']) + len(stuff) > limit:
+                log.warning(fmt('{0} sent more than {1} items, dropping the rest', self.service, limit))
+                stuff = stuff[:limit - len(page['stuff'])]
+            page['stuff'].extend(stuff)
+            if 'cursor' in chunk:
+                page['cursor'] = chunk['cursor']
+        return page
+
+    def get_page(self, request):
+        """
+        Get one page of stuff, which the service streams in chunks of at most
+        CHUNK_SIZE items, see merge_chunks.
+
+        :param request: dict with the "limit" and optionally the "cursor" of the page
+
+        :return: dict
+        """
+        return self.call(dict(request, chunk_size=int(CHUNK_SIZE)), routing_key=ROUTING_KEY)
+
+    def get_page_async(self, request):
+        """ Like get_page, but return an RpcFuture for the page. """
+        return self.call_async(dict(request, chunk_size=int(CHUNK_SIZE)), routing_key=ROUTING_KEY)
+
+
+def sync_response_cache():
+    """
+    Apply the invalidations sent by the write functions since the last
+    invocation and store finished background refreshes.
+    Invalidations are only received while a connection exists, so the cache is
+    emptied whenever a new connection had to be made.
 
-def validate_request_params(request):
     """
-        Validates the incoming request to match the minimum
-        requirements to be able to handle this request.
+    try:
+        subscribe_invalidations(AMQP_EXCHANGE, 'stuff', response_cache.invalidate)
+        if cache_connection['connects'] != connection_manager.connect_count:
+            response_cache.clear()
+            cache_connection['connects'] = connection_manager.connect_count
+        poll()
+        response_cache.collect(accept=lambda response: response.get('success'))
+    except Exception:
+        log.exception('Could not sync response cache, dropping it')
+        response_cache.clear()
+        connection_manager.reset()
+
+
+def get_stuff(client, request):
+    """
+    Get the stuff from the response cache or via AMQP. A stale response is
+    returned right away while it is refreshed in the background, the new one
+    is picked up by a later invocation.
 
-    :param request: dict
-        { }
+    :param client: GetStuffViaAMQPClient
 
-    :return: Boolean
+    :param request: dict, with the "limit" of the page
+
+    :return: dict
 
     """
-    try:
-        return True
+    if response_cache.max_size <= 0:
+        return client.get_page(request)
+
+    sync_response_cache()
+    key = response_cache.make_key(request)
+    response, state = response_cache.get(key)
+    add_fields(cache=state)
+    if state == STALE:
+        response_cache.revalidate(key, request.get('stuff_id'), lambda: client.get_page_async(request))
+    if state != MISS:
+        log.debug(fmt('cached response ({0}): {1}', state, key))
+        return response
 
-    except AssertionError:
-        log.warning('get call request not validated: {0}'.format(request))
-        return False
+    response = client.get_page(request)
+    if response.get('success'):
+        response_cache.set(key, response, request.get('stuff_id'))
+    return response
 
-    except:
-        log.error('error in validation: {0}'.format(request))
-        log.error(traceback.print_exc())
-        return False
 
+def prewarm(ping=False):
+    """
+    Prime the container for the first get request of a keep warm ping: the
+    connection, declarations and consumers of the client and the
+    subscription of the response cache to the invalidations.
+
+    :param ping: round-trip a health ping to the get_stuff service too
+
+    :return: dict of the milliseconds of every step, see RpcClient.prewarm
+
+    """
+    steps = GetStuffViaAMQPClient().prewarm(ping=ping, routing_key=ROUTING_KEY)
+    if 'error' not in steps and response_cache.max_size > 0:
+        start = time.time()
+        sync_response_cache()
+        steps['invalidations_ms'] = round((time.time() - start) * 1000, 3)
+    return steps
 
+
+REQUEST_SCHEMA = {
+    'stuff_id': Field('string', blank=False, max_length=128),
+    'limit': Field('integer', minimum=1, maximum=int(PAGE_MAX_LIMIT)),
+    'cursor': Field('string', blank=False, max_length=512),
+}
+"Fields of a get request, see utils.schema, noop requests are answered before the validation."
+validate_request_params = compile_schema('get_call', REQUEST_SCHEMA)
+
+
+@log_invocation('get_call', sample_rate=LOG_SAMPLE_RATE)
+@instrument('get_call', namespace=METRICS_NAMESPACE)
 def get_stuff_handler(request, context):
     """
     Main function to be called as lambda handler.
@@ -69,31 +185,44 @@ def get_stuff_handler(request, context):
     special call available for test purpose:
     this returns a message with the context used in the call, logging can be skipped if
     "skiplog" is ste to True, so even the connection with Cloudwatch can be switched
+    "metrics" adds the latency histograms of the container, see utils.metrics
+    "hold_ms" keeps the container busy, so concurrent keep warm pings reach distinct containers,
+    the response has the "container_id", see utils.noop_response
+    "prewarm" opens the AMQP connection and declares everything a request needs, "ping" also
+    sends a health ping to the service, the response has the milliseconds of every step
         {
             "noop": True,
-            "skiplog": False
+            "skiplog": False,
+            "metrics": False,
+            "hold_ms": 0,
+            "prewarm": False,
+            "ping": False
         }
 
     :param request: JSON
         {
             "value1": "something",
             "value2": "something else",
-            "value3": "foo"
+            "value3": "foo",
+            "limit": 100,
+            "cursor": "from the response of the previous page"
         }
 
     :param context: request context from AWS lambda
 
     :raises: GetCallException
 
-    :return: JSON
+    :return: JSON, a page of at most "limit" (default PAGE_LIMIT) items, its "cursor" gets the next page, it is
+        null after the last one
     """
 
     if isinstance(request, str):
         try:
-            log.info('Got string request, converting to JSON.')
-            request = json.loads(request)
+            log.debug('Got string request, converting to JSON.')
+            with timer('parse'):
+                request = json.loads(request)
         except ValueError:
-            log.warning('Malformed Json in request: {0}'.format(request))
+            log.warning(fmt('Malformed Json in request: {0}', request))
             msg = get_error_message(BAD_REQUEST, 'Malformed JSON in request.')
             raise GetCallException(msg)
 
@@ -105,26 +234,31 @@ def get_stuff_handler(request, context):
     if 'noop' in request and request.get('noop'):
         if not request.get('skiplog'):
             log.info('NoOp called !')
-            log.info('context returned: {0}'.format(context))
-        response = dict(message='No Op call successful',
-                        context=context,
-                        success=True)
+            log.info(fmt('context returned: {0}', context))
+        steps = prewarm(ping=bool(request.get('ping'))) if request.get('prewarm') else None
+        response = noop_response(request, context)
+        if steps is not None:
+            response['prewarm'] = steps
         return response
 
-    log.debug('got request: {0}'.format(request))
+    log.debug(fmt('got request: {0}', request))
     response = dict(success=False,
                     message='')
 
-    if not validate_request_params(request):
+    with timer('validate'):
+        # the limit is a query string parameter, i.e. a string
+        request = coerce_integers(request, ('limit',))
+        error = validate_request_params(request)
+    if error:
         # we need to use exceptions here now, so we can match the
         # errorMessage in the context response for HTTP response types
-        msg = get_error_message(BAD_REQUEST, 'Parameter mismatch: validation failed.')
-        raise GetCallException(msg)
+        log.warning(fmt('request not validated, {0}: {1}', error, request))
+        raise GetCallException(get_error_message(BAD_REQUEST, error))
 
     try:
         client = GetStuffViaAMQPClient()
-        response = client.call(request, routing_key=ROUTING_KEY)
-        log.info('found stuff with ID: {0}'.format(request.get('stuff_id')))
+        response = get_stuff(client, dict(request, limit=request.get('limit') or int(PAGE_LIMIT)))
+        add_fields(stuff_id=request.get('stuff_id'))
 
         if not response['success']:
             raise GetCallException()
@@ -132,19 +266,18 @@ def get_stuff_handler(request, context):
         return response
 
     except AmqpRpcError:
-        log.error('Error connecting to AMQP exchange: {0}'.format(AMQP_EXCHANGE))
+        log.error(fmt('Error connecting to AMQP exchange: {0}', AMQP_EXCHANGE))
         msg = get_error_message(INTERNAL_SERVER_ERROR, 'Error in request for GET call!')
         raise GetCallException(msg)
 
     except GetCallException:
         log.info('Error response from VREG.')
-        log.info('response was: {0}'.format(response))
+        log.info(fmt('response was: {0}', response))
         msg = get_error_message(BAD_REQUEST, response['message'])
         raise GetCallException(msg)
 
     except:
-        log.error('unexpected exception in get call: {0}'.format(request))
-        log.error(traceback.print_exc())
+        log.exception(fmt('unexpected exception in get call: {0}', request))
         msg = get_error_message(INTERNAL_SERVER_ERROR, 'Error in request for GET call!')
         raise GetCallException(msg)
 
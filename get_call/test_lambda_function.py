@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import sys
+import unittest
+from StringIO import StringIO
+
+from kombu import Connection, Consumer, Exchange, Producer, Queue
+from mock import call, patch
+
+# the rpc client reads the configuration of the function
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import utils  # noqa: E402
+from get_call import lambda_function  # noqa: E402
+from utils import logs, metrics, rpc_client, serialization  # noqa: E402
+from utils.cache import ResponseCache  # noqa: E402
+
+
+class StuffService(object):
+    """ Answers get_stuff requests on the same connection, always in chunks. """
+
+    def __init__(self, connection, items=25, plain_reply=None):
+        self.stuff = [{'stuff_id': 'stuff-{0}'.format(i)} for i in range(items)]
+        self.plain_reply = plain_reply
+        self.requests = []
+        exchange = Exchange(lambda_function.AMQP_EXCHANGE, type='topic')
+        queue = Queue('get_stuff_requests', exchange, lambda_function.ROUTING_KEY, channel=connection.default_channel)
+        self.consumer = Consumer(connection, queue, on_message=self.on_message)
+        self.consumer.consume()
+        self.producer = Producer(connection, exchange=Exchange(''))
+
+    def on_message(self, message):
+        message.ack()
+        codec = serialization.get_codec_for(message.content_type)
+        request = codec.decode(message.body)
+        self.requests.append(request)
+        if self.plain_reply is not None:
+            self.producer.publish(codec.encode(self.plain_reply), content_type=codec.content_type,
+                                  content_encoding='binary', routing_key=message.properties['reply_to'],
+                                  correlation_id=message.properties['correlation_id'])
+            return
+        start = int(request.get('cursor') or 0)
+        end = start + request.get('limit', len(self.stuff))
+        stuff = self.stuff[start:end]
+        size = request.get('chunk_size') or 5
+        chunks = [stuff[offset:offset + size] for offset in range(0, len(stuff), size)] or [[]]
+        for index, chunk in enumerate(chunks):
+            last = index == len(chunks) - 1
+            reply = dict(success=True, message='', stuff=chunk)
+            if last:
+                reply['cursor'] = str(end) if end < len(self.stuff) else None
+            self.producer.publish(codec.encode(reply), content_type=codec.content_type, content_encoding='binary',
+                                  headers={rpc_client.CHUNK_HEADER: index, rpc_client.LAST_CHUNK_HEADER: last},
+                                  routing_key=message.properties['reply_to'],
+                                  correlation_id=message.properties['correlation_id'])
+
+
+class GetCallTests(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = Connection(transport='memory')
+        manager = rpc_client.ConnectionManager(lambda: self.connection)
+        self.now = 1000.0
+        cache = ResponseCache(max_size=10, ttl=30, stale_ttl=300, ignore_keys=('noop', 'skiplog'),
+                              clock=lambda: self.now)
+        for patcher in [patch.object(rpc_client, 'connection_manager', manager),
+                        patch.object(lambda_function, 'connection_manager', manager),
+                        patch.object(lambda_function, 'response_cache', cache),
+                        patch.object(logs.Invocation, 'stream', StringIO()),
+                        patch.object(metrics, 'stream', StringIO())]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(manager.reset)
+        self.manager = manager
+
+    def get(self, request):
+        return lambda_function.get_stuff_handler(request, None)
+
+    def test_pages(self):
+        service = StuffService(self.connection, items=25)
+        first = self.get({'stuff_id': 'stuff-1', 'limit': 10})
+        last = self.get({'stuff_id': 'stuff-1', 'limit': 10, 'cursor': '20'})
+        self.assertEqual((10, '10'), (len(first['stuff']), first['cursor']))
+        self.assertEqual((5, None), (len(last['stuff']), last['cursor']))
+        self.assertEqual(int(lambda_function.CHUNK_SIZE), service.requests[0]['chunk_size'])
+
+    def test_plain_reply_without_stuff_is_unchanged(self):
+        reply = dict(success=True, message='', count=3)
+        StuffService(self.connection, plain_reply=reply)
+        self.assertEqual(reply, self.get({'stuff_id': 'stuff-1'}))
+
+    def test_only_lists_of_stuff_are_merged(self):
+        client = lambda_function.GetStuffViaAMQPClient()
+        for reply in (dict(success=True, stuff={'stuff_id': 'a'}), dict(success=True, stuff='abc')):
+            self.assertEqual(reply, client.merge_chunks(iter([reply]), {'limit': 1}))
+        plain = dict(success=True, stuff=[{'stuff_id': 'a'}])
+        self.assertEqual(plain, client.merge_chunks(iter([plain]), {'limit': 10}))
+        chunks = iter([dict(success=True, stuff=[{'stuff_id': 'a'}]), dict(success=True, stuff='b', cursor=None)])
+        self.assertRaises(rpc_client.ValidationError, client.merge_chunks, chunks, {'limit': 10})
+
+    def test_limit_from_the_query_string(self):
+        service = StuffService(self.connection, items=25)
+        page = self.get({'stuff_id': 'stuff-1', 'limit': '10'})
+        self.assertEqual((10, '10'), (len(page['stuff']), page['cursor']))
+        self.assertEqual(10, service.requests[0]['limit'])
+        with self.assertRaises(lambda_function.GetCallException) as raised:
+            self.get({'stuff_id': 'stuff-1', 'limit': 'ten'})
+        self.assertIn("'limit' must be an integer", str(raised.exception))
+
+    def test_stale_page_is_refreshed_in_chunks(self):
+        service = StuffService(self.connection, items=25)
+        request = {'stuff_id': 'stuff-1', 'limit': 10}
+        first = self.get(dict(request))
+
+        self.now += 60
+        service.stuff[0] = {'stuff_id': 'changed'}
+        service.stuff[9] = {'stuff_id': 'changed too'}
+        self.assertEqual(first, self.get(dict(request)))
+        refreshed = self.get(dict(request))
+
+        self.assertEqual(2, len(service.requests))
+        self.assertEqual(int(lambda_function.CHUNK_SIZE), service.requests[1]['chunk_size'])
+        self.assertEqual(10, len(refreshed['stuff']))
+        self.assertEqual(('changed', 'changed too'), (refreshed['stuff'][0]['stuff_id'],
+                                                      refreshed['stuff'][9]['stuff_id']))
+        self.assertEqual('10', refreshed['cursor'])
+
+    def test_noop_prewarm_with_ping(self):
+        service = StuffService(self.connection)
+        request = {'noop': True, 'skiplog': True, 'prewarm': True, 'ping': True, 'hold_ms': 5000}
+        with patch('utils.time.sleep') as sleep:
+            response = self.get(request)
+
+        self.assertTrue(response['success'])
+        self.assertEqual(utils.CONTAINER_ID, response['container_id'])
+        self.assertEqual(set(['connect_ms', 'channel_ms', 'exchange_ms', 'reply_queue_ms', 'ping_ms',
+                              'invalidations_ms']), set(response['prewarm']))
+        self.assertEqual([{'ping': True}], service.requests)
+        # the hold is capped
+        self.assertIn(call(utils.MAX_HOLD_MS / 1000.0), sleep.call_args_list)
+        self.assertNotIn(call(5.0), sleep.call_args_list)
+
+    def test_noop_prewarm_error_is_passed_on(self):
+        def refuse():
+            raise socket.error('connection refused')
+
+        self.manager.connection_factory = refuse
+        response = self.get({'noop': True, 'skiplog': True, 'prewarm': True, 'ping': True})
+        self.assertTrue(response['success'])
+        # what the warmer checks
+        self.assertEqual({'error': 'connection refused'}, response['prewarm'])
+
+    def test_noop_without_prewarm_does_not_connect(self):
+        response = self.get({'noop': True, 'skiplog': True})
+        self.assertNotIn('prewarm', response)
+        self.assertEqual(0, self.manager.connect_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
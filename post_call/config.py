@@ -4,8 +4,15 @@ AMQP_PORT = 5672
 AMQP_USER = 'guest'
 AMQP_VHOST = '/'
 AMQP_TIMEOUT = 30
+AMQP_HEARTBEAT = 60
 AMQP_HOST = '127.0.0.1'
 AMQP_PASS = 'guest'
 ROUTING_KEY = 'post_call'
 
+BATCH_MAX_SIZE = 100
+
 LOG_LEVEL = "INFO"
+LOG_SAMPLE_RATE = 1.0
+LOG_MAX_SIZE = 1024
+
+METRICS_NAMESPACE = 'api-gateway-template'
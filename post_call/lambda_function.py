@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
-import traceback
-
-from httplib import BAD_REQUEST, INTERNAL_SERVER_ERROR
 
 from config import *
-from utils import get_error_message
+from utils import BAD_REQUEST, INTERNAL_SERVER_ERROR, bulk_write, get_error_message, noop_response
+from utils.logs import configure as configure_logs, fmt, log_invocation
+from utils.metrics import instrument, timer
+from utils.schema import Field, compile_schema
 
 
 log = logging.getLogger('post_call')
 log.setLevel(getattr(logging, LOG_LEVEL.upper()))
+configure_logs(max_size=LOG_MAX_SIZE)
 
 
 class PostCallException(Exception):
@@ -21,60 +22,62 @@ class PostCallException(Exception):
     """
 
 
-def validate_request_params(request):
-    """
-        :param request:
-        :return: Boolean
-    """
-    try:
-        # again just a minimal stub for testing and completeness
-        return True
-
-    except AssertionError:
-        log.warning('POST request not validated: {0}'.format(request))
-        return False
+REQUEST_SCHEMA = {
+    'stuff_id': Field('string', blank=False, max_length=128),
+}
+"Fields of a post request, see utils.schema, noop requests are answered before the validation."
+validate_request_params = compile_schema('post_call', REQUEST_SCHEMA)
 
 
+@log_invocation('post_call', sample_rate=LOG_SAMPLE_RATE)
+@instrument('post_call', namespace=METRICS_NAMESPACE)
 def add_something_handler(request, context):
-    log.info('POST call - got request: {0}'.format(request))
+    log.debug(fmt('POST call - got request: {0}', request))
     response = dict(success=False,
                     message='')
 
     if isinstance(request, str) or isinstance(request, unicode):
         try:
-            log.info('Got string request, converting to JSON.')
-            request = json.loads(request)
+            log.debug('Got string request, converting to JSON.')
+            with timer('parse'):
+                request = json.loads(request)
         except ValueError:
-            log.warning('got malformed JSON request: {0}'.format(request))
+            log.warning(fmt('got malformed JSON request: {0}', request))
             raise PostCallException('Malformed JSON in request.')
 
     # special no op call, if noop is the only key in the request, just return the context
     # and a short message
-    if 'noop' in request and request.get('noop'):
+    if isinstance(request, dict) and request.get('noop'):
         if not request.get('skiplog'):
             log.info('NoOp called !')
             log.info('Nothing else was called, just Ping-Pong.')
-        response = dict(message='No Op call successful',
-                        context=context,
-                        success=True)
+        return noop_response(request, context)
+
+    if isinstance(request, list):
+        with timer('bulk'):
+            error, response = bulk_write(request, validate_request_params, int(BATCH_MAX_SIZE))
+        if error:
+            log.warning(fmt('batch not validated, {0}', error))
+            raise PostCallException(get_error_message(BAD_REQUEST, error))
         return response
 
-    if not validate_request_params(request):
-        msg = get_error_message(BAD_REQUEST, 'Parameter mismatch: validation failed.')
-        raise PostCallException(msg)
+    with timer('validate'):
+        error = validate_request_params(request)
+    if error:
+        log.warning(fmt('request not validated, {0}: {1}', error, request))
+        raise PostCallException(get_error_message(BAD_REQUEST, error))
 
     try:
         response['message'] = json.loads(request.update(dict(called='POST')))
 
     except PostCallException:
         log.info('Error returned.')
-        log.info('response was: {0}'.format(response))
+        log.info(fmt('response was: {0}', response))
         msg = get_error_message(BAD_REQUEST, response['message'])
         raise PostCallException(msg)
 
     except:
-        log.error('exception in a post call: {0}'.format(request))
-        log.error(traceback.print_exc())
+        log.exception(fmt('exception in a post call: {0}', request))
         msg = get_error_message(INTERNAL_SERVER_ERROR, 'Error in POST request !')
         raise PostCallException(msg)
 
@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
-import traceback
-
-from httplib import BAD_REQUEST, INTERNAL_SERVER_ERROR
 
 from config import *
-from utils.rpc_client import RpcClient, AmqpRpcError
-from utils import get_error_message
+from utils import BAD_REQUEST, INTERNAL_SERVER_ERROR, bulk_write, get_error_message, invalidation_client, noop_response
+from utils.logs import configure as configure_logs, fmt, log_invocation
+from utils.metrics import instrument, timer
+from utils.schema import Field, compile_schema
 
 log = logging.getLogger('put_call')
 log.setLevel(getattr(logging, LOG_LEVEL.upper()))
+configure_logs(max_size=LOG_MAX_SIZE)
 
 
 class PutCallException(Exception):
@@ -21,54 +21,64 @@ class PutCallException(Exception):
     """
 
 
-def validate_request_params(request):
-    """
-        Validates the incoming request to match the minimum
-        requirements to be able to handle this request.
-
-    :param request: JSON/dict
-    :return: Boolean
-
-    """
-    try:
-        return True
-
-    except AssertionError:
-        log.warning('Request validation failed for: {0}'.format(request))
-        return False
+REQUEST_SCHEMA = {
+    'stuff_id': Field('string', blank=False, max_length=128),
+}
+"Fields of a put request, see utils.schema."
+validate_request_params = compile_schema('put_call', REQUEST_SCHEMA)
 
 
+@log_invocation('put_call', sample_rate=LOG_SAMPLE_RATE)
+@instrument('put_call', namespace=METRICS_NAMESPACE)
 def update_entry_handler(request, context):
-    log.info('put call got request: {0}'.format(request))
+    log.debug(fmt('put call got request: {0}', request))
     response = dict(success=False,
                     message='')
 
     if isinstance(request, str) or isinstance(request, unicode):
         try:
-            log.info('Got string request, converting to JSON.')
-            request = json.loads(request)
+            log.debug('Got string request, converting to JSON.')
+            with timer('parse'):
+                request = json.loads(request)
         except ValueError:
-            log.warning('got malformed JSON request: {0}'.format(request))
+            log.warning(fmt('got malformed JSON request: {0}', request))
             msg = get_error_message(BAD_REQUEST, 'Malformed JSON in request.')
             raise PutCallException(msg)
 
-    if not validate_request_params(request):
-        msg = get_error_message(BAD_REQUEST, 'Parameter mismatch: validation failed.')
-        raise PutCallException(msg)
+    # keep warm pings, see utils.noop_response
+    if isinstance(request, dict) and request.get('noop'):
+        if not request.get('skiplog'):
+            log.info('NoOp called !')
+        return noop_response(request, context)
+
+    if isinstance(request, list):
+        with timer('bulk'):
+            error, response = bulk_write(request, validate_request_params, int(BATCH_MAX_SIZE), AMQP_EXCHANGE)
+        if error:
+            log.warning(fmt('batch not validated, {0}', error))
+            raise PutCallException(get_error_message(BAD_REQUEST, error))
+        return response
+
+    with timer('validate'):
+        error = validate_request_params(request)
+    if error:
+        log.warning(fmt('request not validated, {0}: {1}', error, request))
+        raise PutCallException(get_error_message(BAD_REQUEST, error))
 
     try:
         # this time return JSON, not stringified
         response = request.update(dict(calles='PUT'))
+        if request.get('stuff_id') is not None:
+            invalidation_client(AMQP_EXCHANGE, 'stuff').invalidate(request['stuff_id'])
         return response
 
     except PutCallException:
         log.info('Error on response')
-        log.info('response was {0}'.format(response))
+        log.info(fmt('response was {0}', response))
         msg = get_error_message(BAD_REQUEST, response['message'])
         raise PutCallException(msg)
 
     except:
-        log.error('exception in update: {0}'.format(request))
-        log.error(traceback.print_exc())
+        log.exception(fmt('exception in update: {0}', request))
         msg = get_error_message(INTERNAL_SERVER_ERROR, 'Error in PUT call request !')
         raise PutCallException(msg)
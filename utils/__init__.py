@@ -1,6 +1,139 @@
 # -*- coding: utf-8 -*-
+import binascii
+import functools
+import os
+import time
+
+# the status codes of httplib, which takes longer to import (it loads ssl) than the rest of a handler
+BAD_REQUEST = 400
+INTERNAL_SERVER_ERROR = 500
+
+MAX_HOLD_MS = 1000
+"Longest a noop request may hold its container, see :py:func:`noop_response`."
+
+
+def new_id():
+    """ Return a random 32 digit hex ID like ``uuid4().hex``, without the import time of :py:mod:`uuid`. """
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+CONTAINER_ID = new_id()
+"Unique identifier of this process, i.e. the (warm) Lambda container."
+
+STARTED = time.time()
+"When this container was started, i.e. when the handler imported utils."
 
 
 def get_error_message(error_code, message, *args):
     items = [error_code, message] + list(args)
     return '--'.join([str(x) for x in items])
+
+
+def validate_batch(validate, items, max_size):
+    """
+    Validate all items of a bulk request in a single pass.
+
+    :param validate: the validator of one item, see utils.schema.compile_schema
+    :param items: list of the requests
+    :param max_size: most items a batch may have
+
+    :return: tuple ``(error, results)``, the error message rejects the whole batch, else it is None and the
+        results hold a dict per item with its ``index``, its ``success`` and the error ``message`` of an
+        invalid item, see get_error_message
+    """
+    if not items:
+        return 'Empty batch.', None
+    if len(items) > max_size:
+        return 'Batch of {0} items, at most {1} allowed.'.format(len(items), max_size), None
+    results = []
+    for index, item in enumerate(items):
+        error = validate(item)
+        results.append(dict(index=index, success=error is None,
+                            message=get_error_message(BAD_REQUEST, error) if error else ''))
+    return None, results
+
+
+def bulk_write(items, validate, max_size, exchange_name=None):
+    """
+    Handle the items of a bulk write: validate them in a single pass (see
+    validate_batch) and announce the changed stuff of all valid items to the
+    caches of get_call in one message.
+
+    :param validate: the validator of one item, see utils.schema.compile_schema
+    :param max_size: most items a batch may have
+    :param exchange_name: exchange of the invalidations, None if the write changes no cached stuff
+
+    :return: tuple ``(error, response)``, the error message rejects the whole batch, else it is None and the
+        response has the ``results`` of every item, it is a ``success`` if all items are
+    """
+    error, results = validate_batch(validate, items, max_size)
+    if error:
+        return error, None
+    stuff_ids = [item['stuff_id'] for item, result in zip(items, results)
+                 if result['success'] and item.get('stuff_id') is not None]
+    if stuff_ids and exchange_name is not None:
+        invalidation_client(exchange_name, 'stuff').invalidate_many(stuff_ids)
+    return None, dict(success=all(result['success'] for result in results), message='', results=results)
+
+
+_invalidation_clients = {}
+
+
+def invalidation_client(exchange_name, entity):
+    """
+    Return the client announcing changes of an entity (see
+    utils.rpc_client.InvalidationClient), made on first use and kept for the
+    lifetime of the container, so kombu is only imported by handlers which
+    actually write.
+
+    """
+    key = (exchange_name, entity)
+    if key not in _invalidation_clients:
+        from utils.rpc_client import InvalidationClient
+        _invalidation_clients[key] = InvalidationClient(exchange_name, entity)
+    return _invalidation_clients[key]
+
+
+def once(setup):
+    """
+    Decorate the expensive setup of a handler module, i.e. a client with its
+    imports. It runs on first use instead of at import time, so a cold start
+    answering a noop or an invalid request does not pay for it, and its
+    result is kept for the lifetime of the container.
+
+    """
+    result = []
+
+    @functools.wraps(setup)
+    def wrapper():
+        if not result:
+            result.append(setup())
+        return result[0]
+
+    wrapper.reset = lambda: result.pop() if result else None
+    return wrapper
+
+
+def noop_response(request, context):
+    """
+    Answer a ``noop`` (keep warm) request, with the identity of the container
+    so a warmer can count the distinct containers it reached.
+
+    ``hold_ms`` keeps the container busy for that long (at most
+    :py:data:`MAX_HOLD_MS`), so concurrent pings are not all answered by the
+    same container, ``metrics`` adds the latency histograms of the container,
+    see :py:mod:`utils.metrics`.
+
+    """
+    hold_ms = request.get('hold_ms')
+    if hold_ms:
+        time.sleep(min(float(hold_ms), MAX_HOLD_MS) / 1000.0)
+    response = dict(message='No Op call successful',
+                    context=context,
+                    success=True,
+                    container_id=CONTAINER_ID,
+                    uptime_s=round(time.time() - STARTED, 3))
+    if request.get('metrics'):
+        from utils import metrics
+        response['metrics'] = metrics.dump()
+    return response
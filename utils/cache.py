@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+"The entry is within its TTL."
+
+STALE = 'stale'
+"The entry expired, but may still be served while it is being revalidated."
+
+MISS = 'miss'
+"There is no usable entry."
+
+
+class ResponseCache(object):
+    """
+    A bounded in-process cache of responses, which lives at module level and
+    therefore survives warm invocations of a Lambda container.
+
+    Entries are evicted least recently used first once *max_size* is reached.
+    An entry is fresh for *ttl* seconds and can then be served stale for
+    another *stale_ttl* seconds while a new value is fetched in the background
+    (stale-while-revalidate). Entries can be tagged with the ID of the entity
+    they contain, so a write to that entity drops every cached response of it.
+
+    """
+    def __init__(self, max_size=256, ttl=30, stale_ttl=0, ignore_keys=(), clock=time.time):
+        """
+        :param max_size:
+            Maximum number of entries.
+
+        :param ttl:
+            Seconds an entry is fresh.
+
+        :param stale_ttl:
+            Seconds an entry may be served stale after the TTL expired.
+
+        :param ignore_keys:
+            Request keys which do not change the response, i.e. logging flags.
+
+        :param clock:
+            Function returning the current time in seconds.
+
+        """
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self.stale_ttl = float(stale_ttl)
+        self.ignore_keys = frozenset(ignore_keys)
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.entity_keys = {}
+        self.revalidating = {}
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return '<ResponseCache size={0}/{1} ttl={2}s>'.format(len(self.entries), self.max_size, self.ttl)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def make_key(self, request):
+        """
+        Return the canonical form of a request, equal for requests which only
+        differ in key order or in ignored keys.
+
+        :param request: dict
+
+        :return: str
+
+        """
+        return json.dumps(dict((k, v) for k, v in request.items() if k not in self.ignore_keys),
+                          sort_keys=True, separators=(',', ':'))
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        :return:
+            A tuple ``(value, state)`` with state being one of :py:data:`FRESH`,
+            :py:data:`STALE` or :py:data:`MISS` (value is None then).
+
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None, MISS
+
+            value, stored, entity_id = entry
+            age = self.clock() - stored
+            if age >= self.ttl + self.stale_ttl:
+                self._unlink(key, entity_id)
+                self.misses += 1
+                return None, MISS
+
+            # re-insert to mark it as most recently used
+            self.entries[key] = entry
+            if age >= self.ttl:
+                self.stale_hits += 1
+                return value, STALE
+
+            self.hits += 1
+            return value, FRESH
+
+    def set(self, key, value, entity_id=None):
+        """
+        Store an entry, evicting the least recently used ones if needed.
+
+        :param entity_id:
+            ID of the entity the value contains, see :py:meth:`invalidate`.
+
+        """
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self._unlink(key, old[2])
+            self.entries[key] = (value, self.clock(), entity_id)
+            if entity_id is not None:
+                self.entity_keys.setdefault(entity_id, set()).add(key)
+
+            while len(self.entries) > self.max_size:
+                old_key, old = self.entries.popitem(last=False)
+                self._unlink(old_key, old[2])
+                self.evictions += 1
+
+    def invalidate(self, entity_id):
+        """
+        Drop all entries tagged with an entity ID.
+
+        :return:
+            The number of entries dropped.
+
+        """
+        with self.lock:
+            keys = self.entity_keys.pop(entity_id, ())
+            for key in keys:
+                self.entries.pop(key, None)
+                self.revalidating.pop(key, None)
+            self.invalidations += len(keys)
+        if keys:
+            log.debug('Invalidated {0} cached responses for {1}'.format(len(keys), entity_id))
+        return len(keys)
+
+    def clear(self):
+        """ Drop everything, i.e. if invalidations may have been missed. """
+        with self.lock:
+            self.entries.clear()
+            self.entity_keys.clear()
+            self.revalidating.clear()
+
+    def revalidate(self, key, entity_id, fetch):
+        """
+        Start fetching a new value for a stale entry, unless that is in
+        progress already.
+
+        :param fetch:
+            Callable returning a future-like object (``done()``,
+            ``exception()``, ``result()``) for the new value. It is called
+            without holding the cache lock, the invalidations arriving while
+            it publishes need that lock.
+
+        """
+        with self.lock:
+            if key in self.revalidating:
+                return
+            self.revalidating[key] = (entity_id, None)
+        try:
+            future = fetch()
+        except Exception:
+            with self.lock:
+                self.revalidating.pop(key, None)
+            raise
+        with self.lock:
+            # an invalidation in the meantime dropped the placeholder
+            if key in self.revalidating:
+                self.revalidating[key] = (entity_id, future)
+
+    def collect(self, accept=None):
+        """
+        Store the values of finished revalidations.
+
+        :param accept:
+            Optional callable deciding whether a value may be cached.
+
+        """
+        with self.lock:
+            done = [(k, v) for k, v in self.revalidating.items() if v[1] is not None and v[1].done()]
+            for key, (entity_id, future) in done:
+                del self.revalidating[key]
+                if future.exception() is not None:
+                    continue
+                value = future.result()
+                if accept is None or accept(value):
+                    self.set(key, value, entity_id)
+
+    def _unlink(self, key, entity_id):
+        keys = self.entity_keys.get(entity_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.entity_keys[entity_id]
+
+    def stats(self):
+        """
+        Report the counters for tuning.
+
+        :return: dict
+
+        """
+        return dict(size=len(self.entries),
+                    max_size=self.max_size,
+                    hits=self.hits,
+                    stale_hits=self.stale_hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    invalidations=self.invalidations,
+                    revalidating=len(self.revalidating))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import socket
+import threading
+
+from utils.logs import fmt
+
+log = logging.getLogger(__name__)
+
+
+class _Call(object):
+    """ One call in flight, shared by everybody asking for the same key. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls: while a call for a key is in
+    flight, further callers asking for the same key wait for it and all get
+    its result (or its error) instead of making their own call.
+
+    The result object is shared between all callers, it must not be modified.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def __repr__(self):
+        return '<SingleFlight in_flight={0} coalesced={1}>'.format(len(self.calls), self.coalesced)
+
+    def do(self, key, function, timeout=None):
+        """
+        Call *function* unless a call for *key* is in flight already.
+
+        :param key:
+            Hashable identifying equal calls.
+
+        :param function:
+            Callable without arguments doing the actual call.
+
+        :param timeout:
+            Seconds to wait for a call made by somebody else.
+
+        :raises:
+            The error of the call, or :py:exc:`socket.timeout` if the call
+            made by somebody else did not finish in time.
+
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            log.debug(fmt('Waiting for call in flight: {0}', key))
+            if not call.event.wait(timeout):
+                raise socket.timeout('Call in flight did not finish in time')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap logging for the lambda handlers: messages are only formatted when a
+record is actually emitted, payloads are cut to a maximum size while they are
+rendered (not after), and credentials are never written.
+
+Every handler invocation is summed up in one JSON line, errors always (with
+the shortened request) and successful calls only for a sampled share of the
+invocations.
+
+"""
+import functools
+import json
+import random
+import sys
+import threading
+import time
+from json.encoder import encode_basestring_ascii as encode_string
+
+DEFAULT_MAX_SIZE = 1024
+"Characters a logged payload is cut to."
+
+REDACTED_KEYS = frozenset(['authorizationToken', 'auth-token', 'authorization', 'Authorization', 'password'])
+"Keys of logged dicts whose values are replaced."
+
+REDACTED = '***'
+
+settings = dict(max_size=DEFAULT_MAX_SIZE)
+"Set with :py:func:`configure`."
+
+_current = threading.local()
+
+
+def configure(max_size=DEFAULT_MAX_SIZE):
+    """
+    Set up the logging of a handler module, once per container.
+
+    :param max_size: characters a logged payload is cut to
+    """
+    settings['max_size'] = int(max_size)
+
+
+_SCALARS = {None: 'null', True: 'true', False: 'false'}
+
+
+class _Writer(object):
+    """ Renders a value into a bounded number of characters. """
+
+    def __init__(self, max_size):
+        self.parts = []
+        self.budget = max_size
+
+    def write(self, text):
+        if self.budget > 0:
+            self.parts.append(text if len(text) <= self.budget else text[:self.budget])
+        self.budget -= len(text)
+
+    def value(self, value):
+        if self.budget <= 0:
+            return
+        if isinstance(value, dict):
+            self.write('{')
+            first = True
+            for key, item in value.items():
+                if self.budget <= 0:
+                    break
+                if not first:
+                    self.write(', ')
+                first = False
+                self.value(key)
+                self.write(': ')
+                self.value(REDACTED if key in REDACTED_KEYS else item)
+            self.write('}')
+        elif isinstance(value, (list, tuple)):
+            self.write('[')
+            first = True
+            for item in value:
+                if self.budget <= 0:
+                    break
+                if not first:
+                    self.write(', ')
+                first = False
+                self.value(item)
+            self.write(']')
+        elif isinstance(value, (bytes, type(u''))):
+            try:
+                self.write(encode_string(value[:self.budget + 1]))
+            except UnicodeDecodeError:
+                self.write(repr(value[:self.budget + 1]))
+        elif value is None or isinstance(value, bool):
+            self.write(_SCALARS[value])
+        elif isinstance(value, (int, float)):
+            self.write(repr(value))
+        else:
+            self.write(repr(value))
+
+
+def shorten(value, max_size=None):
+    """
+    Render a value for the log, in time and space proportional to
+    *max_size* and not to the size of the value.
+
+    :return: text of at most *max_size* characters plus a marker if it was cut
+    """
+    max_size = settings['max_size'] if max_size is None else max_size
+    if isinstance(value, (bytes, type(u''))):
+        text = value[:max_size]
+        cut = len(value) > max_size
+    else:
+        writer = _Writer(max_size)
+        writer.value(value)
+        text = ''.join(writer.parts)
+        cut = writer.budget < 0
+    return text + '...' if cut else text
+
+
+class LazyMessage(object):
+    """
+    A log message formatted with :py:meth:`str.format` only when the record
+    is emitted, the arguments are shortened.
+
+    """
+    __slots__ = ('message', 'args')
+
+    def __init__(self, message, args):
+        self.message = message
+        self.args = args
+
+    def __str__(self):
+        text = self.message.format(*[shorten(arg) for arg in self.args])
+        if not isinstance(text, str):
+            text = text.encode('utf-8')
+        return text
+
+
+def fmt(message, *args):
+    """
+    Create a message to be logged, i.e. ``log.debug(fmt('got request: {0}', request))``.
+
+    """
+    return LazyMessage(message, args)
+
+
+class Invocation(object):
+    """
+    Collects the fields of the summary line of one handler invocation.
+
+    """
+    stream = sys.stdout
+    "Where the summary lines are written to, the Lambda runtime sends stdout to CloudWatch."
+
+    cold = True
+    "True for the first invocation in a container."
+
+    def __init__(self, name, request, context):
+        self.name = name
+        self.request = request
+        self.start = time.time()
+        self.fields = dict(handler=name, request_id=getattr(context, 'aws_request_id', None),
+                           cold=Invocation.cold, status='ok')
+        Invocation.cold = False
+
+    def add(self, **fields):
+        self.fields.update(fields)
+
+    def failed(self, error):
+        # handler errors are formatted for API Gateway, i.e. '400--message'
+        status, _, message = str(error).partition('--')
+        self.add(status=status if message else 'error', error=shorten(message or str(error)),
+                 error_type=type(error).__name__)
+
+    def emit(self):
+        fields = dict(self.fields, duration_ms=round((time.time() - self.start) * 1000, 3))
+        if fields['status'] != 'ok':
+            # only worth the CPU if something went wrong
+            fields['request'] = shorten(self.request)
+        self.stream.write(json.dumps(fields, default=repr) + '\n')
+
+
+def add_fields(**fields):
+    """
+    Add fields to the summary line of the running invocation, if any.
+
+    :return: True if there is a running invocation
+    """
+    invocation = getattr(_current, 'invocation', None)
+    if invocation is None:
+        return False
+    invocation.add(**fields)
+    return True
+
+
+def log_invocation(name, sample_rate=1.0):
+    """
+    Decorate a handler to write one JSON summary line per invocation: always
+    for errors, for a *sample_rate* share of the other invocations. Calls
+    with the ``skiplog`` flag are only logged if they fail.
+
+    """
+    sample_rate = float(sample_rate)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(request, context):
+            sampled = random.random() < sample_rate
+            invocation = _current.invocation = Invocation(name, request, context)
+            failed = False
+            try:
+                return handler(request, context)
+            except Exception as err:
+                failed = True
+                invocation.failed(err)
+                raise
+            finally:
+                _current.invocation = None
+                skip = isinstance(request, dict) and request.get('skiplog')
+                if failed or (sampled and not skip):
+                    invocation.emit()
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Per-phase latency instrumentation. Code paths are timed with
+:py:func:`timer`, every timing goes into an in-process histogram kept for the
+lifetime of the container, and into the metrics of the running invocation,
+which :py:func:`instrument` adds in the CloudWatch Embedded Metric Format to
+the summary line of the invocation (see :py:func:`utils.logs.log_invocation`)
+when the handler returns.
+
+Phases of an RPC call: ``acquire`` (connection), ``declare`` (exchanges,
+queues and the reply consumer), ``encode``, ``publish``, ``wait`` (draining
+events, includes the ``decode`` of the replies arriving meanwhile) and
+``process_response``. Handlers time ``parse`` and ``validate``, ``total`` is
+the whole invocation.
+
+"""
+import bisect
+import functools
+import json
+import sys
+import threading
+import time
+
+from utils.logs import add_fields
+
+UNIT = 'Milliseconds'
+
+BUCKETS = [round(0.01 * 1.2 ** i, 4) for i in range(90)]
+"Upper bounds of the histogram buckets in ms, 0.01 ms to about 130 s, 20% apart."
+
+stream = sys.stdout
+"Where the metric lines are written to, the Lambda runtime sends stdout to CloudWatch."
+
+_current = threading.local()
+
+
+class Histogram(object):
+    """
+    Fixed size latency histogram, percentiles are accurate to a bucket
+    (20%), which is plenty to tell the phases apart.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return '<Histogram count={0}>'.format(self.count)
+
+    def record(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        :return: upper bound of the bucket holding the percentile, capped at the maximum seen
+        """
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return dict(count=self.count,
+                    mean=round(self.total / self.count, 4) if self.count else None,
+                    p50=self.percentile(50),
+                    p95=self.percentile(95),
+                    p99=self.percentile(99),
+                    max=round(self.max, 4))
+
+
+histograms = {}
+"Histograms by phase name, kept across warm invocations."
+
+_histograms_lock = threading.Lock()
+
+
+def record(name, milliseconds):
+    """ Record the duration of a phase. """
+    histogram = histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = histograms.setdefault(name, Histogram())
+    histogram.record(milliseconds)
+
+    phases = getattr(_current, 'phases', None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + milliseconds
+
+
+class timer(object):
+    """
+    Context manager timing a phase, i.e. ``with timer('publish'): ...``.
+    Phases repeated within an invocation are summed up.
+
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, (time.time() - self.start) * 1000)
+
+
+def emf_document(namespace, function_name, phases):
+    """
+    Format the metrics of one invocation in the CloudWatch Embedded Metric
+    Format, CloudWatch extracts the metrics from the log line they are part of.
+
+    """
+    document = dict((name, round(value, 3)) for name, value in phases.items())
+    document['function'] = function_name
+    document['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': namespace,
+            'Dimensions': [['function']],
+            'Metrics': [{'Name': name, 'Unit': UNIT} for name in sorted(phases)],
+        }],
+    }
+    return document
+
+
+def instrument(function_name, namespace=None):
+    """
+    Decorate a handler to time it and add the metrics of every invocation to
+    its summary line, unless *namespace* is empty. Without a summary line,
+    i.e. if the handler is not decorated with
+    :py:func:`utils.logs.log_invocation`, the metrics are written on a line of
+    their own. ``noop`` calls (keep warm pings) are neither timed nor written.
+
+    The metrics are sampled along with the summary line: CloudWatch only
+    gets them for the failed and the sampled successful invocations, so the
+    counts are scaled down by the sample rate and overstate the share of
+    errors. Latency percentiles are not affected, a sample rate of 1 gives
+    exact counts.
+
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(request, context):
+            if isinstance(request, dict) and request.get('noop'):
+                return handler(request, context)
+            phases = _current.phases = {}
+            try:
+                with timer('total'):
+                    return handler(request, context)
+            finally:
+                _current.phases = None
+                if namespace:
+                    document = emf_document(namespace, function_name, phases)
+                    if not add_fields(**document):
+                        stream.write(json.dumps(document, separators=(',', ':')) + '\n')
+        return wrapper
+    return decorator
+
+
+def dump():
+    """
+    :return: dict of phase name to count, mean, p50, p95, p99 and max in ms
+    """
+    return dict((name, histogram.snapshot()) for name, histogram in list(histograms.items()))
+
+
+def reset():
+    histograms.clear()
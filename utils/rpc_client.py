@@ -2,16 +2,53 @@
 
 import json
 import logging
-from uuid import uuid4
+import socket
+import threading
+import time
+from collections import deque, namedtuple
 
 import config
-from kombu import Connection, Consumer, Exchange, Producer, Queue
-from kombu.pools import connections
+
+from utils import CONTAINER_ID, new_id
+from utils.coalesce import SingleFlight
+from utils.logs import fmt
+from utils.metrics import timer
+from utils.serialization import (ACCEPT_ENCODING_HEADER, CodecError, compress, compressors, decompress,
+                                 get_codec, get_codec_for)
 
 log = logging.getLogger()
 log.setLevel(getattr(logging, config.LOG_LEVEL.upper()))
 
 
+REPLY_MODE_SHARED = 'shared'
+"Replies arrive on one named queue shared by every caller of the service."
+
+REPLY_MODE_EXCLUSIVE = 'exclusive'
+"Replies arrive on a private, auto-deleted queue owned by this container."
+
+REPLY_MODE_DIRECT = 'direct'
+"Replies use RabbitMQ direct reply-to, no reply queue is declared at all."
+
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'
+"The pseudo queue name used by RabbitMQ for direct reply-to."
+
+INVALIDATION_ROUTING_KEY = 'invalidate.{0}'
+"Routing key (formatted with the entity name) for announcing changed entities."
+
+DRAIN_INTERVAL = 0.05
+"Maximum time in seconds a single wait for events holds the I/O lock, so other threads can publish in between."
+
+CHUNK_HEADER = 'x-chunk'
+"Header with the index of a chunk of a streamed reply, the chunks of a reply share its correlation ID."
+
+LAST_CHUNK_HEADER = 'x-last-chunk'
+"Header marking the last chunk of a streamed reply."
+
+
+RpcResult = namedtuple('RpcResult', ['result', 'error'])
+"""The outcome of one call of :py:meth:`RpcClient.call_many`, *error* is None on success."""
+
+
 class AmqpRpcError(Exception):
     """ Raised if there is an error making an RPC call over AMQP. """
     pass
@@ -22,6 +59,282 @@ class ValidationError(Exception):
     pass
 
 
+class ReplyDispatcher(object):
+    """
+    Routes replies to the call waiting for them, based on the correlation ID.
+
+    One dispatcher is shared by all clients in the container, so a reply
+    which arrives while another call is being waited for is kept until its
+    owner asks for it instead of being requeued.
+
+    The channels of a Kombu connection are not thread-safe, so every thread
+    holds :py:attr:`io_lock` while it publishes, declares or drains on the
+    managed connection.
+
+    """
+    def __init__(self):
+        self.waiting = set()
+        self.replies = {}
+        self.chunks = {}
+        self.io_lock = threading.RLock()
+
+    def expect(self, correlation_id):
+        """ Register a correlation ID a reply is expected for. """
+        self.waiting.add(correlation_id)
+
+    def forget(self, correlation_id):
+        """ Stop waiting for a reply, i.e. after it was received or the call failed. """
+        self.waiting.discard(correlation_id)
+        self.replies.pop(correlation_id, None)
+        self.chunks.pop(correlation_id, None)
+
+    def is_waiting(self, correlation_id):
+        return correlation_id in self.waiting
+
+    def deliver(self, correlation_id, result, error_response=False):
+        """ Store the reply for a correlation ID somebody is waiting for. """
+        self.replies[correlation_id] = (result, error_response)
+
+    def deliver_chunk(self, correlation_id, index, result, last, error_response=False):
+        """ Queue a chunk of a streamed reply until its owner takes it. """
+        self.chunks.setdefault(correlation_id, deque()).append((index, result, last, error_response))
+
+    def has_reply(self, correlation_id):
+        return correlation_id in self.replies or bool(self.chunks.get(correlation_id))
+
+    def is_complete(self, correlation_id):
+        """ Return True if the whole reply arrived, i.e. the last chunk of a streamed one. """
+        chunks = self.chunks.get(correlation_id)
+        return correlation_id in self.replies or bool(chunks) and chunks[-1][2]
+
+    def pop_chunk(self, correlation_id):
+        """
+        Return and remove the oldest chunk received for a correlation ID.
+
+        :return:
+            A tuple ``(index, result, last, error_response)``.
+
+        """
+        return self.chunks[correlation_id].popleft()
+
+    def pop_reply(self, correlation_id):
+        """
+        Return and remove the reply for a correlation ID.
+
+        :return:
+            A tuple ``(result, error_response)``.
+
+        """
+        self.waiting.discard(correlation_id)
+        return self.replies.pop(correlation_id)
+
+    def wait_for(self, connection, correlation_ids, timeout):
+        """
+        Process incoming events until a reply arrived for every correlation
+        ID. Only one thread drains the connection at a time, replies for the
+        other threads are delivered by whichever thread is draining.
+
+        :param connection:
+            A Kombu Connection instance with the reply consumer set up.
+
+        :param correlation_ids:
+            The correlation IDs to wait for.
+
+        :param timeout:
+            Maximum time to wait in seconds.
+
+        :raises:
+            :py:exc:`socket.timeout` if not all replies arrived in time.
+
+        """
+        deadline = time.time() + timeout
+        while True:
+            missing = [c for c in correlation_ids if not self.has_reply(c)]
+            if not missing:
+                return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout('No reply for {0} of {1} calls'.format(len(missing), len(correlation_ids)))
+            with self.io_lock:
+                if not any(self.has_reply(c) for c in missing):
+                    try:
+                        connection.drain_events(timeout=min(remaining, DRAIN_INTERVAL))
+                    except socket.timeout:
+                        pass
+
+
+dispatcher = ReplyDispatcher()
+
+in_flight = SingleFlight()
+"Coalesces the blocking calls of clients with :py:attr:`RpcClient.coalesce` set."
+
+in_flight_futures = {}
+"The pending :py:class:`RpcFuture` of coalescing clients, by request."
+
+
+class ConnectionManager(object):
+    """
+    Keeps one AMQP connection and its default channel alive across warm
+    invocations of a Lambda container, together with everything declared on
+    it, so a request only pays for the publish and the reply.
+
+    Lambda freezes the process between invocations, so heartbeats are not sent
+    and the broker may have dropped the connection in the meantime. Every
+    :py:meth:`acquire` therefore checks the heartbeat and transparently
+    reconnects a dead connection, which also forgets all declarations and
+    consumers made on it.
+
+    """
+    def __init__(self, connection_factory=None):
+        """
+        :param connection_factory:
+            Callable returning a new (not yet connected) Kombu Connection,
+            defaults to :py:func:`get_amqp_connection`.
+
+        """
+        if connection_factory is None:
+            connection_factory = get_amqp_connection
+        self.connection_factory = connection_factory
+        self.connection = None
+        self.lock = threading.RLock()
+
+        self.declared = set()
+        self.producers = {}
+        self.consumers = {}
+
+        self.acquire_count = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self.acquire_wait_last = 0.0
+        self.connect_count = 0
+
+    def __repr__(self):
+        return '<ConnectionManager connected={0} declared={1}>'.format(
+            self.connection is not None, len(self.declared))
+
+    def is_alive(self):
+        """ Check the current connection, without blocking for I/O. """
+        if self.connection is None or not self.connection.connected:
+            return False
+        try:
+            self.connection.heartbeat_check()
+        except self.connection.recoverable_connection_errors + self.connection.connection_errors:
+            log.info('AMQP connection is dead, reconnecting')
+            return False
+        return True
+
+    def acquire(self):
+        """
+        Return the connection, (re)connecting if needed.
+
+        :return:
+            A connected Kombu Connection instance.
+
+        """
+        start = time.time()
+        with timer('acquire'), self.lock:
+            if not self.is_alive():
+                self.reset()
+                connection = self.connection_factory()
+                connection.ensure_connection(max_retries=3)
+                self.connection = connection
+                self.connect_count += 1
+                log.debug('AMQP connection established: {0}'.format(connection.as_uri()))
+            connection = self.connection
+
+        wait = time.time() - start
+        self.acquire_count += 1
+        self.acquire_wait_total += wait
+        self.acquire_wait_last = wait
+        self.acquire_wait_max = max(self.acquire_wait_max, wait)
+        return connection
+
+    def reset(self):
+        """ Throw away the connection and everything cached for it. """
+        with self.lock:
+            if self.connection is not None:
+                # the socket may be gone already, so just drop the resources
+                self.connection.collect()
+            self.connection = None
+            self.declared.clear()
+            self.producers.clear()
+            self.consumers.clear()
+
+    def maybe_declare(self, entity):
+        """
+        Declare an exchange or queue, unless it was declared on the current
+        connection already.
+
+        :param entity:
+            A Kombu Exchange or Queue instance.
+
+        """
+        key = (type(entity).__name__, entity.name)
+        if key not in self.declared:
+            with timer('declare'):
+                entity.maybe_bind(self.connection)
+                entity.declare()
+            self.declared.add(key)
+            log.debug('Declared {0}: {1}'.format(*key))
+
+    def get_producer(self, exchange, factory):
+        """
+        Return the cached producer for an exchange, declaring the exchange
+        once.
+
+        :param exchange:
+            The Kombu Exchange instance messages are published to.
+
+        :param factory:
+            Callable creating the Producer if it does not exist yet.
+
+        """
+        producer = self.producers.get(exchange.name)
+        if producer is None:
+            if exchange.name:
+                self.maybe_declare(exchange)
+            producer = self.producers[exchange.name] = factory()
+        return producer
+
+    def get_consumer(self, name, factory):
+        """
+        Return the consumer for a reply queue, which keeps consuming for the
+        lifetime of the connection.
+
+        :param name:
+            The name of the queue consumed from.
+
+        :param factory:
+            Callable creating the (not yet consuming) Consumer.
+
+        """
+        consumer = self.consumers.get(name)
+        if consumer is None:
+            with timer('declare'):
+                consumer = factory()
+                consumer.consume()
+            for queue in consumer.queues:
+                self.declared.add(('Queue', queue.name))
+            self.consumers[name] = consumer
+        return consumer
+
+    def stats(self):
+        """
+        Report the pool and acquire statistics.
+
+        :return:
+            A dictionary with the pool size and acquire wait times in seconds.
+
+        """
+        return dict(pool_size=int(self.connection is not None),
+                    connects=self.connect_count,
+                    acquires=self.acquire_count,
+                    acquire_wait_total=self.acquire_wait_total,
+                    acquire_wait_max=self.acquire_wait_max,
+                    acquire_wait_last=self.acquire_wait_last,
+                    declared=len(self.declared))
+
+
 class RpcClient(object):
     """
     A client Which makes an RPC call over AMQP and handles the response.
@@ -43,6 +356,28 @@ class RpcClient(object):
     service = 'OVERRIDE ME'
     "Name of the service being called (for use in log messages)"
 
+    reply_mode = REPLY_MODE_EXCLUSIVE
+    "How replies are received, one of the ``REPLY_MODE_*`` constants."
+
+    codec = 'json'
+    "Name of the :py:mod:`utils.serialization` codec requests are encoded with."
+
+    compression = None
+    "Name of the compression for large requests, None to never compress."
+
+    compression_level = None
+    "Compression level, None for the default of the compression."
+
+    compression_threshold = 4096
+    "Encoded requests smaller than this many bytes are sent uncompressed."
+
+    coalesce = False
+    """If True, identical requests in flight at the same time share one call
+    and its result. Only for side effect free requests."""
+
+    ping_message = {'ping': True}
+    "Request :py:meth:`prewarm` sends to check that the service answers."
+
     def __init__(self, logger=None):
         """
         Set up the client..
@@ -67,39 +402,47 @@ class RpcClient(object):
     def callback(self, message_body, message):
         """
         Handle the RPC response. If successful, the result of the call will be
-        stored in :py:attr:`self.result`.
+        handed to the :py:data:`dispatcher` under its correlation ID.
 
         :param message_body:
-            A dictionary containing the body of the message.
+            The raw body of the message, decoded here according to its
+            content type.
 
         :param message:
             The AMQP message.
 
         """
-        self.result = None
-        self.got_error_response = 'x-death' in message.headers
-
-        # Check this message relates to the request we just sent.
+        # Check this message relates to a request we are waiting for.
         message_correlation_id = message.properties.get('correlation_id')
-        if message_correlation_id == self.correlation_id:
+        if dispatcher.is_waiting(message_correlation_id):
             log.debug('Message received')
             message.ack()
-        else:
+        elif self.reply_mode == REPLY_MODE_SHARED:
             # Not for us, but another client may want it.
             log.debug('Message requeued')
             message.reject(requeue=True)
             return
-
-        if isinstance(message_body, dict):
-            self.result = message_body
         else:
-            try:
-                self.result = json.loads(message_body)
-            except ValueError as err:
-                log.exception('Failed to decode response')
-                raise ValidationError(str(err))
+            # Nobody else reads our reply queue, this is a late reply to a
+            # call which already gave up waiting for it.
+            log.debug('Dropped unexpected message: {0}'.format(message_correlation_id))
+            message.ack()
+            return
 
-        log.debug('Result of call: {0}'.format(self.result))
+        try:
+            with timer('decode'):
+                message_body = decompress(message_body, message.headers)
+                result = get_codec_for(message.content_type).decode(message_body)
+        except (CodecError, ValueError, TypeError) as err:
+            log.exception('Failed to decode response')
+            raise ValidationError(str(err))
+
+        if CHUNK_HEADER in message.headers:
+            dispatcher.deliver_chunk(message_correlation_id, message.headers[CHUNK_HEADER], result,
+                                     bool(message.headers.get(LAST_CHUNK_HEADER)), 'x-death' in message.headers)
+        else:
+            dispatcher.deliver(message_correlation_id, result, 'x-death' in message.headers)
+        log.debug(fmt('Result of call: {0}', result))
 
     def get_publisher(self, connection, exchange):
         """
@@ -118,7 +461,8 @@ class RpcClient(object):
             en/latest/reference/kombu.html#message-producer>`_ instance.
 
         """
-        return Producer(connection, exchange=exchange)
+        from kombu import Producer
+        return Producer(connection, exchange=exchange, auto_declare=False)
 
     def get_send_exchange(self, connection):
         """
@@ -150,14 +494,33 @@ class RpcClient(object):
         """
         self.correlation_id = correlation_id
         exchange = self.get_send_exchange(connection)
-        log.debug('Using exchange: {0}'.format(exchange))
-        publisher = self.get_publisher(connection, exchange)
-        publisher.publish(message_body,
-                          routing_key=routing_key,
-                          correlation_id=correlation_id,
-                          reply_to=self.response_routing_key)
+        publisher = connection_manager.get_producer(exchange, lambda: self.get_publisher(connection, exchange))
+        codec = get_codec(self.codec)
+        with timer('encode'):
+            body, headers = compress(codec.encode(message_body), self.compression,
+                                     self.compression_level, self.compression_threshold)
+        headers[ACCEPT_ENCODING_HEADER] = ','.join(sorted(compressors))
+        with timer('publish'):
+            publisher.publish(body,
+                              headers=headers,
+                              content_type=codec.content_type,
+                              content_encoding='binary',
+                              routing_key=routing_key,
+                              correlation_id=correlation_id,
+                              reply_to=self.get_reply_to())
         log.debug('Message published: {0}'.format(routing_key))
 
+    def get_reply_to(self):
+        """
+        Return the name of the queue the invoked service should reply to.
+
+        """
+        if self.reply_mode == REPLY_MODE_DIRECT:
+            return DIRECT_REPLY_TO
+        if self.reply_mode == REPLY_MODE_EXCLUSIVE:
+            return '{0}.{1}'.format(self.response_routing_key, CONTAINER_ID)
+        return self.response_routing_key
+
     def get_response_queue(self, connection, name=None):
         """
         Set up the queue on which to listen for responses.
@@ -166,7 +529,7 @@ class RpcClient(object):
            A Kombu Connection instance.
 
         :param name:
-            Name of the queue (detaults to routing key).
+            Name of the queue (defaults to the reply to queue of the reply mode).
 
         :return:
             A Kombu `Queue <https://kombu.readthedocs.org/en/latest/reference/
@@ -174,35 +537,128 @@ class RpcClient(object):
 
         """
         if name is None:
-            name = self.response_routing_key
+            name = self.get_reply_to()
 
+        from kombu import Queue
         exchange = get_exchange(connection)
-        queue = Queue(name, exchange, self.response_routing_key, connection.default_channel)
+        if self.reply_mode == REPLY_MODE_DIRECT:
+            queue = Queue(name, exchange, name, connection.default_channel, no_declare=True)
+        elif self.reply_mode == REPLY_MODE_EXCLUSIVE:
+            queue = Queue(name, exchange, name, connection.default_channel,
+                          exclusive=True, auto_delete=True, durable=False)
+        else:
+            queue = Queue(name, exchange, self.response_routing_key, connection.default_channel)
         queue.maybe_bind(connection)
 
         log.debug('Created queue: {0}'.format(queue))
         return queue
 
-    def listen_for_response(self, connection):
+    def get_response_consumer(self, connection):
         """
-        Set up a consumer and listen for a response. If successful, this will
-        return the contents of :py:attr:`self.result` which will have been set
-        up by the callback.
+        Create a consumer for the response queue. It has to be consuming before
+        the request is published, direct reply-to requires this and a private
+        reply queue must exist before the reply is sent.
 
         :param connection:
            A Kombu Connection instance.
 
+        :return:
+            A Kombu Consumer instance, to be used as context manager.
+
+        """
+        from kombu import Consumer
+        queue = self.get_response_queue(connection)
+        return Consumer(connection, queue, on_message=self.on_message,
+                        no_ack=self.reply_mode == REPLY_MODE_DIRECT)
+
+    def on_message(self, message):
+        """
+        Consumer hook receiving the undecoded message, so :py:meth:`callback`
+        decodes it exactly once with the codec of its content type.
+
+        """
+        self.callback(message.body, message)
+
+    def listen_for_response(self, connection, message=None):
+        """
+        Listen for the response to the last request sent. If successful, this
+        will return the processed contents of :py:attr:`self.result` which will
+        have been handed over by the callback, the chunks of a streamed
+        response merged by :py:meth:`merge_chunks`.
+
+        :param connection:
+           A Kombu Connection instance with a consumer set up by
+           :py:meth:`get_response_consumer`.
+
+        :param message:
+            The request, handed to :py:meth:`merge_chunks`.
+
         :return:
             A dictionary containing the result, or None if the request failed.
 
         """
         self.result = None
-        queue = self.get_response_queue(connection)
-        with Consumer(connection, queue, callbacks=[self.callback]):
-            while self.result is None:
-                connection.drain_events(timeout=self.amqp_timeout)
+        return self.merge_chunks(self.read_chunks(connection, self.correlation_id), message)
+
+    def read_chunks(self, connection, correlation_id, deadline=None):
+        """
+        Wait for the reply to a request and yield it processed, chunk by
+        chunk if the service streams it (see :py:data:`CHUNK_HEADER`). A
+        reply which is not chunked is yielded as the one and only chunk.
+
+        :param connection:
+           A Kombu Connection instance with the reply consumer set up.
+
+        :param correlation_id:
+            The correlation ID of the request.
+
+        :param deadline:
+            Time by which the whole reply must have arrived, by default the
+            AMQP timeout applies to every chunk.
+
+        :raises:
+            :py:exc:`ValidationError` if a chunk is missing or out of order,
+            :py:exc:`socket.timeout` if the reply does not arrive in time.
+
+        """
+        expected = 0
+        while True:
+            timeout = self.amqp_timeout if deadline is None else deadline - time.time()
+            with timer('wait'):
+                dispatcher.wait_for(connection, [correlation_id], timeout)
+            if correlation_id in dispatcher.replies:
+                self.result, self.got_error_response = dispatcher.pop_reply(correlation_id)
+                index, last = expected, True
+            else:
+                index, self.result, last, self.got_error_response = dispatcher.pop_chunk(correlation_id)
+            if index != expected:
+                raise ValidationError('{0} sent chunk {1}, expected {2}'.format(self.service, index, expected))
+            expected += 1
+            with timer('process_response'):
+                chunk = self.process_response(self.result)
+            yield chunk
+            if last:
+                return
+
+    def merge_chunks(self, chunks, message):
+        """
+        Combine the processed chunks of a reply into the result of a call.
+        Clients of services streaming their replies override this, i.e. to
+        concatenate the items of the chunks as they arrive.
+
+        :param chunks:
+            A generator of the processed chunks, see :py:meth:`read_chunks`.
+
+        :param message:
+            The request, None if unknown.
 
-        return self.process_response(self.result)
+        :return:
+            The one chunk of a reply which is not streamed, else the list of
+            the chunks.
+
+        """
+        results = list(chunks)
+        return results[0] if len(results) == 1 else results
 
     def call(self, message, response_required=True, reraise_exceptions=True, routing_key=None):
         """
@@ -228,22 +684,253 @@ class RpcClient(object):
             The result of the call.
 
         """
-        if response_required:
-            correlation_id = uuid4().hex
-        else:
-            correlation_id = None
+        routing_key = routing_key or self.send_routing_key
+
+        try:
+            if not response_required:
+                self.publish_request(routing_key, message, None)
+                return
+
+            if self.coalesce:
+                return in_flight.do(self.get_coalesce_key(routing_key, message),
+                                    lambda: self.request_reply(routing_key, message),
+                                    timeout=self.amqp_timeout)
+            return self.request_reply(routing_key, message)
+        except:
+            log.exception('Error in AMQP RPC call')
+            if reraise_exceptions:
+                raise
+
+    def request_reply(self, routing_key, message):
+        """
+        Send a request and wait for its response.
+
+        :return:
+            The processed response.
+
+        """
+        correlation_id = new_id()
+        dispatcher.expect(correlation_id)
+        try:
+            if self.reply_mode == REPLY_MODE_SHARED:
+                # a consumer on a shared queue must not outlive the call, it
+                # would hold on to replies for other clients, so the
+                # connection is kept to this call until it is cancelled
+                connection = connection_manager.acquire()
+                with dispatcher.io_lock, self.get_response_consumer(connection):
+                    self.send_request(connection, routing_key, message, correlation_id)
+                    return self.listen_for_response(connection, message)
+
+            connection = self.publish_request(routing_key, message, correlation_id)
+            return self.listen_for_response(connection, message)
+        finally:
+            dispatcher.forget(correlation_id)
+
+    def stream(self, message, routing_key=None):
+        """
+        Send a request whose reply the service may stream as a sequence of
+        chunk messages (see :py:data:`CHUNK_HEADER`) and yield the processed
+        chunks as they arrive, so only one chunk has to be decoded and held
+        at a time instead of the whole result. A reply which is not chunked
+        is yielded as the one and only chunk.
+
+        The AMQP timeout applies to every chunk. Chunks arriving after the
+        generator was closed are dropped like other late replies.
+
+        :param message:
+            A dictionary containing the data to be sent.
+
+        :param routing_key:
+            If supplied will be used in preference to the class attribute.
+
+        :raises:
+            :py:exc:`ValidationError` if a chunk is missing or out of order.
+
+        :return:
+            A generator of the processed chunks.
+
+        """
+        if self.reply_mode == REPLY_MODE_SHARED:
+            raise AmqpRpcError('Streamed replies need a private reply queue, not {0}'.format(self.reply_mode))
+
+        correlation_id = new_id()
+        dispatcher.expect(correlation_id)
+        try:
+            connection = self.publish_request(routing_key or self.send_routing_key, message, correlation_id)
+            for chunk in self.read_chunks(connection, correlation_id):
+                yield chunk
+        finally:
+            dispatcher.forget(correlation_id)
+
+    def get_coalesce_key(self, routing_key, message):
+        """
+        Return the key identifying equal requests, see :py:attr:`coalesce`.
+
+        """
+        return json.dumps([self.service, routing_key, message], sort_keys=True, separators=(',', ':'))
+
+    def call_async(self, message, routing_key=None, timeout=None):
+        """
+        Send a request without waiting for the response. Any number of calls
+        can be in flight on the one channel, their replies are told apart by
+        correlation ID.
+
+        :param message:
+            A dictionary containing the data to be sent.
+
+        :param routing_key:
+            If supplied will be used in preference to the class attribute.
+
+        :param timeout:
+            Seconds to wait for the response, defaults to the AMQP timeout.
+
+        :return:
+            A :py:class:`RpcFuture` for the result of the call.
+
+        """
+        if self.reply_mode == REPLY_MODE_SHARED:
+            raise AmqpRpcError('Asynchronous calls need a private reply queue, not {0}'.format(self.reply_mode))
 
         routing_key = routing_key or self.send_routing_key
+        if self.coalesce:
+            key = self.get_coalesce_key(routing_key, message)
+            future = in_flight_futures.get(key)
+            if future is not None and not future.done():
+                in_flight.coalesced += 1
+                return future
+
+        correlation_id = new_id()
+        dispatcher.expect(correlation_id)
+        try:
+            connection = self.publish_request(routing_key, message, correlation_id)
+        except:
+            dispatcher.forget(correlation_id)
+            log.exception('Error in AMQP RPC call')
+            raise
+
+        if timeout is None:
+            timeout = self.amqp_timeout
+        future = RpcFuture(self, connection, correlation_id, time.time() + timeout, message)
+        if self.coalesce:
+            for done in [k for k, f in in_flight_futures.items() if f.done()]:
+                del in_flight_futures[done]
+            in_flight_futures[key] = future
+        return future
+
+    def call_many(self, messages, routing_key=None, timeout=None):
+        """
+        Scatter-gather: send all requests back to back and collect the replies
+        with the one reply consumer, so N calls cost about one round trip.
+
+        :param messages:
+            Iterable of dictionaries, each the data of one request.
+
+        :param routing_key:
+            If supplied will be used in preference to the class attribute.
+
+        :param timeout:
+            Deadline for the whole batch in seconds, defaults to the AMQP
+            timeout.
+
+        :return:
+            A list of :py:class:`RpcResult`, in the order of *messages*. Calls
+            which failed or did not get a reply in time carry the error.
+
+        """
+        if timeout is None:
+            timeout = self.amqp_timeout
+
+        results = []
+        futures = []
+        for message in messages:
+            try:
+                futures.append(self.call_async(message, routing_key=routing_key, timeout=timeout))
+                results.append(None)
+            except Exception as err:
+                futures.append(None)
+                results.append(RpcResult(None, err))
+
+        wait([f for f in futures if f is not None], timeout)
+
+        for index, future in enumerate(futures):
+            if future is not None:
+                error = future.exception()
+                results[index] = RpcResult(None if error else future.result(), error)
+        log.debug('{0} calls to {1}, {2} failed'.format(
+            len(results), self.service, len([r for r in results if r.error])))
+        return results
+
+    def publish_request(self, routing_key, message_body, correlation_id):
+        """
+        Send a request on the managed connection, making sure the persistent
+        reply consumer is running first if a reply is expected. A connection
+        which turns out to be dead is replaced once, nothing has been sent on it
+        at that point.
+
+        :return:
+            The connection the request was sent on.
 
-        with get_amqp_connection() as connection:
+        """
+        for retry in (True, False):
+            connection = connection_manager.acquire()
             try:
-                self.send_request(connection, routing_key, message, correlation_id)
-                if response_required:
-                    return self.listen_for_response(connection)
-            except:
-                log.exception('Error in AMQP RPC call')
-                if reraise_exceptions:
+                with dispatcher.io_lock:
+                    if correlation_id is not None:
+                        connection_manager.get_consumer(self.get_reply_to(),
+                                                        lambda: self.get_response_consumer(connection))
+                    self.send_request(connection, routing_key, message_body, correlation_id)
+                return connection
+            except connection.recoverable_connection_errors:
+                if not retry:
                     raise
+                log.warning('AMQP connection lost, reconnecting')
+                connection_manager.reset()
+
+    def prewarm(self, ping=False, routing_key=None):
+        """
+        Open and cache everything a call needs, so the first call of a warm
+        container only pays for the publish and the reply: the connection,
+        its channel, the send exchange with its producer and the consumer of
+        the reply queue (only declared for the shared reply mode, whose
+        consumer does not outlive a call).
+
+        :param ping:
+            If True, also send :py:attr:`ping_message` and wait for the reply.
+
+        :param routing_key:
+            Routing key of the ping, defaults to the class attribute.
+
+        :return:
+            A dictionary of the milliseconds of every step, i.e.
+            ``connect_ms``, and the ``error`` of the step which failed.
+
+        """
+        steps = {}
+
+        def step(name, function):
+            start = time.time()
+            result = function()
+            steps[name + '_ms'] = round((time.time() - start) * 1000, 3)
+            return result
+
+        try:
+            connection = step('connect', connection_manager.acquire)
+            with dispatcher.io_lock:
+                step('channel', lambda: connection.default_channel)
+                exchange = self.get_send_exchange(connection)
+                step('exchange', lambda: connection_manager.get_producer(
+                    exchange, lambda: self.get_publisher(connection, exchange)))
+                if self.reply_mode == REPLY_MODE_SHARED:
+                    step('reply_queue', lambda: connection_manager.maybe_declare(self.get_response_queue(connection)))
+                else:
+                    step('reply_queue', lambda: connection_manager.get_consumer(
+                        self.get_reply_to(), lambda: self.get_response_consumer(connection)))
+            if ping:
+                step('ping', lambda: self.request_reply(routing_key or self.send_routing_key, self.ping_message))
+        except Exception as err:
+            log.exception('Prewarming the {0} client failed'.format(self.service))
+            steps['error'] = str(err) or type(err).__name__
+        return steps
 
     def process_response(self, response):
         """
@@ -276,28 +963,226 @@ class RpcClient(object):
 
         status_code = response['_status'].get('code')
         if status_code != 'ok':
-            log.error('Bad status from {0}'.format(self.service), status_code=status_code)
+            log.error(fmt('Bad status from {0}: {1}', self.service, status_code))
             raise AmqpRpcError('{0} returned error code: {1}'.format(self.service, status_code))
 
         data = response.get('_response', {})
-        log.debug('Data from {0}'.format(self.service))
-        log.debug('Data: {0}'.format(data))
+        log.debug(fmt('Data from {0}: {1}', self.service, data))
         return data
 
 
+class RpcFuture(object):
+    """
+    The pending result of a call made with :py:meth:`RpcClient.call_async`.
+
+    """
+    def __init__(self, client, connection, correlation_id, deadline, message=None):
+        self.client = client
+        self.connection = connection
+        self.correlation_id = correlation_id
+        self.deadline = deadline
+        self.message = message
+        self._resolved = False
+        self._result = None
+        self._error = None
+
+    def __repr__(self):
+        return '<RpcFuture {0} {1}>'.format(self.client.service, 'done' if self.done() else 'pending')
+
+    def done(self):
+        """ Return True if the whole reply has arrived (or the call failed or timed out). """
+        return self._resolved or dispatcher.is_complete(self.correlation_id) or time.time() >= self.deadline
+
+    def resolve(self):
+        """ Process the reply which has arrived, or record the failure to get one. """
+        if self._resolved:
+            return
+        try:
+            self._result = self.client.merge_chunks(
+                self.client.read_chunks(self.connection, self.correlation_id, self.deadline), self.message)
+        except Exception as err:
+            log.warning('{0} call {1} failed: {2!r}'.format(self.client.service, self.correlation_id, err))
+            self._error = err
+        finally:
+            dispatcher.forget(self.correlation_id)
+            self._resolved = True
+
+    def exception(self):
+        """ Wait for the reply and return the error of the call, if any. """
+        self.resolve()
+        return self._error
+
+    def result(self):
+        """
+        Wait for the reply and return the processed result.
+
+        :raises:
+            Whatever the call failed with, i.e. :py:exc:`socket.timeout`,
+            :py:exc:`AmqpRpcError` or :py:exc:`ValidationError`.
+
+        """
+        self.resolve()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class InvalidationClient(RpcClient):
+    """
+    Announces changed entities on an exchange, so every container caching
+    them (see :py:func:`subscribe_invalidations`) drops its copies.
+
+    """
+    service = 'invalidation'
+    send_exchange_type = 'topic'
+
+    def __init__(self, exchange_name, entity, logger=None):
+        super(InvalidationClient, self).__init__(logger)
+        self.entity = entity
+        self.send_exchange_name = exchange_name
+        self.send_routing_key = INVALIDATION_ROUTING_KEY.format(entity)
+
+    def invalidate(self, entity_id):
+        """
+        Publish the invalidation for one entity. Errors are logged, not
+        raised, the write itself succeeded already.
+
+        """
+        log.debug('Invalidating {0} {1}'.format(self.entity, entity_id))
+        self.call(dict(entity=self.entity, entity_id=entity_id),
+                  response_required=False, reraise_exceptions=False)
+
+    def invalidate_many(self, entity_ids):
+        """
+        Publish the invalidations for several entities, i.e. of a bulk
+        write, in one message.
+
+        """
+        log.debug('Invalidating {0} {1}'.format(len(entity_ids), self.entity))
+        self.call(dict(entity=self.entity, entity_ids=list(entity_ids)),
+                  response_required=False, reraise_exceptions=False)
+
+
+def subscribe_invalidations(exchange_name, entity, callback):
+    """
+    Consume the invalidations for an entity on a private queue of this
+    container. They are processed whenever the connection is drained, i.e. by
+    :py:func:`poll` or while waiting for a reply.
+
+    :param exchange_name:
+        The exchange the invalidations are published to.
+
+    :param entity:
+        Name of the entity, as used by :py:class:`InvalidationClient`.
+
+    :param callback:
+        Called with the ID of every invalidated entity.
+
+    """
+    def on_message(message_body, message):
+        message.ack()
+        try:
+            if 'entity_ids' in message_body:
+                for entity_id in message_body['entity_ids']:
+                    callback(entity_id)
+            else:
+                callback(message_body['entity_id'])
+        except (KeyError, TypeError):
+            log.warning(fmt('Malformed invalidation: {0}', message_body))
+
+    connection = connection_manager.acquire()
+    name = '{0}.{1}'.format(INVALIDATION_ROUTING_KEY.format(entity), CONTAINER_ID)
+
+    def get_consumer():
+        from kombu import Consumer, Queue
+        exchange = get_exchange(connection, exchange_name, 'topic')
+        queue = Queue(name, exchange, INVALIDATION_ROUTING_KEY.format(entity), connection.default_channel,
+                      exclusive=True, auto_delete=True, durable=False)
+        return Consumer(connection, queue, callbacks=[on_message])
+
+    with dispatcher.io_lock:
+        connection_manager.get_consumer(name, get_consumer)
+
+
+def poll():
+    """
+    Process the events which arrived on the managed connection, without
+    waiting for more.
+
+    """
+    connection = connection_manager.acquire()
+    with dispatcher.io_lock:
+        while True:
+            try:
+                connection.drain_events(timeout=0)
+            except socket.timeout:
+                return
+
+
+def wait(futures, timeout=None):
+    """
+    Wait for several futures at once, draining the connection only once for
+    all of them. Calls which do not get their reply in time fail with
+    :py:exc:`socket.timeout`.
+
+    :param futures:
+        Iterable of :py:class:`RpcFuture` instances.
+
+    :param timeout:
+        Overall time to wait, defaults to the latest deadline of the futures.
+
+    """
+    pending = [f for f in futures if not f.done()]
+    if not pending:
+        return
+
+    deadline = max(f.deadline for f in pending)
+    if timeout is not None:
+        deadline = min(deadline, time.time() + timeout)
+        for future in pending:
+            future.deadline = min(future.deadline, deadline)
+    try:
+        with timer('wait'):
+            dispatcher.wait_for(pending[0].connection, [f.correlation_id for f in pending],
+                                deadline - time.time())
+    except socket.timeout:
+        # every future will now report its own timeout
+        pass
+
+
+def wait_all(futures, timeout=None):
+    """
+    Wait for several futures, see :py:func:`wait`.
+
+    :raises:
+        The error of the first failed call.
+
+    :return:
+        A list with the results, in the order of the futures.
+
+    """
+    futures = list(futures)
+    wait(futures, timeout)
+    return [f.result() for f in futures]
+
+
 def get_amqp_connection():
     """
     Create a Kombu Connection instance based on the application configuration.
+    Use :py:data:`connection_manager` to get the shared, connected instance.
 
     :return:
         The connection.
 
     """
+    from kombu import Connection
+    return Connection(hostname=config.AMQP_HOST, port=int(config.AMQP_PORT),
+                      userid=config.AMQP_USER, password=config.AMQP_PASS,
+                      virtual_host=config.AMQP_VHOST,
+                      heartbeat=int(config.AMQP_HEARTBEAT))
+
 
-    connection = Connection(hostname=config.AMQP_HOST, port=config.AMQP_PORT,
-                            userid=config.AMQP_USER, password=config.AMQP_PASS,
-                            virtual_host=config.AMQP_VHOST)
-    return connections[connection].acquire(block=True)
+connection_manager = ConnectionManager()
 
 
 def get_exchange(connection, exchange_name='', exchange_type='direct', **args):
@@ -325,6 +1210,7 @@ def get_exchange(connection, exchange_name='', exchange_type='direct', **args):
         The exchange.
 
     """
+    from kombu import Exchange
     return Exchange(exchange_name,
                     type=exchange_type,
                     connection=connection,
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative validation of the requests of the handlers. A handler declares
+the fields it accepts, and :py:func:`compile_schema` turns the declaration
+into a function specialized to it, once at import time::
+
+    REQUEST_SCHEMA = {
+        'modifier_id': Field(('string', 'integer'), required=True, blank=False, max_length=64),
+        'status': Field('string', enum=('open', 'closed')),
+    }
+    validate_request_params = compile_schema('delete_call', REQUEST_SCHEMA)
+
+The validator returns None for a valid request, else the message for the
+user, to be passed to ``get_error_message(BAD_REQUEST, message)``. Fields
+which are not declared are accepted, JSON null counts as missing.
+
+:py:func:`check` interprets a schema on every call, it gives the same
+results and is the reference the compiled validators are tested against.
+
+Query string parameters arrive as strings, :py:func:`coerce_integers` turns
+the numeric ones into integers ahead of the validation.
+
+"""
+import re
+
+KINDS = {
+    'string': (str, unicode),
+    'integer': (int, long),
+    'number': (int, long, float),
+    'boolean': (bool,),
+    'object': (dict,),
+    'array': (list,),
+}
+"JSON types by name, to the Python types of the parsed request."
+
+PREFIX = 'Parameter mismatch: '
+
+INTEGER = re.compile(r'\s*[-+]?\d+\s*$')
+"A string holding an integer, as query string parameters do."
+
+
+class Field(object):
+    """
+    Constraints of one request field.
+
+    :param kind: name of the JSON type, see :py:data:`KINDS`, or a tuple of them
+    :param required: the field has to be there, and not null
+    :param blank: strings of whitespace only are accepted
+    :param min_length: minimum length of a string or array
+    :param max_length: maximum length of a string or array
+    :param enum: accepted values
+    :param minimum: minimum of a number
+    :param maximum: maximum of a number
+    :param pattern: regular expression a string has to match, from its start
+    """
+    __slots__ = ('kinds', 'required', 'blank', 'min_length', 'max_length', 'enum', 'minimum', 'maximum',
+                 'pattern')
+
+    def __init__(self, kind, required=False, blank=True, min_length=None, max_length=None, enum=None,
+                 minimum=None, maximum=None, pattern=None):
+        self.kinds = (kind,) if isinstance(kind, basestring) else tuple(kind)
+        unknown = [name for name in self.kinds if name not in KINDS]
+        if unknown:
+            raise ValueError('unknown kind: {0}'.format(', '.join(unknown)))
+        self.required = required
+        self.blank = blank
+        self.min_length = min_length
+        self.max_length = max_length
+        self.enum = frozenset(enum) if enum is not None else None
+        self.minimum = minimum
+        self.maximum = maximum
+        self.pattern = re.compile(pattern) if isinstance(pattern, basestring) else pattern
+
+    @property
+    def types(self):
+        return tuple(t for name in self.kinds for t in KINDS[name])
+
+    @property
+    def excludes_bool(self):
+        """ bool is an int to Python, not an integer or number to JSON """
+        return 'boolean' not in self.kinds and ('integer' in self.kinds or 'number' in self.kinds)
+
+    def messages(self, name):
+        """ :return: dict of the error messages of the field by constraint """
+        field = "'{0}'".format(name)
+        return dict(
+            required=PREFIX + field + ' is required.',
+            kind=PREFIX + field + ' must be ' + ' or '.join(
+                ('an ' if kind in ('integer', 'object', 'array') else 'a ') + kind for kind in self.kinds) + '.',
+            blank=PREFIX + field + ' must not be blank.',
+            min_length=PREFIX + field + ' must have at least {0} {1}.'.format(
+                self.min_length, 'items' if self.kinds == ('array',) else 'characters'),
+            max_length=PREFIX + field + ' must have at most {0} {1}.'.format(
+                self.max_length, 'items' if self.kinds == ('array',) else 'characters'),
+            enum=PREFIX + field + ' must be one of {0}.'.format(', '.join(sorted(map(str, self.enum or ())))),
+            minimum=PREFIX + field + ' must be at least {0}.'.format(self.minimum),
+            maximum=PREFIX + field + ' must be at most {0}.'.format(self.maximum),
+            pattern=PREFIX + field + ' has an invalid format.',
+        )
+
+
+NOT_AN_OBJECT = PREFIX + 'request must be a JSON object.'
+
+
+def coerce_integers(request, names):
+    """
+    Convert the named fields of a request from numeric strings to integers,
+    other values are left for the validator to report.
+
+    :param names: of the integer fields which may be passed as strings
+    :return: the request, a copy if a field was converted
+    """
+    if not isinstance(request, dict):
+        return request
+    converted = dict((name, int(request[name])) for name in names
+                     if isinstance(request.get(name), basestring) and INTEGER.match(request[name]))
+    return dict(request, **converted) if converted else request
+
+
+def check(schema, request):
+    """
+    Validate a request by interpreting the schema.
+
+    :param schema: dict of field name to :py:class:`Field`
+    :return: None if valid, else the error message
+    """
+    if not isinstance(request, dict):
+        return NOT_AN_OBJECT
+    for name in sorted(schema):
+        failed = _check_field(schema[name], request.get(name))
+        if failed:
+            return schema[name].messages(name)[failed]
+    return None
+
+
+def _check_field(field, value):
+    """ :return: the constraint the value fails, None if it is valid """
+    if value is None:
+        return 'required' if field.required else None
+    if not isinstance(value, field.types) or (field.excludes_bool and isinstance(value, bool)):
+        return 'kind'
+    if isinstance(value, basestring):
+        if not field.blank and not value.strip():
+            return 'blank'
+        if field.pattern is not None and not field.pattern.match(value):
+            return 'pattern'
+    if isinstance(value, (basestring, list)):
+        if field.min_length is not None and len(value) < field.min_length:
+            return 'min_length'
+        if field.max_length is not None and len(value) > field.max_length:
+            return 'max_length'
+    if field.enum is not None and value not in field.enum:
+        return 'enum'
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        if field.minimum is not None and value < field.minimum:
+            return 'minimum'
+        if field.maximum is not None and value > field.maximum:
+            return 'maximum'
+    return None
+
+
+def _field_source(index, name, field, namespace):
+    """ :return: lines of the validator checking one field, without the indentation of the function body """
+    messages = field.messages(name)
+    types = field.types
+    strings = [t for t in types if issubclass(t, basestring)]
+    numbers = [t for t in types if t in (int, long, float)]
+    sized = [t for t in types if issubclass(t, (basestring, list))]
+    lines = ['value = get({0!r})'.format(name)]
+    if field.required:
+        lines += ['if value is None:', '    return {0!r}'.format(messages['required'])]
+        indent = ''
+    else:
+        lines += ['if value is not None:']
+        indent = '    '
+
+    def add(condition, message):
+        lines.append('{0}if {1}:'.format(indent, condition))
+        lines.append('{0}    return {1!r}'.format(indent, message))
+
+    namespace['types_{0}'.format(index)] = types
+    kind = 'not isinstance(value, types_{0})'.format(index)
+    if field.excludes_bool:
+        kind += ' or value.__class__ is bool'
+    add(kind, messages['kind'])
+
+    def guarded(condition, label, kinds):
+        """ the constraint only applies to some of the accepted types """
+        if len(kinds) == len(types):
+            return condition
+        namespace['{0}_{1}'.format(label, index)] = tuple(kinds)
+        return 'isinstance(value, {0}_{1}) and ({2})'.format(label, index, condition)
+
+    if strings and not field.blank:
+        add(guarded('not value.strip()', 'strings', strings), messages['blank'])
+    if strings and field.pattern is not None:
+        namespace['pattern_{0}'.format(index)] = field.pattern
+        add(guarded('not pattern_{0}.match(value)'.format(index), 'strings', strings), messages['pattern'])
+    if sized and field.min_length is not None:
+        add(guarded('len(value) < {0!r}'.format(field.min_length), 'sized', sized), messages['min_length'])
+    if sized and field.max_length is not None:
+        add(guarded('len(value) > {0!r}'.format(field.max_length), 'sized', sized), messages['max_length'])
+    if field.enum is not None:
+        namespace['enum_{0}'.format(index)] = field.enum
+        add('value not in enum_{0}'.format(index), messages['enum'])
+    if numbers and field.minimum is not None:
+        add(guarded('value < {0!r}'.format(field.minimum), 'numbers', numbers), messages['minimum'])
+    if numbers and field.maximum is not None:
+        add(guarded('value > {0!r}'.format(field.maximum), 'numbers', numbers), messages['maximum'])
+    return lines
+
+
+def compile_schema(name, schema):
+    """
+    Generate the source of a validator specialized to the schema and
+    compile it: no loop over the fields, no lookups of the constraints, the
+    messages are constants.
+
+    :param name: of the handler, for tracebacks
+    :param schema: dict of field name to :py:class:`Field`
+    :return: function taking the request, returning None if it is valid, else the error message
+    """
+    namespace = dict(NOT_AN_OBJECT=NOT_AN_OBJECT)
+    body = ['if request.__class__ is not dict and not isinstance(request, dict):',
+            '    return NOT_AN_OBJECT',
+            'get = request.get']
+    for index, field_name in enumerate(sorted(schema)):
+        body.extend(_field_source(index, field_name, schema[field_name], namespace))
+    body.append('return None')
+    source = 'def validate(request):\n' + ''.join('    {0}\n'.format(line) for line in body)
+    exec(compile(source, '<schema {0}>'.format(name), 'exec'), namespace)
+    validate = namespace['validate']
+    validate.__name__ = 'validate_{0}'.format(name)
+    validate.source = source
+    return validate
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from utils.cache import FRESH, MISS, STALE, ResponseCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFuture(object):
+
+    def __init__(self, value, error=None):
+        self.value = value
+        self.error = error
+
+    def done(self):
+        return True
+
+    def exception(self):
+        return self.error
+
+    def result(self):
+        return self.value
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(max_size=2, ttl=10, stale_ttl=20, ignore_keys=('skiplog',), clock=self.clock)
+
+    def test_key_is_canonical(self):
+        self.assertEqual(self.cache.make_key({'a': 1, 'b': 2}),
+                         self.cache.make_key({'b': 2, 'a': 1, 'skiplog': True}))
+
+    def test_ttl_and_stale_window(self):
+        self.cache.set('k', 'v')
+        self.assertEqual(('v', FRESH), self.cache.get('k'))
+        self.clock.now += 15
+        self.assertEqual(('v', STALE), self.cache.get('k'))
+        self.clock.now += 20
+        self.assertEqual((None, MISS), self.cache.get('k'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual((None, MISS), self.cache.get('b'))
+        self.assertEqual((1, FRESH), self.cache.get('a'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_invalidate_by_entity(self):
+        self.cache.set('a', 1, entity_id='x')
+        self.cache.set('b', 2, entity_id='x')
+        self.assertEqual(2, self.cache.invalidate('x'))
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.invalidate('x'))
+
+    def test_revalidate_once_and_collect(self):
+        self.cache.set('k', 'old', entity_id='x')
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return FakeFuture('new')
+
+        self.cache.revalidate('k', 'x', fetch)
+        self.cache.revalidate('k', 'x', fetch)
+        self.assertEqual(1, len(calls))
+        self.cache.collect()
+        self.assertEqual(('new', FRESH), self.cache.get('k'))
+        self.assertEqual(0, self.cache.stats()['revalidating'])
+
+    def test_fetch_runs_without_the_lock(self):
+        # invalidations arrive on another thread while the fetch publishes
+        self.cache.set('k', 'old', entity_id='x')
+        invalidated = []
+
+        def fetch():
+            thread = threading.Thread(target=lambda: invalidated.append(self.cache.invalidate('x')))
+            thread.start()
+            thread.join(1)
+            invalidated.append(thread.is_alive())
+            return FakeFuture('new')
+
+        self.cache.revalidate('k', 'x', fetch)
+        self.assertEqual([1, False], invalidated)
+        # the value fetched before the invalidation is not stored
+        self.cache.collect()
+        self.assertEqual((None, MISS), self.cache.get('k'))
+        self.assertEqual(0, self.cache.stats()['revalidating'])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import unittest
+
+from utils.coalesce import SingleFlight
+
+
+class SingleFlightTests(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def slow_call():
+            calls.append(1)
+            release.wait(1)
+            return {'value': 42}
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow_call, timeout=1)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.coalesced < 4:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([{'value': 42}] * 5, results)
+        self.assertFalse(flight.calls)
+
+    def test_waiter_deadline(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=lambda: flight.do('key', lambda: release.wait(1)))
+        leader.start()
+        while not flight.calls:
+            pass
+        self.assertRaises(socket.timeout, flight.do, 'key', lambda: None, 0.01)
+        release.set()
+        leader.join()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from utils import logs
+from utils.logs import Invocation, add_fields, fmt, log_invocation, shorten
+
+
+class Context(object):
+    aws_request_id = 'request-1'
+
+
+class ShortenTests(unittest.TestCase):
+
+    def test_small_values(self):
+        self.assertEqual('plain text', shorten('plain text'))
+        self.assertEqual('{"a": [1, 2.5, null, true]}', shorten({'a': [1, 2.5, None, True]}))
+
+    def test_large_values_are_cut(self):
+        self.assertEqual('x' * 10 + '...', shorten('x' * 100000, 10))
+        text = shorten({'stuff': [{'stuff_id': i} for i in range(100000)]}, 100)
+        self.assertEqual(103, len(text))
+        self.assertTrue(text.endswith('...'))
+
+    def test_credentials_are_redacted(self):
+        text = shorten({'authorizationToken': 'secret', 'nested': [{'auth-token': 'secret'}]})
+        self.assertNotIn('secret', text)
+
+    def test_lazy_message(self):
+        class Payload(object):
+            def __repr__(self):
+                raise AssertionError('formatted although not emitted')
+
+        message = fmt('got: {0}', Payload())
+        self.assertRaises(AssertionError, str, message)
+        self.assertEqual('got: \xc3\xa4 [1]', str(fmt(u'got: {0} {1}', u'\xe4', [1])))
+
+
+class LogInvocationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        patcher = mock.patch.object(Invocation, 'stream', self.stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_one_line_per_invocation(self):
+        @log_invocation('test_call')
+        def handler(request, context):
+            add_fields(stuff_id=request['stuff_id'])
+            return dict(success=True)
+
+        handler({'stuff_id': 'stuff-1', 'auth-token': 'secret'}, Context())
+        line, = self.lines()
+        self.assertEqual('test_call', line['handler'])
+        self.assertEqual('request-1', line['request_id'])
+        self.assertEqual('ok', line['status'])
+        self.assertEqual('stuff-1', line['stuff_id'])
+        self.assertNotIn('request', line)
+
+    def test_errors_are_always_logged(self):
+        @log_invocation('test_call', sample_rate=0)
+        def handler(request, context):
+            if request.get('fail'):
+                raise ValueError('400--Parameter mismatch')
+            return dict(success=True)
+
+        for request in [{}, {'skiplog': True}, {'fail': True}]:
+            try:
+                handler(request, Context())
+            except ValueError:
+                pass
+        line, = self.lines()
+        self.assertEqual('400', line['status'])
+        self.assertEqual('Parameter mismatch', line['error'])
+        self.assertEqual('{"fail": true}', line['request'])
+
+    def test_skiplog(self):
+        handler = log_invocation('test_call')(lambda request, context: None)
+        handler({'noop': True, 'skiplog': True}, Context())
+        self.assertEqual([], self.lines())
+
+    def test_max_size(self):
+        def handler(request, context):
+            raise ValueError('500--Error')
+
+        with mock.patch.dict(logs.settings, max_size=20):
+            self.assertRaises(ValueError, log_invocation('test_call')(handler), {'data': 'x' * 1000}, Context())
+        self.assertEqual(23, len(self.lines()[0]['request']))
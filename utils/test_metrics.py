@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from utils import logs, metrics
+from utils.metrics import Histogram, instrument, timer
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for value in range(1, 101):
+            histogram.record(float(value))
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(100, snapshot['count'])
+        self.assertEqual(50.5, snapshot['mean'])
+        self.assertEqual(100.0, snapshot['max'])
+        # accurate to a bucket, i.e. 20%
+        self.assertTrue(50 <= snapshot['p50'] <= 60, snapshot)
+        self.assertTrue(95 <= snapshot['p95'] <= 100, snapshot)
+        self.assertTrue(99 <= snapshot['p99'] <= 100, snapshot)
+
+
+class InstrumentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        patcher = mock.patch.object(metrics, 'stream', self.stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(metrics.reset)
+        metrics.reset()
+
+    def test_emf_line_per_invocation(self):
+        @instrument('test_call', namespace='test')
+        def handler(request, context):
+            for _ in range(2):
+                with timer('publish'):
+                    pass
+            with timer('wait'):
+                raise ValueError('400--timeout')
+
+        self.assertRaises(ValueError, handler, {}, None)
+        line = json.loads(self.stream.getvalue())
+        self.assertEqual('test_call', line['function'])
+        self.assertEqual(set(['publish', 'wait', 'total']), set(m['Name'] for m in
+                                                               line['_aws']['CloudWatchMetrics'][0]['Metrics']))
+        self.assertEqual([['function']], line['_aws']['CloudWatchMetrics'][0]['Dimensions'])
+        self.assertEqual(2, metrics.dump()['publish']['count'])
+
+    def test_metrics_join_the_summary_line(self):
+        @logs.log_invocation('test_call')
+        @instrument('test_call', namespace='test')
+        def handler(request, context):
+            with timer('publish'):
+                return dict(success=True)
+
+        summary = StringIO()
+        with mock.patch.object(logs.Invocation, 'stream', summary):
+            handler({}, None)
+            handler({'skiplog': True}, None)
+        self.assertEqual('', self.stream.getvalue())
+        line, = [json.loads(text) for text in summary.getvalue().splitlines()]
+        self.assertEqual(('test_call', 'ok'), (line['handler'], line['status']))
+        self.assertEqual(set(['publish', 'total']), set(m['Name'] for m in
+                                                        line['_aws']['CloudWatchMetrics'][0]['Metrics']))
+        self.assertIn('publish', line)
+
+    def test_metrics_are_sampled_with_the_summary_line(self):
+        @logs.log_invocation('test_call', sample_rate=0)
+        @instrument('test_call', namespace='test')
+        def handler(request, context):
+            if request.get('fail'):
+                raise ValueError('400--Parameter mismatch')
+            return dict(success=True)
+
+        summary = StringIO()
+        with mock.patch.object(logs.Invocation, 'stream', summary):
+            handler({}, None)
+            self.assertEqual('', summary.getvalue())
+            self.assertRaises(ValueError, handler, {'fail': True}, None)
+        self.assertEqual('', self.stream.getvalue())
+        line, = [json.loads(text) for text in summary.getvalue().splitlines()]
+        self.assertEqual('400', line['status'])
+        self.assertIn('_aws', line)
+
+    def test_noop_calls_are_not_timed(self):
+        instrument('test_call', namespace='test')(lambda request, context: None)({'noop': True}, None)
+        self.assertEqual('', self.stream.getvalue())
+        self.assertEqual({}, metrics.dump())
+
+    def test_no_namespace(self):
+        instrument('test_call')(lambda request, context: None)({}, None)
+        self.assertEqual('', self.stream.getvalue())
+        self.assertEqual(1, metrics.dump()['total']['count'])
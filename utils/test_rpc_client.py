@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import sys
+import threading
+import unittest
+
+from kombu import Connection, Consumer, Exchange, Producer, Queue
+from mock import patch
+
+# the rpc client reads the function configuration, borrow the one of get_call
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'get_call'))
+
+from utils import metrics, rpc_client, serialization  # noqa: E402
+
+
+class EchoClient(rpc_client.RpcClient):
+    service = 'echo'
+    response_routing_key = 'echo_response'
+    send_exchange_name = 'test_exchange'
+    send_routing_key = 'echo'
+
+
+class CoalescingEchoClient(EchoClient):
+    coalesce = True
+
+
+class MsgpackEchoClient(EchoClient):
+    codec = 'msgpack'
+
+
+class CompressingEchoClient(EchoClient):
+    compression = 'zlib'
+    compression_threshold = 100
+
+
+class FakeResponder(object):
+    """ Answers requests on the same connection, optionally with extra stray replies first. """
+
+    def __init__(self, connection, stray_replies=0, compression=None, chunks=None):
+        self.connection = connection
+        self.stray_replies = stray_replies
+        self.compression = compression
+        self.chunks = chunks
+        self.exchange = Exchange('test_exchange', type='topic')
+        self.queue = Queue('echo_requests', self.exchange, 'echo', channel=connection.default_channel)
+        self.consumer = Consumer(connection, self.queue, on_message=self.on_message)
+        self.consumer.consume()
+        # the memory broker outlives the connections, drop the requests lost by earlier tests
+        self.queue.purge()
+        self.requests = []
+        self.skip = set()
+
+    def on_message(self, message):
+        message.ack()
+        self.requests.append(dict(message.properties, content_type=message.content_type, headers=message.headers))
+        if len(self.requests) - 1 in self.skip:
+            return
+
+        codec = serialization.get_codec_for(message.content_type)
+        body = codec.decode(serialization.decompress(message.body, message.headers))
+        producer = Producer(self.connection, exchange=Exchange(''))
+        for i in range(self.stray_replies):
+            producer.publish(codec.encode({'_status': {'code': 'ok'}, '_response': 'stray'}),
+                             content_type=codec.content_type, content_encoding='binary',
+                             routing_key=message.properties['reply_to'],
+                             correlation_id='stray-{0}'.format(i))
+        if self.chunks is not None:
+            # the echoed request, once per chunk index of the list
+            for position, index in enumerate(self.chunks):
+                producer.publish(codec.encode({'_status': {'code': 'ok'}, '_response': dict(body, chunk=index)}),
+                                 headers={rpc_client.CHUNK_HEADER: index,
+                                          rpc_client.LAST_CHUNK_HEADER: position == len(self.chunks) - 1},
+                                 content_type=codec.content_type, content_encoding='binary',
+                                 routing_key=message.properties['reply_to'],
+                                 correlation_id=message.properties['correlation_id'])
+            return
+        reply, headers = serialization.compress(codec.encode({'_status': {'code': 'ok'}, '_response': body}),
+                                                self.compression)
+        producer.publish(reply, headers=headers,
+                         content_type=codec.content_type, content_encoding='binary',
+                         routing_key=message.properties['reply_to'],
+                         correlation_id=message.properties['correlation_id'])
+
+
+class RpcClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = Connection(transport='memory')
+        manager = rpc_client.ConnectionManager(lambda: self.connection)
+        patcher = patch.object(rpc_client, 'connection_manager', manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(manager.reset)
+
+    def test_exclusive_reply_queue_is_per_container(self):
+        responder = FakeResponder(self.connection)
+        self.assertEqual({'a': 1}, EchoClient().call({'a': 1}))
+        self.assertEqual('echo_response.{0}'.format(rpc_client.CONTAINER_ID),
+                         responder.requests[0]['reply_to'])
+
+    def test_unknown_replies_are_dropped_not_requeued(self):
+        FakeResponder(self.connection, stray_replies=3)
+        self.assertEqual({'a': 2}, EchoClient().call({'a': 2}))
+        self.assertFalse(rpc_client.dispatcher.waiting)
+        self.assertFalse(rpc_client.dispatcher.replies)
+
+    def test_connection_and_declarations_are_reused(self):
+        FakeResponder(self.connection)
+        client = EchoClient()
+        for i in range(3):
+            self.assertEqual({'i': i}, client.call({'i': i}))
+
+        stats = rpc_client.connection_manager.stats()
+        self.assertEqual(1, stats['connects'])
+        self.assertEqual(1, stats['pool_size'])
+        self.assertEqual(3, stats['acquires'])
+        self.assertEqual(2, stats['declared'])
+
+    def test_prewarm_opens_and_declares_ahead_of_the_first_call(self):
+        responder = FakeResponder(self.connection)
+        client = EchoClient()
+        steps = client.prewarm()
+        self.assertEqual(['channel_ms', 'connect_ms', 'exchange_ms', 'reply_queue_ms'], sorted(steps))
+        self.assertEqual({'a': 1}, client.call({'a': 1}))
+
+        stats = rpc_client.connection_manager.stats()
+        self.assertEqual((1, 2), (stats['connects'], stats['declared']))
+        self.assertEqual(1, len(responder.requests))
+
+    def test_prewarm_ping(self):
+        responder = FakeResponder(self.connection)
+        steps = EchoClient().prewarm(ping=True)
+        self.assertIn('ping_ms', steps)
+        self.assertNotIn('error', steps)
+        self.assertEqual('echo', responder.requests[0]['delivery_info']['routing_key'])
+
+    def test_prewarm_reports_the_error(self):
+        def refuse():
+            raise socket.error('connection refused')
+
+        with patch.object(rpc_client, 'connection_manager', rpc_client.ConnectionManager(refuse)):
+            steps = EchoClient().prewarm(ping=True)
+        self.assertEqual({'error': 'connection refused'}, steps)
+
+    def test_streamed_chunks(self):
+        FakeResponder(self.connection, chunks=[0, 1, 2])
+        self.assertEqual([{'a': 1, 'chunk': n} for n in range(3)], list(EchoClient().stream({'a': 1})))
+        self.assertFalse(rpc_client.dispatcher.waiting)
+        self.assertFalse(rpc_client.dispatcher.chunks)
+
+    def test_plain_reply_is_one_chunk(self):
+        FakeResponder(self.connection)
+        self.assertEqual([{'a': 1}], list(EchoClient().stream({'a': 1})))
+
+    def test_chunked_replies_to_calls_are_merged(self):
+        FakeResponder(self.connection, chunks=[0, 1])
+        client = EchoClient()
+        self.assertEqual([{'a': 1, 'chunk': 0}, {'a': 1, 'chunk': 1}], client.call({'a': 1}))
+        future = client.call_async({'b': 2})
+        self.assertEqual([{'b': 2, 'chunk': 0}, {'b': 2, 'chunk': 1}], future.result())
+        self.assertFalse(rpc_client.dispatcher.chunks)
+
+    def test_chunks_out_of_order(self):
+        FakeResponder(self.connection, chunks=[0, 2, 1])
+        chunks = EchoClient().stream({'a': 1})
+        self.assertEqual({'a': 1, 'chunk': 0}, next(chunks))
+        self.assertRaises(rpc_client.ValidationError, next, chunks)
+
+    def test_closed_stream_drops_the_rest(self):
+        responder = FakeResponder(self.connection, chunks=[0, 1, 2])
+        client = EchoClient()
+        chunks = client.stream({'a': 1})
+        next(chunks)
+        chunks.close()
+        responder.chunks = None
+        self.assertEqual({'b': 2}, client.call({'b': 2}))
+        self.assertFalse(rpc_client.dispatcher.chunks)
+
+    def test_async_calls_are_multiplexed(self):
+        responder = FakeResponder(self.connection)
+        client = EchoClient()
+
+        futures = [client.call_async({'n': n}) for n in range(5)]
+        self.assertEqual(0, len(responder.requests))
+        self.assertEqual([{'n': n} for n in range(5)], rpc_client.wait_all(futures))
+        self.assertEqual(5, len(responder.requests))
+
+    def test_publishes_wait_for_the_connection_io(self):
+        responder = FakeResponder(self.connection)
+        EchoClient().prewarm()
+        results = []
+        with rpc_client.dispatcher.io_lock:
+            # a client keeps the correlation ID of its call, so one per thread
+            threads = [threading.Thread(target=lambda n=n: results.append(EchoClient().call({'n': n})))
+                       for n in range(3)]
+            for thread in threads:
+                thread.start()
+            threads[0].join(0.05)
+            self.assertEqual([], responder.requests)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([{'n': n} for n in range(3)], sorted(results))
+
+    def test_async_call_timeout(self):
+        future = EchoClient().call_async({'lost': True}, timeout=0.01)
+        self.assertIsInstance(future.exception(), socket.timeout)
+        self.assertRaises(socket.timeout, future.result)
+
+    def test_call_many_keeps_order_and_per_item_errors(self):
+        responder = FakeResponder(self.connection)
+        responder.skip = set([2])
+        results = EchoClient().call_many([{'n': n} for n in range(4)], timeout=0.05)
+
+        self.assertEqual([{'n': 0}, {'n': 1}, None, {'n': 3}], [r.result for r in results])
+        self.assertEqual([None, None], [r.error for r in results][:2])
+        self.assertIsInstance(results[2].error, socket.timeout)
+
+    def test_invalidations_reach_subscribers(self):
+        invalidated = []
+        rpc_client.subscribe_invalidations('test_exchange', 'stuff', invalidated.append)
+        rpc_client.InvalidationClient('test_exchange', 'stuff').invalidate('id-1')
+        rpc_client.poll()
+        self.assertEqual(['id-1'], invalidated)
+
+    def test_bulk_invalidation_is_one_message(self):
+        invalidated = []
+        rpc_client.subscribe_invalidations('test_exchange', 'stuff', invalidated.append)
+        rpc_client.InvalidationClient('test_exchange', 'stuff').invalidate_many(['id-1', 'id-2'])
+        rpc_client.poll()
+        self.assertEqual(['id-1', 'id-2'], invalidated)
+
+    def test_identical_async_calls_are_coalesced(self):
+        responder = FakeResponder(self.connection)
+        client = CoalescingEchoClient()
+        futures = [client.call_async({'id': 1}), client.call_async({'id': 1}), client.call_async({'id': 2})]
+        self.assertIs(futures[0], futures[1])
+        self.assertEqual([{'id': 1}, {'id': 1}, {'id': 2}], rpc_client.wait_all(futures))
+        self.assertEqual(2, len(responder.requests))
+
+    @unittest.skipIf(serialization.msgpack is None, 'msgpack not installed')
+    def test_msgpack_codec(self):
+        responder = FakeResponder(self.connection)
+        self.assertEqual({'data': [1, 2.5, u'\xe4']}, MsgpackEchoClient().call({'data': [1, 2.5, u'\xe4']}))
+        self.assertEqual('application/x-msgpack', responder.requests[0]['content_type'])
+
+    def test_compression_above_threshold(self):
+        responder = FakeResponder(self.connection, compression='bz2')
+        client = CompressingEchoClient()
+        self.assertEqual({'small': 1}, client.call({'small': 1}))
+        self.assertEqual({'large': 'x' * 1000}, client.call({'large': 'x' * 1000}))
+
+        self.assertNotIn('content-encoding', responder.requests[0]['headers'])
+        self.assertEqual('zlib', responder.requests[1]['headers']['content-encoding'])
+        self.assertEqual('bz2,zlib', responder.requests[1]['headers']['accept-encoding'])
+
+    def test_call_phases_are_timed(self):
+        FakeResponder(self.connection)
+        with patch.dict(metrics.histograms, clear=True):
+            EchoClient().call({'id': 1})
+            phases = metrics.dump()
+        for phase in ['acquire', 'declare', 'encode', 'publish', 'wait', 'decode', 'process_response']:
+            self.assertIn(phase, phases)
+
+
+class ConnectionManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.responders = []
+        self.manager = rpc_client.ConnectionManager(self.connect)
+        patcher = patch.object(rpc_client, 'connection_manager', self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.manager.reset)
+
+    def connect(self):
+        connection = Connection(transport='memory')
+        self.responders.append(FakeResponder(connection))
+        return connection
+
+    def break_publishing(self, connection):
+        error = connection.recoverable_connection_errors[0]('connection reset')
+        patcher = patch.object(connection.default_channel, 'basic_publish', side_effect=error)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_closed_connection_is_replaced(self):
+        client = EchoClient()
+        self.assertEqual({'a': 1}, client.call({'a': 1}))
+        self.manager.connection.close()
+
+        self.assertEqual({'a': 2}, client.call({'a': 2}))
+        self.assertEqual(2, self.manager.stats()['connects'])
+        self.assertEqual([1, 1], [len(responder.requests) for responder in self.responders])
+
+    def test_publish_on_a_dead_connection_is_retried_once(self):
+        client = EchoClient()
+        self.assertEqual({'a': 1}, client.call({'a': 1}))
+        self.break_publishing(self.manager.connection)
+
+        with patch.object(rpc_client, 'log') as log:
+            self.assertEqual({'a': 2}, client.call({'a': 2}))
+        log.warning.assert_called_once_with('AMQP connection lost, reconnecting')
+        self.assertEqual(2, self.manager.stats()['connects'])
+        self.assertEqual([1, 1], [len(responder.requests) for responder in self.responders])
+
+    def test_failed_retry_raises(self):
+        connect = self.connect
+
+        def connect_broken():
+            connection = connect()
+            self.break_publishing(connection)
+            return connection
+
+        self.manager.connection_factory = connect_broken
+        error = Connection(transport='memory').recoverable_connection_errors[0]
+        self.assertRaises(error, EchoClient().call, {'a': 1})
+        self.assertEqual(2, self.manager.stats()['connects'])
+        self.assertFalse(rpc_client.dispatcher.waiting)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from utils.schema import NOT_AN_OBJECT, Field, check, coerce_integers, compile_schema
+
+SCHEMA = {
+    'modifier_id': Field(('string', 'integer'), required=True, blank=False, max_length=8),
+    'status': Field('string', enum=('open', 'closed')),
+    'count': Field('integer', minimum=1, maximum=100),
+    'score': Field('number', maximum=1.5),
+    'tags': Field('array', min_length=1, max_length=3),
+    'code': Field('string', pattern=r'[A-Z]{3}$'),
+    'active': Field('boolean'),
+    'owner': Field('object'),
+}
+
+
+class SchemaTests(unittest.TestCase):
+
+    def setUp(self):
+        self.validate = compile_schema('test', SCHEMA)
+
+    def test_valid(self):
+        self.assertIsNone(self.validate({'modifier_id': 'user-1'}))
+        self.assertIsNone(self.validate({'modifier_id': 12, 'status': 'open', 'count': 100, 'score': 1.5,
+                                         'tags': ['a'], 'code': 'ABC', 'active': False, 'owner': {},
+                                         'other': 'not declared'}))
+
+    def test_required(self):
+        self.assertEqual("Parameter mismatch: 'modifier_id' is required.", self.validate({}))
+        self.assertEqual("Parameter mismatch: 'modifier_id' is required.", self.validate({'modifier_id': None}))
+
+    def test_not_an_object(self):
+        for request in ([], 'text', 1, None):
+            self.assertEqual(NOT_AN_OBJECT, self.validate(request))
+
+    def test_kinds(self):
+        self.assertEqual("Parameter mismatch: 'modifier_id' must be a string or an integer.",
+                         self.validate({'modifier_id': 1.5}))
+        # bool is an int to Python, not to JSON
+        self.assertEqual("Parameter mismatch: 'count' must be an integer.",
+                         self.validate({'modifier_id': 'a', 'count': True}))
+        self.assertIsNone(self.validate({'modifier_id': 'a', 'score': 1}))
+
+    def test_constraints(self):
+        cases = [
+            ({'modifier_id': '  '}, "'modifier_id' must not be blank."),
+            ({'modifier_id': 'way-too-long'}, "'modifier_id' must have at most 8 characters."),
+            ({'modifier_id': 'a', 'status': 'gone'}, "'status' must be one of closed, open."),
+            ({'modifier_id': 'a', 'count': 0}, "'count' must be at least 1."),
+            ({'modifier_id': 'a', 'score': 2}, "'score' must be at most 1.5."),
+            ({'modifier_id': 'a', 'tags': []}, "'tags' must have at least 1 items."),
+            ({'modifier_id': 'a', 'code': 'ABCD'}, "'code' has an invalid format."),
+        ]
+        for request, message in cases:
+            self.assertEqual('Parameter mismatch: ' + message, self.validate(request))
+
+    def test_length_applies_to_strings_only(self):
+        self.assertIsNone(self.validate({'modifier_id': 123456789}))
+
+    def test_same_results_as_interpreted(self):
+        rng = random.Random(7)
+        values = [None, True, 0, 1, 50, 101, 1.2, 3.5, '', ' ', 'user-1', 'way-too-long', 'ABC', 'abc', 'open',
+                  u'closed', [], ['a'], ['a', 'b', 'c', 'd'], {}, {'a': 1}]
+        for _ in range(2000):
+            request = dict((name, rng.choice(values)) for name in SCHEMA if rng.random() < 0.5)
+            self.assertEqual(check(SCHEMA, request), self.validate(request), request)
+
+    def test_coerce_integers(self):
+        request = {'modifier_id': 'a', 'count': u' 10 '}
+        self.assertEqual({'modifier_id': 'a', 'count': 10}, coerce_integers(request, ('count', 'score')))
+        self.assertEqual(u' 10 ', request['count'])
+        for count in ('ten', '1.5', '', 10, None):
+            unchanged = dict(request, count=count)
+            self.assertIs(unchanged, coerce_integers(unchanged, ('count',)))
+        self.assertEqual("Parameter mismatch: 'count' must be an integer.",
+                         self.validate(coerce_integers({'modifier_id': 'a', 'count': '1.5'}, ('count',))))
+        self.assertEqual(['not', 'a', 'dict'], coerce_integers(['not', 'a', 'dict'], ('count',)))
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, Field, 'date')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import json
+import time
 import unittest
+from StringIO import StringIO
 
 from httplib import BAD_REQUEST, INTERNAL_SERVER_ERROR
+from mock import call, patch
 
-from utils import get_error_message
+import utils
+from delete_call import lambda_function as delete_call
+from patch_call import lambda_function as patch_call
+from post_call import lambda_function as post_call
+from put_call import lambda_function as put_call
+from utils import bulk_write, get_error_message, logs, metrics, once, validate_batch
+from utils.schema import NOT_AN_OBJECT
 
 
 class UtilsTests(unittest.TestCase):
@@ -16,3 +26,113 @@ class UtilsTests(unittest.TestCase):
     def test_get_error_message_additional_args(self):
         correct = '400--some message--more information'
         self.assertEqual(correct, get_error_message(BAD_REQUEST, 'some message', 'more information'))
+
+    def test_status_codes_match_httplib(self):
+        self.assertEqual((BAD_REQUEST, INTERNAL_SERVER_ERROR), (utils.BAD_REQUEST, utils.INTERNAL_SERVER_ERROR))
+
+    def test_once_runs_setup_on_first_use_only(self):
+        calls = []
+
+        @once
+        def client():
+            calls.append(1)
+            return object()
+
+        self.assertEqual([], calls)
+        self.assertIs(client(), client())
+        self.assertEqual(1, len(calls))
+
+        client.reset()
+        client()
+        self.assertEqual(2, len(calls))
+
+    def test_noop_response_reports_the_container(self):
+        response = utils.noop_response({'noop': True}, None)
+        self.assertTrue(response['success'])
+        self.assertEqual(utils.CONTAINER_ID, response['container_id'])
+        self.assertEqual(32, len(utils.CONTAINER_ID))
+
+    def test_noop_response_holds_the_container(self):
+        start = time.time()
+        utils.noop_response({'noop': True, 'hold_ms': 30}, None)
+        self.assertGreaterEqual(time.time() - start, 0.025)
+
+    def test_validate_batch_reports_every_item(self):
+        def validate(item):
+            return None if item.get('stuff_id') else 'stuff_id is required.'
+
+        error, results = validate_batch(validate, [{'stuff_id': 'a'}, {}, {'stuff_id': 'c'}], 3)
+        self.assertIsNone(error)
+        self.assertEqual([True, False, True], [result['success'] for result in results])
+        self.assertEqual('400--stuff_id is required.', results[1]['message'])
+        self.assertEqual([0, 1, 2], [result['index'] for result in results])
+
+    def test_validate_batch_size(self):
+        self.assertEqual(('Empty batch.', None), validate_batch(lambda item: None, [], 3))
+        self.assertEqual(('Batch of 4 items, at most 3 allowed.', None), validate_batch(lambda item: None, [{}] * 4, 3))
+
+    def test_bulk_write_without_invalidations(self):
+        error, response = bulk_write([{'stuff_id': 'a'}, 'text'], lambda item: None if item != 'text' else 'bad', 2)
+        self.assertIsNone(error)
+        self.assertEqual([True, False], [result['success'] for result in response['results']])
+        self.assertEqual(('Empty batch.', None), bulk_write([], lambda item: None, 2))
+
+    def test_bulk_write_invalidates_the_valid_items_at_once(self):
+        def validate(item):
+            return None if item.get('stuff_id') else 'stuff_id is required.'
+
+        with patch.object(utils, 'invalidation_client') as client:
+            error, response = bulk_write([{'stuff_id': 'a'}, {}, {'stuff_id': 'c'}], validate, 3, 'exchange')
+            self.assertEqual(('Batch of 4 items, at most 3 allowed.', None),
+                             bulk_write([{'stuff_id': 'a'}] * 4, validate, 3, 'exchange'))
+        self.assertIsNone(error)
+        self.assertFalse(response['success'])
+        self.assertEqual([call('exchange', 'stuff'), call().invalidate_many(['a', 'c'])], client.mock_calls)
+
+
+class WriteHandlerTests(unittest.TestCase):
+    """ The batches of every write handler go through bulk_write. """
+
+    HANDLERS = [
+        (post_call, post_call.add_something_handler, post_call.PostCallException),
+        (put_call, put_call.update_entry_handler, put_call.PutCallException),
+        (patch_call, patch_call.patch_handler, patch_call.PatchCallException),
+        (delete_call, delete_call.delete_handler, delete_call.DeleteCallException),
+    ]
+    "Module, handler and exception of the write functions."
+
+    def setUp(self):
+        for patcher in [patch.object(logs.Invocation, 'stream', StringIO()),
+                        patch.object(metrics, 'stream', StringIO())]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(utils, 'invalidation_client')
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batches(self):
+        items = [{'stuff_id': 'a', 'modifier_id': 1}, {'stuff_id': '', 'modifier_id': 1},
+                 {'stuff_id': 'c', 'modifier_id': 'user-1'}]
+        for module, handler, _ in self.HANDLERS:
+            self.client.reset_mock()
+            response = handler(items, None)
+            self.assertEqual([True, False, True], [result['success'] for result in response['results']])
+            self.assertEqual("400--Parameter mismatch: 'stuff_id' must not be blank.",
+                             response['results'][1]['message'])
+            # post creates stuff, there is nothing cached to invalidate
+            if module is post_call:
+                self.assertEqual([], self.client.mock_calls)
+            else:
+                self.assertEqual([call(module.AMQP_EXCHANGE, 'stuff'), call().invalidate_many(['a', 'c'])],
+                                 self.client.mock_calls, module.__name__)
+
+            for body in (['noop'], json.dumps(['noop'])):
+                self.assertEqual('400--' + NOT_AN_OBJECT, handler(body, None)['results'][0]['message'])
+
+    def test_batch_size(self):
+        for module, handler, exception in self.HANDLERS:
+            for items in ([], [{'stuff_id': 'a', 'modifier_id': 1}] * (int(module.BATCH_MAX_SIZE) + 1)):
+                with self.assertRaises(exception) as raised:
+                    handler(items, None)
+                self.assertTrue(str(raised.exception).startswith('400--'), module.__name__)
+        self.assertEqual([], self.client.mock_calls)